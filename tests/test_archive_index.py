@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Test suite for the backup archive index (<backup>.idx).
+Verifies that streaming backups write an index of gzip member / zstd frame checkpoints
+and tar members, that config.php and single folders are read by seeking straight to
+them, that exact and prefix lookups bisect a sorted name table, and that older
+archives get the same index built lazily on verification.
+"""
+
+import os
+import sys
+import io
+import shutil
+import tarfile
+import tempfile
+import subprocess
+
+# Import the module using importlib to handle the dash in filename
+import importlib.util
+spec = importlib.util.spec_from_file_location(
+    "nextcloud_restore",
+    os.path.join(os.path.dirname(__file__), "../src/nextcloud_restore_and_backup-v9.py")
+)
+nextcloud_restore = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(nextcloud_restore)
+
+ZSTD_AVAILABLE = nextcloud_restore.is_zstd_available()
+
+
+def create_fake_nextcloud_root(users=("alice", "bob"), files_per_user=20, file_size=300 * 1024):
+    """Create a directory that looks like /var/www/html inside a container."""
+    root = tempfile.mkdtemp(prefix="fake_html_")
+    os.makedirs(os.path.join(root, "config"))
+    with open(os.path.join(root, "config", "config.php"), "w") as f:
+        f.write("<?php\n$CONFIG = array (\n  'dbtype' => 'sqlite',\n);\n")
+    for user in users:
+        # A long directory name exercises tar's extended headers
+        folder = os.path.join(root, "data", user, "files", "Photos " + "x" * 110)
+        os.makedirs(folder)
+        for i in range(files_per_user):
+            with open(os.path.join(folder, f"img_{i}.jpg"), "wb") as f:
+                f.write(os.urandom(file_size))
+    return root
+
+
+def write_streamed_backup(root, archive_path, folders=("data", "config"), archive_format='gz'):
+    """Run stream_backup_archive against a local directory instead of a container."""
+    original = nextcloud_restore.open_container_tar_stream
+    nextcloud_restore.open_container_tar_stream = lambda c, folders, base_path: subprocess.Popen(
+        ['tar', '-c', '-C', root] + list(folders), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        nextcloud_restore.stream_backup_archive("nextcloud-app", list(folders), archive_path,
+                                                archive_format=archive_format)
+    finally:
+        nextcloud_restore.open_container_tar_stream = original
+
+
+def read_tree(directory):
+    """Map of relative path -> file contents under directory."""
+    tree = {}
+    for dirpath, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(dirpath, name)
+            with open(path, 'rb') as f:
+                tree[os.path.relpath(path, directory)] = f.read()
+    return tree
+
+
+def test_index_written_with_backup():
+    """A streamed backup gets an index whose member table matches the archive."""
+    print("\nTesting index written alongside the backup...")
+    root = create_fake_nextcloud_root()
+    out_dir = tempfile.mkdtemp(prefix="archive_index_write_")
+    try:
+        archive_path = os.path.join(out_dir, "nextcloud-backup-test.tar.gz")
+        write_streamed_backup(root, archive_path)
+        index = nextcloud_restore.load_archive_index(archive_path)
+        assert index is not None, "No index written"
+        assert len(index.checkpoints) > 1, index.checkpoints
+
+        with tarfile.open(archive_path, 'r:gz') as tar:
+            expected = [(m.name, m.offset) for m in tar.getmembers()]
+        assert [(name, offset) for name, offset, _ in index.members()] == expected
+        print(f"  ✓ {index.member_count} members, {len(index.checkpoints)} checkpoints")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+
+def test_config_php_read_by_seeking():
+    """With an index, config.php at the end of the archive is read without a pass from the start."""
+    print("\nTesting config.php lookup through the index...")
+    root = create_fake_nextcloud_root()
+    out_dir = tempfile.mkdtemp(prefix="archive_index_config_")
+    original = nextcloud_restore.open_decompressed_archive_stream
+    try:
+        archive_path = os.path.join(out_dir, "nextcloud-backup-test.tar.gz")
+        write_streamed_backup(root, archive_path)
+
+        def no_full_pass(fileobj):
+            raise AssertionError("archive was decompressed from the start")
+        nextcloud_restore.open_decompressed_archive_stream = no_full_pass
+        config_path = nextcloud_restore.extract_config_php_only(archive_path, os.path.join(out_dir, "cfg"))
+        assert config_path and config_path.endswith(os.path.join("config", "config.php"))
+        print("  ✓ config.php extracted from its checkpoint")
+    finally:
+        nextcloud_restore.open_decompressed_archive_stream = original
+        shutil.rmtree(root, ignore_errors=True)
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+
+def test_extract_single_user_folder():
+    """Extracting one user's folder gives the same files with and without the index."""
+    print("\nTesting single-folder extraction...")
+    root = create_fake_nextcloud_root()
+    out_dir = tempfile.mkdtemp(prefix="archive_index_user_")
+    try:
+        archive_path = os.path.join(out_dir, "nextcloud-backup-test.tar.gz")
+        write_streamed_backup(root, archive_path)
+
+        with_index = os.path.join(out_dir, "with_index")
+        count = nextcloud_restore.extract_archive_paths(archive_path, with_index, ["data/bob"])
+        os.remove(nextcloud_restore.get_archive_index_path(archive_path))
+        without_index = os.path.join(out_dir, "without_index")
+        assert nextcloud_restore.extract_archive_paths(archive_path, without_index, ["data/bob/"]) == count
+
+        tree = read_tree(with_index)
+        assert tree == read_tree(without_index)
+        assert len(tree) == 20 and all(path.startswith(os.path.join("data", "bob")) for path in tree)
+        assert tree == {path: data for path, data in read_tree(root).items()
+                        if path.startswith(os.path.join("data", "bob"))}
+        print(f"  ✓ {count} members of data/bob extracted")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+
+def test_exact_and_prefix_lookups():
+    """find_member and find_paths match a full scan; the member table is read once."""
+    print("\nTesting sorted index lookups...")
+    root = create_fake_nextcloud_root(users=("bob", "bob-old", "bobby"), files_per_user=5, file_size=1024)
+    out_dir = tempfile.mkdtemp(prefix="archive_index_lookup_")
+    try:
+        archive_path = os.path.join(out_dir, "nextcloud-backup-test.tar.gz")
+        write_streamed_backup(root, archive_path)
+        index = nextcloud_restore.load_archive_index(archive_path)
+        members = list(index.members())
+        reads = []
+        original_members = index.members
+        index.members = lambda: reads.append(1) or original_members()
+
+        config = index.find_member("config/config.php")
+        assert config is not None and config == next(m for m in members if m[0] == "config/config.php")
+        assert index.find_member("config/missing.php") is None
+        assert index.find_member("config/") == next(m for m in members if m[0] == "config")
+        for paths in (["data/bob"], ["data/bob", "data/bobby"], ["config", "data/bob-old/files"], ["nothing"]):
+            expected = [m for m in members if nextcloud_restore._member_in_paths(m[0], paths)]
+            assert index.find_paths(paths) == expected, paths
+        assert len(index.find_paths(["data/bob"])) == 1 + 1 + 1 + 5, "bob, files, Photos folder and 5 files"
+        assert len(reads) == 1, f"member table read {len(reads)} times"
+        print(f"  ✓ {len(members)} members, 6 lookups from one read of the table")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+
+def test_lazy_index_for_existing_archives():
+    """Archives without an index get one on verification; a stale index is ignored."""
+    print("\nTesting lazily built index...")
+    root = create_fake_nextcloud_root(files_per_user=5)
+    out_dir = tempfile.mkdtemp(prefix="archive_index_lazy_")
+    try:
+        # Single-member gzip as written by older versions (shutil.make_archive)
+        legacy_path = os.path.join(out_dir, "nextcloud-backup-legacy.tar.gz")
+        with tarfile.open(legacy_path, 'w:gz') as tar:
+            tar.add(os.path.join(root, "config"), arcname="config")
+            tar.add(os.path.join(root, "data"), arcname="data")
+        status, details = nextcloud_restore.verify_backup_integrity(legacy_path)
+        assert status == 'success', details
+        index = nextcloud_restore.load_archive_index(legacy_path)
+        assert index is not None and index.checkpoints == [[0, 0]]
+        with tarfile.open(legacy_path, 'r:gz') as tar:
+            assert [name for name, _, _ in index.members()] == tar.getnames()
+
+        # Multi-member archive: the lazily built index matches the one written with it
+        streamed_path = os.path.join(out_dir, "nextcloud-backup-streamed.tar.gz")
+        write_streamed_backup(root, streamed_path)
+        index_path = nextcloud_restore.get_archive_index_path(streamed_path)
+        written = nextcloud_restore.load_archive_index(streamed_path)
+        written_members, written_checkpoints = list(written.members()), written.checkpoints
+        os.remove(index_path)
+        rebuilt = nextcloud_restore.build_archive_index(streamed_path)
+        assert list(rebuilt.members()) == written_members
+        assert rebuilt.checkpoints == written_checkpoints
+
+        with open(streamed_path, 'ab') as f:
+            f.write(b'\0' * 10)
+        assert nextcloud_restore.load_archive_index(streamed_path) is None, "Stale index should be ignored"
+        print("  ✓ Legacy and streamed archives indexed on first full read")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+
+def test_zstd_archive_index():
+    """The index works for .tar.zst frames too."""
+    print("\nTesting .tar.zst index...")
+    if not ZSTD_AVAILABLE:
+        print("  - Skipped: zstandard module not installed")
+        return
+    root = create_fake_nextcloud_root(files_per_user=30)
+    out_dir = tempfile.mkdtemp(prefix="archive_index_zstd_")
+    try:
+        archive_path = os.path.join(out_dir, "nextcloud-backup-test.tar.zst")
+        write_streamed_backup(root, archive_path, archive_format='zst')
+        index = nextcloud_restore.load_archive_index(archive_path)
+        assert index.archive_format == 'zst' and len(index.checkpoints) > 1
+        extract_to = os.path.join(out_dir, "alice")
+        nextcloud_restore.extract_archive_paths(archive_path, extract_to, ["data/alice"])
+        assert len(read_tree(extract_to)) == 30
+        config_path = nextcloud_restore.extract_config_php_only(archive_path, os.path.join(out_dir, "cfg"))
+        assert config_path
+        print(f"  ✓ {len(index.checkpoints)} zstd checkpoints")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_index_written_with_backup()
+    test_config_php_read_by_seeking()
+    test_extract_single_user_folder()
+    test_exact_and_prefix_lookups()
+    test_lazy_index_for_existing_archives()
+    test_zstd_archive_index()
+    print("\n✅ All archive index tests passed")
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Test suite for the backup catalog.
+Verifies that backup archives are recorded in the history database and the directory
+is only listed again when its mtime changes, that the history is reconciled with the
+disk both ways (records of deleted files removed, unrecorded archives added, renamed
+files followed by inode), and that the latest-backup lookup, scheduled-backup check
+and rotation are served from the catalog.
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+# Import the module using importlib to handle the dash in filename
+import importlib.util
+spec = importlib.util.spec_from_file_location(
+    "nextcloud_restore",
+    os.path.join(os.path.dirname(__file__), "../src/nextcloud_restore_and_backup-v9.py")
+)
+nextcloud_restore = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(nextcloud_restore)
+
+DAY = 86400
+
+
+def write_backup(directory, name, age_days, size=100):
+    path = os.path.join(directory, name)
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+    mtime = time.time() - age_days * DAY
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def settle(directory, age_days):
+    """Give the directory an mtime old enough for its scan to be trusted."""
+    mtime = time.time() - age_days * DAY
+    os.utime(directory, (mtime, mtime))
+
+
+class CountingScandir:
+    def __enter__(self):
+        self.calls = 0
+        self.original = os.scandir
+
+        def scandir(path='.'):
+            self.calls += 1
+            return self.original(path)
+        os.scandir = scandir
+        return self
+
+    def __exit__(self, *exc):
+        os.scandir = self.original
+
+
+def test_rescans_only_when_directory_changes():
+    """Repeated lookups list the directory once; a change to it triggers one rescan."""
+    print("\nTesting rescan on directory mtime...")
+    work_dir = tempfile.mkdtemp(prefix="backup_catalog_")
+    backup_dir = os.path.join(work_dir, "backups")
+    os.mkdir(backup_dir)
+    try:
+        history = nextcloud_restore.BackupHistoryManager(db_path=os.path.join(work_dir, "history.db"))
+        catalog = nextcloud_restore.BackupCatalog(history)
+        for day in range(5):
+            write_backup(backup_dir, f"nextcloud-backup-2026010{day + 1}_000000.tar.gz", age_days=10 - day)
+        write_backup(backup_dir, "test_backup_probe.tar.gz", age_days=0)
+        write_backup(backup_dir, "notes.txt", age_days=0)
+        settle(backup_dir, 3)
+
+        with CountingScandir() as scans:
+            for _ in range(5):
+                latest = nextcloud_restore.get_last_backup_info(backup_dir, catalog=catalog)
+            assert latest['name'] == "nextcloud-backup-20260105_000000.tar.gz", latest
+            assert latest['size'] == 100 and 5.9 < latest['age_hours'] / 24 < 6.1
+            assert scans.calls == 1, f"{scans.calls} scans"
+
+            write_backup(backup_dir, "nextcloud-backup-20260106_000000.tar.zst", age_days=1)
+            settle(backup_dir, 2)
+            assert [f['name'] for f in catalog.files(backup_dir)][:3] == ["test_backup_probe.tar.gz",
+                "nextcloud-backup-20260106_000000.tar.zst", "nextcloud-backup-20260105_000000.tar.gz"]
+            catalog.files(backup_dir)
+            assert scans.calls == 2, f"{scans.calls} scans"
+
+            # Just modified: the mtime may not move for a change in the same tick, so no caching yet
+            write_backup(backup_dir, "nextcloud-backup-20260107_000000.tar.gz", age_days=0)
+            catalog.files(backup_dir)
+            catalog.files(backup_dir)
+            assert scans.calls == 4, f"{scans.calls} scans"
+
+        shutil.rmtree(backup_dir)
+        assert catalog.files(backup_dir) == []
+        assert nextcloud_restore.get_last_backup_info(backup_dir, catalog=catalog) is None
+        history.close()
+        print("  ✓ 7 lookups from 2 scans of a settled directory")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def test_history_reconciled_both_ways():
+    """Deleted files lose their records, renamed ones keep them, new archives gain one."""
+    print("\nTesting history reconciliation...")
+    work_dir = tempfile.mkdtemp(prefix="backup_catalog_")
+    backup_dir = os.path.join(work_dir, "backups")
+    os.mkdir(backup_dir)
+    try:
+        history = nextcloud_restore.BackupHistoryManager(db_path=os.path.join(work_dir, "history.db"))
+        catalog = nextcloud_restore.BackupCatalog(history)
+        paths = [write_backup(backup_dir, f"nextcloud-backup-2026020{i}_000000.tar.gz", age_days=9 - i, size=100 + i)
+                 for i in range(1, 5)]
+        ids = [history.add_backup(path, database_type="pgsql") for path in paths]
+        settle(backup_dir, 5)
+        catalog.files(backup_dir)
+
+        os.remove(paths[0])
+        renamed = os.path.join(backup_dir, "nextcloud-backup-moved.tar.gz")
+        os.rename(paths[1], renamed)
+        copied = write_backup(backup_dir, "nextcloud-backup-20260209_000000.tar.zst.gpg", age_days=1, size=512)
+        settle(backup_dir, 4)
+        catalog.files(backup_dir)
+
+        assert history.get_backup_by_path(paths[0]) is None, "record of a deleted file is removed"
+        moved = history.get_backup_by_path(renamed)
+        assert moved is not None and moved[0] == ids[1] and moved[5] == "pgsql", "renamed file keeps its record"
+        found = history.get_backup_by_path(copied)
+        assert found[3] == 512 and found[4] and found[7] == nextcloud_restore.CATALOG_DISCOVERED_STATUS
+        assert history.count_backups() == 4
+
+        # Recording the archive later replaces the discovered record instead of duplicating it
+        new_id = history.add_backup(copied, encrypted=True)
+        assert history.count_backups() == 4 and history.get_backup_by_path(copied)[0] == new_id
+        history.close()
+        print("  ✓ 1 record removed, 1 followed a rename, 1 added")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def test_unrelated_directories_not_added_to_history():
+    """A directory the history has never backed up to is catalogued but not imported."""
+    print("\nTesting unrelated directories...")
+    work_dir = tempfile.mkdtemp(prefix="backup_catalog_")
+    try:
+        history = nextcloud_restore.BackupHistoryManager(db_path=os.path.join(work_dir, "history.db"))
+        catalog = nextcloud_restore.BackupCatalog(history)
+        write_backup(work_dir, "nextcloud-backup-20260301_000000.tar.gz", age_days=2)
+        assert len(catalog.files(work_dir)) == 1 and history.count_backups() == 0
+        history.close()
+        print("  ✓ Catalogued without history records")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def test_call_sites_use_catalog():
+    """Verification goes through get_last_backup_info; rotation reads the GUI's catalog."""
+    print("\nTesting call sites...")
+    src_path = os.path.join(os.path.dirname(__file__), "../src/nextcloud_restore_and_backup-v9.py")
+    with open(src_path, 'r') as f:
+        content = f.read()
+    for name, expected in (('get_last_backup_info', 'catalog.files(backup_dir)'),
+                           ('verify_scheduled_backup_ran', 'get_last_backup_info(backup_dir)'),
+                           ('_perform_backup_rotation', 'self.backup_catalog.files(backup_dir)')):
+        start = content.find(f'def {name}(')
+        method = content[start:content.find('\n    def ' if name.startswith('_') else '\ndef ', start + 10)]
+        assert expected in method, name
+        assert 'listdir' not in method and 'getmtime' not in method, name
+    assert content.count('self.backup_catalog = BackupCatalog(self.backup_history)') == 1
+    print("  ✓ No directory walks left in the three call sites")
+
+
+if __name__ == "__main__":
+    test_rescans_only_when_directory_changes()
+    test_history_reconciled_both_ways()
+    test_unrelated_directories_not_added_to_history()
+    test_call_sites_use_catalog()
+    print("\n✅ All backup catalog tests passed")
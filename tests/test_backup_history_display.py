@@ -104,7 +104,7 @@ def test_backup_history_sql_logic():
         print("✅ SQL logic test PASSED")
 
 def test_backup_history_ui_integration():
-    """Test that show_backup_history calls get_all_backups."""
+    """Test that show_backup_history pages through the history."""
     print("\nTesting backup history UI integration...")
     
     main_file = "../src/nextcloud_restore_and_backup-v9.py"
@@ -120,10 +120,10 @@ def test_backup_history_ui_integration():
         show_history_end = len(content)
     show_history_section = content[show_history_start:show_history_end]
     
-    # Verify it calls get_all_backups
-    assert 'self.backup_history.get_all_backups()' in show_history_section, \
-        "show_backup_history should call get_all_backups()"
-    print("  ✓ show_backup_history() calls get_all_backups()")
+    # Verify it pages through the history (keyset pagination) instead of a fixed limit
+    assert 'BackupHistoryPager(self.backup_history)' in show_history_section, \
+        "show_backup_history should page through the history"
+    print("  ✓ show_backup_history() pages through the history")
     
     # Verify it displays each backup
     assert 'for backup in backups:' in show_history_section, \
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Test suite for the paginated backup history view.
+Verifies that the history is paged with keyset pagination on the timestamp index
+(no rows skipped or repeated, even with equal timestamps), that pages are only fetched
+as the view reaches them, and that file checks run on a background pool whose results
+are cached and collected on the UI side.
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+
+# Import the module using importlib to handle the dash in filename
+import importlib.util
+spec = importlib.util.spec_from_file_location(
+    "nextcloud_restore",
+    os.path.join(os.path.dirname(__file__), "../src/nextcloud_restore_and_backup-v9.py")
+)
+nextcloud_restore = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(nextcloud_restore)
+
+
+def make_history(work_dir, count):
+    """A history with `count` backups; every group of three shares one timestamp."""
+    history = nextcloud_restore.BackupHistoryManager(db_path=os.path.join(work_dir, "history.db"))
+    for i in range(count):
+        history._execute("INSERT INTO backups (backup_path, timestamp, verification_status) VALUES (?, ?, 'pending')",
+                         (f"/backups/nextcloud-backup-{i:04d}.tar.gz", f"2026-01-01T00:{i // 3 // 60:02d}:{i // 3 % 60:02d}"))
+    return history
+
+
+def test_keyset_pages_cover_history():
+    """Paging visits every record once, newest first, and each page uses the index."""
+    print("\nTesting keyset pagination...")
+    work_dir = tempfile.mkdtemp(prefix="history_pages_")
+    try:
+        history = make_history(work_dir, 250)
+        seen = []
+        after = None
+        while True:
+            page = history.get_backups_page(40, after=after)
+            seen.extend(page)
+            if len(page) < 40:
+                break
+            after = (page[-1][2], page[-1][0])
+        expected = history._query('SELECT id FROM backups ORDER BY timestamp DESC, id DESC')
+        assert [row[0] for row in seen] == [row[0] for row in expected]
+        assert len(seen) == history.count_backups() == 250
+
+        plan = ' '.join(row[-1] for row in history._query(
+            'EXPLAIN QUERY PLAN SELECT id FROM backups WHERE timestamp <= ? AND (timestamp < ? OR id < ?) '
+            'ORDER BY timestamp DESC, id DESC LIMIT 40', ('2026-01-01T00:00:30', '2026-01-01T00:00:30', 100)))
+        assert 'idx_backups_timestamp' in plan and 'TEMP B-TREE' not in plan, plan
+        history.close()
+        print(f"  ✓ {len(seen)} records in 7 pages, served from the index")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def test_pager_fetches_on_demand():
+    """The pager only fetches the pages a view has scrolled to, and drops removed files."""
+    print("\nTesting pager...")
+    work_dir = tempfile.mkdtemp(prefix="history_pages_")
+    try:
+        history = make_history(work_dir, 500)
+        pages = []
+        original = history.get_backups_page
+        history.get_backups_page = lambda limit, after=None: pages.append(after) or original(limit, after)
+        pager = nextcloud_restore.BackupHistoryPager(history, page_size=50)
+        assert pager.total == 500 and not pages
+
+        first_rows = pager.rows(0, 6)
+        assert len(pages) == 1 and first_rows[0][1].endswith("0499.tar.gz")
+        pager.rows(120, 126)
+        assert len(pages) == 3
+        pager.rows(0, 126)
+        assert len(pages) == 3, "loaded pages are not fetched again"
+
+        removed = pager.remove_path(first_rows[0][1])
+        assert len(removed) == 1 and pager.total == 499
+        assert pager.rows(0, 1)[0][0] == first_rows[1][0]
+        assert len(pager.rows(0, 1000)) == 499 and pager.total == 499
+        history.close()
+        print(f"  ✓ {len(pages)} page queries for the whole history")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def test_background_resolver():
+    """Lookups run concurrently off the caller's thread; results are cached and queued once."""
+    print("\nTesting background file checks...")
+    calls = []
+    failed_once = set()
+    notified = threading.Semaphore(0)
+
+    def slow_status(path):
+        calls.append(path)
+        time.sleep(0.2)
+        if path == 'flaky' and path not in failed_once:
+            failed_once.add(path)
+            raise OSError("stale NFS handle")
+        return None if path == 'gone' else len(path)
+    resolver = nextcloud_restore.BackgroundResolver(slow_status, workers=4, on_result=notified.release)
+    try:
+        start = time.perf_counter()
+        keys = ['a', 'bb', 'gone', 'flaky']
+        assert all(resolver.request(key) == (False, None) for key in keys)
+        assert time.perf_counter() - start < 0.1, "request() must not wait for the lookup"
+        assert resolver.request('a') == (False, None) and calls.count('a') <= 1
+
+        for _ in range(3):
+            assert notified.acquire(timeout=5)
+        elapsed = time.perf_counter() - start
+        assert elapsed < 0.5, f"lookups took {elapsed:.2f}s (serial would be 0.8s)"
+        assert sorted(resolver.pop_results()) == [('a', 1), ('bb', 2), ('gone', None)]
+        assert resolver.pop_results() == []
+        assert resolver.request('bb') == (True, 2) and calls.count('bb') == 1
+
+        deadline = time.monotonic() + 5
+        while 'flaky' not in failed_once or 'flaky' in resolver._pending:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        assert resolver.request('flaky') == (False, None), "a failed lookup is retried"
+        assert notified.acquire(timeout=5)
+        assert resolver.pop_results() == [('flaky', 5)]
+        print(f"  ✓ 4 checks in {elapsed:.2f}s; cached, failures retried")
+    finally:
+        resolver.close()
+
+
+def test_history_page_is_virtualized():
+    """The history page builds rows only in its render pass and checks files in the pool."""
+    print("\nTesting history page wiring...")
+    src_path = os.path.join(os.path.dirname(__file__), "../src/nextcloud_restore_and_backup-v9.py")
+    with open(src_path, 'r') as f:
+        content = f.read()
+    start = content.find('def show_backup_history(')
+    method = content[start:content.find('\n    def ', start + 10)]
+    assert 'get_all_backups' not in method
+    assert method.count('self._create_backup_item(') == 1
+    render = method[method.find('def render('):method.find('def schedule_render(')]
+    assert 'self._create_backup_item(' in render and 'os.path.exists' not in render
+    assert 'BackgroundResolver(file_status' in method
+    assert "self.progress_bus.subscribe('history', on_file_status)" in method
+    # Row height follows fonts and tk scaling instead of a fixed pixel count
+    assert 'row_height = self._measure_backup_item_height(canvas)' in method
+    assert 'HISTORY_ROW_HEIGHT' not in content
+    start = content.find('def _measure_backup_item_height(')
+    measure = content[start:content.find('\n    def ', start + 10)]
+    assert 'self._create_backup_item(' in measure and 'winfo_reqheight()' in measure
+    print("  ✓ Widgets only for visible rows; file checks off the Tk thread; row height measured")
+
+
+if __name__ == "__main__":
+    test_keyset_pages_cover_history()
+    test_pager_fetches_on_demand()
+    test_background_resolver()
+    test_history_page_is_virtualized()
+    print("\n✅ All backup history pagination tests passed")
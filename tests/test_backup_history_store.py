@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Test suite for the backup history store.
+Verifies that BackupHistoryManager keeps one WAL-mode connection shared safely across
+threads, that the timestamp and backup_path indexes exist and are used, that schema
+migrations run once on old databases, and that records are looked up and deleted by
+path in bulk (which is what backup rotation now does).
+"""
+
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+import threading
+
+# Import the module using importlib to handle the dash in filename
+import importlib.util
+spec = importlib.util.spec_from_file_location(
+    "nextcloud_restore",
+    os.path.join(os.path.dirname(__file__), "../src/nextcloud_restore_and_backup-v9.py")
+)
+nextcloud_restore = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(nextcloud_restore)
+
+
+def test_one_connection_in_wal_mode():
+    """Many calls from several threads share one WAL connection."""
+    print("\nTesting persistent connection...")
+    work_dir = tempfile.mkdtemp(prefix="history_store_")
+    original_connect = sqlite3.connect
+    connects = []
+
+    def counting_connect(*args, **kwargs):
+        connects.append(args)
+        return original_connect(*args, **kwargs)
+    try:
+        sqlite3.connect = counting_connect
+        history = nextcloud_restore.BackupHistoryManager(db_path=os.path.join(work_dir, "history.db"))
+
+        def add_many(worker):
+            for i in range(50):
+                backup_id = history.add_backup(f"/backups/w{worker}-{i}.tar.gz", database_type="pgsql")
+                history.update_verification(backup_id, "success")
+        threads = [threading.Thread(target=add_many, args=(worker,)) for worker in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(history.get_all_backups(limit=1000)) == 400
+        assert len(connects) == 1, f"{len(connects)} connections"
+        assert history._query('PRAGMA journal_mode')[0][0] == 'wal'
+        history.close()
+        print("  ✓ 800 writes from 8 threads over 1 WAL connection")
+    finally:
+        sqlite3.connect = original_connect
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def test_migrations_run_once():
+    """An old database gains the chain columns and indexes, and is versioned."""
+    print("\nTesting schema migrations...")
+    work_dir = tempfile.mkdtemp(prefix="history_store_")
+    try:
+        db_path = os.path.join(work_dir, "history.db")
+        conn = sqlite3.connect(db_path)
+        conn.execute('''CREATE TABLE backups (id INTEGER PRIMARY KEY AUTOINCREMENT, backup_path TEXT NOT NULL,
+                        timestamp DATETIME NOT NULL, size_bytes INTEGER, encrypted BOOLEAN, database_type TEXT,
+                        folders_backed_up TEXT, verification_status TEXT, verification_details TEXT, notes TEXT,
+                        created_at DATETIME DEFAULT CURRENT_TIMESTAMP)''')
+        conn.execute("INSERT INTO backups (backup_path, timestamp) VALUES ('old.tar.gz', '2024-01-01T00:00:00')")
+        conn.commit()
+        conn.close()
+
+        history = nextcloud_restore.BackupHistoryManager(db_path=db_path)
+        version = history._query('PRAGMA user_version')[0][0]
+        assert version == nextcloud_restore.BackupHistoryManager.SCHEMA_VERSION
+        indexes = {row[1] for row in history._query('PRAGMA index_list(backups)')}
+        assert {'idx_backups_timestamp', 'idx_backups_backup_path', 'idx_backups_backup_dir'} <= indexes, indexes
+        assert history.get_backup_links('old.tar.gz')[2] == 'full'
+        assert history._query('SELECT backup_dir FROM backups')[0][0] == os.path.normcase(os.path.abspath(''))
+        history.close()
+
+        reopened = nextcloud_restore.BackupHistoryManager(db_path=db_path)
+        assert len(reopened.get_all_backups()) == 1
+        reopened.close()
+        print(f"  ✓ Upgraded to schema version {version}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def test_path_lookup_and_bulk_delete():
+    """Path lookups use the index; hundreds of records are deleted in one statement."""
+    print("\nTesting path lookup and bulk delete...")
+    work_dir = tempfile.mkdtemp(prefix="history_store_")
+    try:
+        history = nextcloud_restore.BackupHistoryManager(db_path=os.path.join(work_dir, "history.db"))
+        paths = [f"/backups/nextcloud-backup-{i:04d}.tar.gz" for i in range(600)]
+        for path in paths:
+            history.add_backup(path)
+        record = history.get_backup_by_path(paths[42])
+        assert record[1] == paths[42] and len(record) == len(history.get_all_backups(limit=1)[0])
+        assert history.get_backup_by_path("/backups/missing.tar.gz") is None
+        plan = ' '.join(row[-1] for row in history._query(
+            'EXPLAIN QUERY PLAN SELECT id FROM backups WHERE backup_path = ?', (paths[0],)))
+        assert 'idx_backups_backup_path' in plan, plan
+
+        statements = []
+        history._conn.set_trace_callback(statements.append)
+        assert history.delete_by_paths(paths[:500] + ["/backups/never-recorded.tar.gz"]) == 500
+        history._conn.set_trace_callback(None)
+        assert len([s for s in statements if s.lstrip().upper().startswith('DELETE')]) == 1, statements
+        assert [row[1] for row in history.get_all_backups(limit=1000)] == sorted(paths[500:], reverse=True)
+        assert history.delete_by_paths([]) == 0
+        history.close()
+        print("  ✓ 500 records deleted with 1 statement")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def test_rotation_uses_bulk_delete():
+    """Rotation no longer scans the history once per deleted file."""
+    print("\nTesting rotation...")
+    src_path = os.path.join(os.path.dirname(__file__), "../src/nextcloud_restore_and_backup-v9.py")
+    with open(src_path, 'r') as f:
+        content = f.read()
+    for name in ('_perform_backup_rotation', '_rotate_chunk_repository'):
+        start = content.find(f'def {name}(')
+        method = content[start:content.find('\n    def ', start + 10)]
+        assert 'get_all_backups' not in method, name
+        assert method.count('self.backup_history.delete_by_paths(deleted)') == 1, name
+    print("  ✓ Rotation removes history records in one call")
+
+
+if __name__ == "__main__":
+    test_one_connection_in_wal_mode()
+    test_migrations_run_once()
+    test_path_lookup_and_bulk_delete()
+    test_rotation_uses_bulk_delete()
+    print("\n✅ All backup history store tests passed")
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Test suite for bounded-memory archive reading.
+Verifies that BackupArchiveReader and iter_tar_members drop each member record once
+the next one is read, that every archive reader (extraction, config.php lookup,
+verification, backup info, selective extraction) goes through them, and that memory
+stays flat while reading a synthetic archive with millions of entries.
+
+The memory benchmark streams a generated archive through a FIFO, so nothing is
+written to disk. It reads 200,000 entries by default; set BENCH_ARCHIVE_ENTRIES=5000000
+for the full 5-million-entry run (about six minutes).
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import tarfile
+import tempfile
+import threading
+import contextlib
+
+# Import the module using importlib to handle the dash in filename
+import importlib.util
+spec = importlib.util.spec_from_file_location(
+    "nextcloud_restore",
+    os.path.join(os.path.dirname(__file__), "../src/nextcloud_restore_and_backup-v9.py")
+)
+nextcloud_restore = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(nextcloud_restore)
+
+BENCH_ENTRIES = int(os.environ.get("BENCH_ARCHIVE_ENTRIES", "200000"))
+CONFIG_PHP = b"<?php\n$CONFIG = array (\n  'dbtype' => 'sqlite3',\n);\n"
+
+
+def rss_bytes():
+    """Current resident set size of this process."""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def write_archive(path, file_count=300, decoys=20):
+    """A small backup: info member, decoy config.php files, the real one and data files."""
+    with tarfile.open(path, "w:gz", compresslevel=1) as tar:
+        def add(name, data):
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+        add(nextcloud_restore.BACKUP_INFO_NAME, json.dumps({'backup_type': 'full'}).encode())
+        for i in range(decoys):
+            add(f"apps/app_{i}/lib/config.php", b"<?php return [];")
+        for i in range(file_count):
+            add(f"data/admin/files/dir_{i % 9}/file_{i}.txt", b"x" * (i % 700))
+        add("config/config.php", CONFIG_PHP)
+
+
+def generate_tar_stream(fifo_path, entries):
+    """Write a plain tar of `entries` empty files into a FIFO (run on a thread)."""
+    template = tarfile.TarInfo("")
+    template.mtime = 1200000000
+    with open(fifo_path, "wb", buffering=1024 * 1024) as out:
+        for i in range(entries):
+            template.name = f"data/admin/files/dir_{i // 1000}/file_{i}.txt"
+            out.write(template.tobuf(tarfile.GNU_FORMAT))
+        out.write(b"\0" * tarfile.RECORDSIZE)
+
+
+@contextlib.contextmanager
+def record_retained_members():
+    """Track the largest TarFile.members list seen while reading archives."""
+    original_next = tarfile.TarFile.next
+    seen = {'max': 0, 'calls': 0}
+
+    def next_member(self):
+        # Measured before next() appends the new member: what earlier reads left behind
+        seen['max'] = max(seen['max'], len(self.members))
+        seen['calls'] += 1
+        return original_next(self)
+    tarfile.TarFile.next = next_member
+    try:
+        yield seen
+    finally:
+        tarfile.TarFile.next = original_next
+
+
+def test_reader_drops_member_records():
+    """Members come out in archive order and none stay in tar.members."""
+    print("\nTesting BackupArchiveReader...")
+    work_dir = tempfile.mkdtemp(prefix="bounded_reader_")
+    try:
+        archive_path = os.path.join(work_dir, "nextcloud-backup-test.tar.gz")
+        write_archive(archive_path)
+        with tarfile.open(archive_path, "r:gz") as tar:
+            expected = tar.getnames()
+        with nextcloud_restore.BackupArchiveReader(archive_path) as reader:
+            names = []
+            for member in reader:
+                names.append(member.name)
+                assert reader.tar.members == []
+            reader.drain()
+            assert reader.bytes_read == os.path.getsize(archive_path)
+        assert names == expected
+        print(f"  ✓ {len(names)} members read, none retained")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def test_archive_readers_keep_no_member_records():
+    """Extraction, config lookup, verification and info reads never accumulate members."""
+    print("\nTesting archive readers...")
+    work_dir = tempfile.mkdtemp(prefix="bounded_readers_")
+    try:
+        archive_path = os.path.join(work_dir, "nextcloud-backup-test.tar.gz")
+        write_archive(archive_path)
+        with record_retained_members() as seen:
+            nextcloud_restore.fast_extract_tar_gz(archive_path, os.path.join(work_dir, "serial"), writers=1)
+            nextcloud_restore.fast_extract_tar_gz(archive_path, os.path.join(work_dir, "parallel"), writers=4)
+            assert nextcloud_restore.extract_config_php_only(archive_path, os.path.join(work_dir, "cfg"))
+            assert nextcloud_restore.verify_archive_stream(archive_path)['files'] == 321
+            assert nextcloud_restore.read_backup_info(archive_path) == {'backup_type': 'full'}
+            os.remove(archive_path + ".idx")  # Scan the whole archive rather than seek
+            assert nextcloud_restore.extract_archive_paths(archive_path, os.path.join(work_dir, "sel"),
+                                                           ["data/admin/files/dir_3"]) == 33
+        assert seen['calls'] > 5 * 321
+        assert seen['max'] <= 1, f"{seen['max']} member records retained"
+        print(f"  ✓ {seen['calls']} members read, at most {seen['max']} retained")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def test_config_lookup_logs_one_line_per_candidate():
+    """Skipped config.php candidates cost one log line each."""
+    print("\nTesting config.php lookup output...")
+    work_dir = tempfile.mkdtemp(prefix="bounded_config_")
+    try:
+        archive_path = os.path.join(work_dir, "nextcloud-backup-test.tar.gz")
+        write_archive(archive_path, file_count=10, decoys=200)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            config_path = nextcloud_restore.extract_config_php_only(archive_path, os.path.join(work_dir, "cfg"))
+        assert config_path.endswith(os.path.join("config", "config.php"))
+        lines = output.getvalue().splitlines()
+        assert len(lines) <= 200 + 6, f"{len(lines)} lines for 201 candidates"
+        assert sum("apps/app_7/lib/config.php" in line for line in lines) == 1
+        print(f"  ✓ {len(lines)} lines for 201 candidates")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def test_memory_flat_on_huge_archive():
+    """RSS does not grow with the number of entries read (benchmark)."""
+    print(f"\nBenchmarking {BENCH_ENTRIES:,} entries...")
+    work_dir = tempfile.mkdtemp(prefix="bounded_bench_")
+    try:
+        fifo_path = os.path.join(work_dir, "huge.tar")
+        os.mkfifo(fifo_path)
+        writer = threading.Thread(target=generate_tar_stream, args=(fifo_path, BENCH_ENTRIES), daemon=True)
+        writer.start()
+        samples = []
+        start = time.perf_counter()
+        with nextcloud_restore.BackupArchiveReader(fifo_path) as reader:
+            for count, member in enumerate(reader, 1):
+                if count % (BENCH_ENTRIES // 10) == 0:
+                    samples.append(rss_bytes())
+        elapsed = time.perf_counter() - start
+        writer.join(timeout=30)
+        assert count == BENCH_ENTRIES
+        # Skip the first sample (allocator warm-up); a retained TarInfo costs ~500 bytes,
+        # so keeping them would add hundreds of MB over the remaining entries
+        growth = max(samples[1:]) - samples[1]
+        assert growth < 16 * 1024 * 1024, f"RSS grew by {growth / 1048576:.1f} MiB"
+        print(f"  ✓ {count:,} entries in {elapsed:.1f}s; RSS {samples[1] / 1048576:.1f} MiB -> "
+              f"{samples[-1] / 1048576:.1f} MiB (growth {growth / 1048576:.2f} MiB)")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_reader_drops_member_records()
+    test_archive_readers_keep_no_member_records()
+    test_config_lookup_logs_one_line_per_candidate()
+    test_memory_flat_on_huge_archive()
+    print("\n✅ All bounded archive reader tests passed")
@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+"""
+Test suite for the deduplicating chunk repository storage mode.
+Verifies that content-defined chunking survives insertions and keeps chunk sizes near
+the average on low-entropy data, that repeated backups only
+store new chunks, that rotation garbage-collects unreferenced chunks, that a snapshot
+streams back into a container as a tar stream, and that encrypted repositories check
+their password and store chunks in gpg-encrypted packs.
+"""
+
+import os
+import sys
+import io
+import time
+import random
+import shutil
+import tempfile
+import subprocess
+
+# Import the module using importlib to handle the dash in filename
+import importlib.util
+spec = importlib.util.spec_from_file_location(
+    "nextcloud_restore",
+    os.path.join(os.path.dirname(__file__), "../src/nextcloud_restore_and_backup-v9.py")
+)
+nextcloud_restore = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(nextcloud_restore)
+
+# Small chunk sizes keep the test data small while still producing many chunks
+SMALL_CHUNKER = dict(min_size=4 * 1024, avg_size=16 * 1024, max_size=64 * 1024)
+
+
+def write_file(root, rel_path, content, mtime=None):
+    path = os.path.join(root, rel_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+def local_listing(root, folders):
+    """Stand-in for list_container_files: same find command, run locally."""
+    output = subprocess.run(
+        ['find'] + [os.path.join(root, f) for f in folders] + ['-printf', '%y\\t%m\\t%s\\t%T@\\t%p\\0'],
+        capture_output=True, check=True
+    ).stdout
+    return nextcloud_restore.parse_container_file_listing(output, root)
+
+
+def read_tree(root, folders):
+    """Map of relative file path -> content for comparison."""
+    tree = {}
+    for folder in folders:
+        for dirpath, dirnames, filenames in os.walk(os.path.join(root, folder)):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                with open(path, "rb") as f:
+                    tree[os.path.relpath(path, root)] = f.read()
+    return tree
+
+
+class LocalContainer:
+    """Point the container stream helpers at a local directory for the duration of a test."""
+    NAMES = ('open_container_tar_stream', 'open_container_paths_tar_stream',
+             'list_container_files', 'open_container_tar_extract_stream')
+
+    def __init__(self, root, restore_root=None):
+        self.root = root
+        self.restore_root = restore_root
+
+    def __enter__(self):
+        self.originals = {name: getattr(nextcloud_restore, name) for name in self.NAMES}
+        root = self.root
+        nextcloud_restore.open_container_tar_stream = lambda c, folders, base_path: subprocess.Popen(
+            ['tar', '-c', '-C', root] + list(folders), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        nextcloud_restore.open_container_paths_tar_stream = lambda c, paths, base_path: subprocess.Popen(
+            ['tar', '-c', '-C', root, '--no-recursion'] + list(paths), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        nextcloud_restore.list_container_files = lambda c, folders, base_path: local_listing(root, folders)
+        if self.restore_root:
+            nextcloud_restore.open_container_tar_extract_stream = lambda c, base_path: subprocess.Popen(
+                ['tar', '-x', '-f', '-', '-C', self.restore_root],
+                stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        return self
+
+    def __exit__(self, *exc):
+        for name, original in self.originals.items():
+            setattr(nextcloud_restore, name, original)
+
+
+def test_chunk_boundaries_survive_insertion():
+    """Inserting bytes near the start of a file only changes the chunks around the edit."""
+    print("\nTesting content-defined chunk boundaries...")
+    chunker = nextcloud_restore.ContentDefinedChunker(**SMALL_CHUNKER)
+    data = os.urandom(1024 * 1024)
+    chunks = list(chunker.split(io.BytesIO(data)))
+    assert b"".join(chunks) == data
+    assert all(len(c) <= SMALL_CHUNKER['max_size'] for c in chunks)
+    assert all(len(c) >= SMALL_CHUNKER['min_size'] for c in chunks[:-1])
+    assert 20 < len(chunks) < 200, f"Unexpected chunk count {len(chunks)}"
+
+    shifted = list(chunker.split(io.BytesIO(data[:5000] + b"inserted bytes" + data[5000:])))
+    shared = set(chunks) & set(shifted)
+    assert len(shared) >= len(chunks) - 3, f"Only {len(shared)} of {len(chunks)} chunks survived the insertion"
+
+    # Boundaries are found even when the reader returns short reads
+    class Trickle(io.RawIOBase):
+        def __init__(self, payload):
+            self.stream = io.BytesIO(payload)
+        def read(self, size=-1):
+            return self.stream.read(min(size, 1000) if size and size > 0 else 1000)
+    assert list(chunker.split(Trickle(data))) == chunks
+    assert list(chunker.split(io.BytesIO(b""))) == []
+    print(f"  ✓ {len(chunks)} chunks, {len(shared)} unchanged after an insertion")
+
+
+def test_chunk_sizes_on_low_entropy_data():
+    """Chunk sizes stay near avg_size on repetitive data, not pinned to min_size or max_size."""
+    print("\nTesting chunk sizes on low-entropy data...")
+    chunker = nextcloud_restore.ContentDefinedChunker(**SMALL_CHUNKER)
+    rnd = random.Random(1234)
+    samples = {
+        'random': os.urandom(2 * 1024 * 1024),
+        'four-letter text': bytes(rnd.choices(b"ACGT", k=2 * 1024 * 1024)),
+        'table rows': b"".join(b"%08d|files/photo_%d.jpg|%d\n" % (row, row % 97, 1700000000 + row * 7)
+                               for row in range(60000)),
+    }
+    for name, data in samples.items():
+        sizes = [len(c) for c in chunker.split(io.BytesIO(data))][:-1]
+        mean = sum(sizes) / len(sizes)
+        pinned = sum(size in (SMALL_CHUNKER['min_size'], SMALL_CHUNKER['max_size']) for size in sizes)
+        assert SMALL_CHUNKER['avg_size'] / 2 < mean < SMALL_CHUNKER['avg_size'] * 2, f"{name}: mean {mean:.0f}"
+        assert pinned < len(sizes) / 10, f"{name}: {pinned} of {len(sizes)} chunks at min/max size"
+        print(f"  ✓ {name}: {len(sizes)} chunks, mean {mean / 1024:.1f} KB")
+
+    # The block screening finds the same boundaries as hashing byte by byte
+    data = samples['table rows'][:512 * 1024]
+    expected, start, h = [], 0, 0
+    for index, byte in enumerate(data):
+        h = ((h << 1) + chunker.GEAR[byte]) & 0xffffffffffffffff
+        length = index + 1 - start
+        mask = chunker._mask_small if length <= SMALL_CHUNKER['avg_size'] else chunker._mask_large
+        if length == SMALL_CHUNKER['max_size'] or (length >= SMALL_CHUNKER['min_size'] and not h & mask):
+            expected.append(length)
+            start = index + 1
+    assert [len(c) for c in chunker.split(io.BytesIO(data))][:len(expected)] == expected
+    print(f"  ✓ Same {len(expected)} boundaries as a byte-by-byte gear hash")
+
+    # A run of identical bytes has one hash value: it must not cut at every min_size
+    zeros = [len(c) for c in chunker.split(io.BytesIO(bytes(1024 * 1024)))]
+    assert zeros == [SMALL_CHUNKER['max_size']] * 16, zeros[:5]
+    print("  ✓ zero-filled: max_size chunks")
+
+
+def test_repeated_backups_store_only_new_chunks():
+    """A second snapshot of a mostly unchanged tree writes only the changed chunks."""
+    print("\nTesting deduplication across snapshots...")
+    root = tempfile.mkdtemp(prefix="fake_html_")
+    backup_dir = tempfile.mkdtemp(prefix="chunk_backups_")
+    try:
+        old = time.time() - 3600
+        write_file(root, "config/config.php", b"<?php $CONFIG = array('dbtype' => 'sqlite');", old)
+        big = os.urandom(512 * 1024)
+        write_file(root, "data/admin/files/video.bin", big, old)
+        write_file(root, "data/admin/files/copy-of-video.bin", big, old)
+        write_file(root, "apps/files/appinfo.xml", b"<info/>", old)
+        folders = ["config", "data", "apps"]
+
+        repo = nextcloud_restore.ChunkRepository(
+            nextcloud_restore.get_chunk_repository_path(backup_dir), create=True,
+            chunker=nextcloud_restore.ContentDefinedChunker(**SMALL_CHUNKER))
+        with LocalContainer(root):
+            first_path, first = nextcloud_restore.backup_to_chunk_repository(repo, "nextcloud-app", folders)
+            assert first['new_chunks'] < first['chunks'], "Duplicate file content was stored twice"
+
+            # Change the middle of the big file and add a new file
+            write_file(root, "data/admin/files/video.bin", big[:200000] + b"edited" + big[200006:])
+            write_file(root, "data/admin/files/new.txt", b"new file\n" * 10)
+            second_path, second = nextcloud_restore.backup_to_chunk_repository(repo, "nextcloud-app", folders)
+
+        assert second['files'] == 2, f"Only changed files should be read, got {second['files']}"
+        assert second['reused_files'] > 0
+        assert 0 < second['new_chunks'] <= 3, f"Expected a couple of new chunks, got {second['new_chunks']}"
+        assert second['new_bytes'] < first['new_bytes'] / 5
+        assert repo.list_snapshots() == [first_path, second_path]
+
+        files, _ = repo.load_snapshot(second_path)
+        assert files["config/config.php"] == repo.load_snapshot(first_path)[0]["config/config.php"]
+        print(f"  ✓ First run wrote {first['new_chunks']} chunks, second run {second['new_chunks']}")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+        shutil.rmtree(backup_dir, ignore_errors=True)
+
+
+def test_gc_removes_only_unreferenced_chunks():
+    """After deleting a snapshot, gc frees its unique chunks and keeps the shared ones."""
+    print("\nTesting garbage collection...")
+    work_dir = tempfile.mkdtemp(prefix="chunk_gc_")
+    try:
+        repo = nextcloud_restore.ChunkRepository(
+            os.path.join(work_dir, "repo"), create=True,
+            chunker=nextcloud_restore.ContentDefinedChunker(**SMALL_CHUNKER))
+        shared_id, _ = repo.put_chunk(b"shared" * 1000)
+        old_id, _ = repo.put_chunk(os.urandom(10000))
+        entry = lambda ids: ['f', 0, 0, 0o644, ids, '', 33, 33, 'www-data', 'www-data']
+        old_snapshot = repo.write_snapshot({"data/a": entry([shared_id, old_id])}, timestamp="20240101_000000")
+        repo.write_snapshot({"data/a": entry([shared_id])}, timestamp="20240102_000000")
+        # Leftover of an interrupted write
+        open(os.path.join(repo.chunks_dir, shared_id[:2], ".tmp-leftover"), "wb").close()
+
+        assert repo.gc() == (0, 0)
+        repo.delete_snapshot(old_snapshot)
+        removed, freed = repo.gc()
+        assert removed == 1 and freed > 0
+        assert repo.has_chunk(shared_id) and not repo.has_chunk(old_id)
+        assert not os.path.exists(os.path.join(repo.chunks_dir, shared_id[:2], ".tmp-leftover"))
+        assert repo.get_chunk(shared_id) == b"shared" * 1000
+        print(f"  ✓ Removed {removed} chunk(s), kept the shared chunk")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def test_snapshot_streams_back_into_container():
+    """A snapshot restores the exact tree through `tar -x`, and local extraction picks config and dump."""
+    print("\nTesting snapshot restore stream...")
+    root = tempfile.mkdtemp(prefix="fake_html_")
+    restore_root = tempfile.mkdtemp(prefix="chunk_restore_")
+    backup_dir = tempfile.mkdtemp(prefix="chunk_backups_")
+    try:
+        write_file(root, "config/config.php", b"<?php $CONFIG = array('dbtype' => 'pgsql');")
+        write_file(root, "data/admin/files/photo.jpg", os.urandom(200 * 1024))
+        write_file(root, "data/admin/files/empty.txt", b"")
+        os.symlink("photo.jpg", os.path.join(root, "data/admin/files/latest.jpg"))
+        dump_path = os.path.join(backup_dir, "dump.sql")
+        with open(dump_path, "wb") as f:
+            f.write(b"CREATE TABLE oc_users (uid TEXT);\n")
+
+        repo = nextcloud_restore.ChunkRepository(
+            nextcloud_restore.get_chunk_repository_path(backup_dir), create=True,
+            chunker=nextcloud_restore.ContentDefinedChunker(**SMALL_CHUNKER))
+        with LocalContainer(root, restore_root):
+            snapshot_path, _ = nextcloud_restore.backup_to_chunk_repository(
+                repo, "nextcloud-app", ["config", "data"], extra_files={"nextcloud-db.sql": dump_path})
+            assert nextcloud_restore.is_snapshot_path(snapshot_path)
+            stats = nextcloud_restore.restore_snapshot_to_container(repo, snapshot_path, "nextcloud-app", ["data"])
+
+        assert read_tree(restore_root, ["data"]) == read_tree(root, ["data"])
+        assert os.readlink(os.path.join(restore_root, "data/admin/files/latest.jpg")) == "photo.jpg"
+        assert not os.path.exists(os.path.join(restore_root, "config")), "Unselected folder was restored"
+        print(f"  ✓ Streamed {stats['files']} entries into the container")
+
+        local_dir = os.path.join(backup_dir, "local")
+        files, _ = repo.load_snapshot(snapshot_path)
+        nextcloud_restore.extract_snapshot(repo, snapshot_path, local_dir,
+                                           paths=nextcloud_restore.get_snapshot_restore_paths(files))
+        assert os.path.exists(os.path.join(local_dir, "config", "config.php"))
+        assert os.path.exists(os.path.join(local_dir, "nextcloud-db.sql"))
+        assert not os.path.exists(os.path.join(local_dir, "data", "admin"))
+
+        status, details = nextcloud_restore.verify_backup_integrity(snapshot_path)
+        assert status == 'success', details
+        print(f"  ✓ {details}")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+        shutil.rmtree(restore_root, ignore_errors=True)
+        shutil.rmtree(backup_dir, ignore_errors=True)
+
+
+def test_corrupted_chunk_is_detected():
+    """A chunk whose content no longer matches its name is reported, not restored."""
+    print("\nTesting corrupted chunk detection...")
+    work_dir = tempfile.mkdtemp(prefix="chunk_corrupt_")
+    try:
+        repo = nextcloud_restore.ChunkRepository(os.path.join(work_dir, "repo"), create=True)
+        chunk_id, _ = repo.put_chunk(b"important data" * 100)
+        chunk_path = os.path.join(repo.chunks_dir, chunk_id[:2], chunk_id)
+        with open(chunk_path, "wb") as f:
+            f.write(nextcloud_restore.CHUNK_CODEC_RAW + b"tampered")
+        try:
+            repo.get_chunk(chunk_id)
+            assert False, "Corrupted chunk was accepted"
+        except Exception as e:
+            assert "corrupted" in str(e)
+            print(f"  ✓ Rejected: {e}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def test_encrypted_repository_checks_password():
+    """Encrypted repositories hide content, need the right password and keyed chunk names."""
+    print("\nTesting encrypted repository...")
+    available, _ = nextcloud_restore.check_gpg_available()
+    if not available:
+        print("  - Skipped: gpg not installed")
+        return
+    work_dir = tempfile.mkdtemp(prefix="chunk_encrypted_")
+    try:
+        repo_path = os.path.join(work_dir, "repo")
+        repo = nextcloud_restore.ChunkRepository(repo_path, password="s3cret", create=True)
+        data = b"confidential spreadsheet" * 200
+        chunk_id, _ = repo.put_chunk(data)
+        assert chunk_id != nextcloud_restore.hashlib.sha256(data).hexdigest(), "Chunk name leaks the content hash"
+        snapshot_path = repo.write_snapshot({"data/a.xlsx": ['f', len(data), 0, 0o644, [chunk_id], '', 0, 0, '', '']})
+        assert snapshot_path.endswith(".json.gz.gpg")
+        for dirpath, _, filenames in os.walk(repo_path):
+            for name in filenames:
+                with open(os.path.join(dirpath, name), "rb") as f:
+                    assert b"confidential" not in f.read(), name
+
+        reopened = nextcloud_restore.ChunkRepository(repo_path, password="s3cret")
+        assert reopened.get_chunk(chunk_id) == data
+        assert reopened.load_snapshot(snapshot_path)[0]["data/a.xlsx"][4] == [chunk_id]
+        for password in (None, "wrong"):
+            try:
+                nextcloud_restore.ChunkRepository(repo_path, password=password)
+                assert False, f"Opened encrypted repository with password {password!r}"
+            except Exception as e:
+                assert "password" in str(e)
+        print("  ✓ Chunks and snapshots encrypted; wrong or missing password rejected")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def test_encrypted_chunks_are_packed():
+    """Chunks of an encrypted repository share gpg packs; gc rewrites partly used packs."""
+    print("\nTesting encrypted chunk packs...")
+    available, _ = nextcloud_restore.check_gpg_available()
+    if not available:
+        print("  - Skipped: gpg not installed")
+        return
+    work_dir = tempfile.mkdtemp(prefix="chunk_packs_")
+    original_run_gpg = nextcloud_restore.run_gpg
+    calls = []
+
+    def counting_run_gpg(args, *rest, **kwargs):
+        calls.append(args[0])
+        return original_run_gpg(args, *rest, **kwargs)
+    try:
+        nextcloud_restore.run_gpg = counting_run_gpg
+        repo_path = os.path.join(work_dir, "repo")
+        repo = nextcloud_restore.ChunkRepository(repo_path, password="s3cret", create=True)
+        blobs = [os.urandom(20000) for _ in range(200)]
+        ids = [repo.put_chunk(blob)[0] for blob in blobs]
+        entry = lambda chunk_ids: ['f', 0, 0, 0o644, chunk_ids, '', 0, 0, '', '']
+        old_snapshot = repo.write_snapshot({"data/old": entry(ids[:100])}, timestamp="20240101_000000")
+        repo.write_snapshot({"data/new": entry(ids[100:])}, timestamp="20240102_000000")
+        assert calls.count('-c') == 3, f"{calls.count('-c')} gpg encryptions for 200 chunks and 2 snapshots"
+        assert not os.path.exists(repo.chunks_dir) or not any(os.scandir(repo.chunks_dir))
+
+        # An encrypted chunk file written by earlier versions is still read and collected
+        legacy_data = b"written before packs" * 50
+        legacy_id = repo.chunk_id(legacy_data)
+        os.makedirs(os.path.join(repo.chunks_dir, legacy_id[:2]))
+        with open(os.path.join(repo.chunks_dir, legacy_id[:2], legacy_id), "wb") as f:
+            f.write(nextcloud_restore.gpg_encrypt_bytes(nextcloud_restore.CHUNK_CODEC_RAW + legacy_data, "s3cret"))
+
+        reopened = nextcloud_restore.ChunkRepository(repo_path, password="s3cret")
+        del calls[:]
+        assert [reopened.get_chunk(chunk_id) for chunk_id in ids] == blobs
+        assert calls.count('-d') == 1, f"{calls.count('-d')} gpg decryptions to read one pack"
+        assert reopened.get_chunk(legacy_id) == legacy_data
+
+        reopened.delete_snapshot(old_snapshot)
+        removed, freed = reopened.gc()
+        assert removed == 101 and freed > 0, (removed, freed)
+        after_gc = nextcloud_restore.ChunkRepository(repo_path, password="s3cret")
+        assert not any(after_gc.has_chunk(chunk_id) for chunk_id in ids[:100] + [legacy_id])
+        assert [after_gc.get_chunk(chunk_id) for chunk_id in ids[100:]] == blobs[100:]
+        print(f"  ✓ 200 chunks in 1 pack; gc removed {removed} chunk(s) and rewrote the pack")
+    finally:
+        nextcloud_restore.run_gpg = original_run_gpg
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def test_storage_mode_option_and_rotation_hook():
+    """The storage mode round-trips to CLI flags, and rotation garbage-collects the repository."""
+    print("\nTesting storage mode option...")
+    options = nextcloud_restore.get_backup_options({'storage_mode': 'repository'})
+    assert nextcloud_restore.build_backup_option_args(options) == ["--storage-mode", "repository"]
+    assert nextcloud_restore.get_backup_options(None)['storage_mode'] == 'archive'
+
+    src_path = os.path.join(os.path.dirname(__file__), "../src/nextcloud_restore_and_backup-v9.py")
+    with open(src_path, 'r') as f:
+        content = f.read()
+    start = content.find('def _rotate_chunk_repository(')
+    rotation_src = content[start:content.find('\n    def ', start + 1)]
+    assert "repo.gc()" in rotation_src and "delete_snapshot" in rotation_src
+    assert "self._rotate_chunk_repository(backup_dir, keep_count, password)" in content
+    assert "self._stream_snapshot_into_container(" in content
+
+    # The schedule page offers the mode together with its first-run chunking speed
+    start = content.find('def show_schedule_backup(')
+    page = content[start:content.find('\n    def ', start + 1)]
+    assert "'repository' if repository_var.get() else 'archive'" in page
+    assert 'text=f"⚠️ {CHUNK_REPOSITORY_SPEED_NOTE}"' in page
+    assert "backup_options['storage_mode'] = storage_mode" in content
+    print("  ✓ --storage-mode repository; rotation deletes old snapshots and runs gc")
+
+
+if __name__ == "__main__":
+    test_chunk_boundaries_survive_insertion()
+    test_chunk_sizes_on_low_entropy_data()
+    test_repeated_backups_store_only_new_chunks()
+    test_gc_removes_only_unreferenced_chunks()
+    test_snapshot_streams_back_into_container()
+    test_corrupted_chunk_is_detected()
+    test_encrypted_repository_checks_password()
+    test_encrypted_chunks_are_packed()
+    test_storage_mode_option_and_rotation_hook()
+    print("\n✅ All chunk repository tests passed")
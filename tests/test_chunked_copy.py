@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Test suite for the batched tar-chunk copy used when streaming is not possible.
+Verifies that files are grouped into chunks by size and count, that directories are
+created up front, that each chunk costs one `docker cp -` process with several running
+at once, that progress is still reported per file, and that a file changing while it
+is written fails its chunk.
+
+`docker cp -` is replaced by a local `tar -x` into a temporary directory.
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import subprocess
+
+# Import the module using importlib to handle the dash in filename
+import importlib.util
+spec = importlib.util.spec_from_file_location(
+    "nextcloud_restore",
+    os.path.join(os.path.dirname(__file__), "../src/nextcloud_restore_and_backup-v9.py")
+)
+nextcloud_restore = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(nextcloud_restore)
+
+
+def create_tree(file_count=250, file_size=4096):
+    """Create a folder with nested directories, an empty directory and file_count files."""
+    root = tempfile.mkdtemp(prefix="chunked_copy_src_")
+    os.makedirs(os.path.join(root, "admin", "files", "empty"))
+    for i in range(file_count):
+        folder = os.path.join(root, "admin", "files", f"dir_{i % 7}")
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, f"file {i}.txt"), "wb") as f:
+            f.write(os.urandom(file_size))
+    return root
+
+
+def read_tree(directory):
+    """Map of relative path -> file contents under directory."""
+    tree = {}
+    for dirpath, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(dirpath, name)
+            with open(path, 'rb') as f:
+                tree[os.path.relpath(path, directory)] = f.read()
+    return tree
+
+
+class LocalDockerCp:
+    """Replace `docker cp -` and `docker exec mkdir -p` with local equivalents."""
+
+    def __init__(self):
+        self.processes = 0
+        self.running = 0
+        self.max_running = 0
+        self.directories = []
+        self.lock = threading.Lock()
+
+    def open_stream(self, container_name, base_path):
+        with self.lock:
+            self.processes += 1
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        # A short sleep before tar makes overlapping transfers observable
+        proc = subprocess.Popen(['sh', '-c', 'sleep 0.2; tar -x -f - -C "$0"', base_path],
+                                stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        original_wait = proc.wait
+
+        def wait(timeout=None):
+            returncode = original_wait(timeout)
+            with self.lock:
+                self.running -= 1
+            return returncode
+        proc.wait = wait
+        return proc
+
+    def make_directories(self, container_name, directories, base_path, batch_size=500):
+        self.directories.extend(directories)
+        for path in directories:
+            os.makedirs(os.path.join(base_path, path), exist_ok=True)
+
+    def __enter__(self):
+        self.originals = (nextcloud_restore.open_container_cp_extract_stream,
+                          nextcloud_restore.make_container_directories)
+        nextcloud_restore.open_container_cp_extract_stream = self.open_stream
+        nextcloud_restore.make_container_directories = self.make_directories
+        return self
+
+    def __exit__(self, *exc):
+        (nextcloud_restore.open_container_cp_extract_stream,
+         nextcloud_restore.make_container_directories) = self.originals
+
+
+def test_plan_respects_chunk_limits():
+    """Chunks hold at most max_files files and max_bytes of data."""
+    print("\nTesting chunk planning...")
+    root = create_tree(file_count=100, file_size=1000)
+    try:
+        directories, chunks = nextcloud_restore.plan_tar_chunks(root, max_bytes=10 ** 6, max_files=30)
+        assert [len(chunk) for chunk in chunks] == [30, 30, 30, 10]
+        assert "admin/files/empty" in directories
+
+        directories, chunks = nextcloud_restore.plan_tar_chunks(root, max_bytes=25000, max_files=1000)
+        assert all(sum(size for _, _, size in chunk) <= 25000 for chunk in chunks)
+        assert sum(len(chunk) for chunk in chunks) == 100
+        print(f"  ✓ {len(chunks)} chunks of at most 25 files by size")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def test_chunks_copied_concurrently_with_per_file_progress():
+    """Every file arrives, one process per chunk, several in flight, progress per file."""
+    print("\nTesting chunked copy...")
+    root = create_tree()
+    dest = tempfile.mkdtemp(prefix="chunked_copy_dst_")
+    progress = []
+    try:
+        with LocalDockerCp() as docker:
+            stats = nextcloud_restore.copy_folder_to_container_in_chunks(
+                root, "nextcloud-app", dest, progress_callback=lambda *args: progress.append(args),
+                max_files=40, workers=3)
+        assert read_tree(dest) == read_tree(root)
+        assert os.path.isdir(os.path.join(dest, "admin", "files", "empty"))
+        assert stats['files'] == 250 and stats['chunks'] == 7
+        assert docker.processes == 7, "one docker cp per chunk, not per file"
+        assert docker.max_running > 1, "chunks should be transferred concurrently"
+        assert len(progress) == 250 and progress[-1][:2] == (250, 250)
+        assert progress[-1][3] == progress[-1][4] == 250 * 4096
+        assert {args[2] for args in progress} == {path.replace(os.sep, '/') for path in read_tree(root)}
+        print(f"  ✓ 250 files in {docker.processes} docker cp calls, up to {docker.max_running} at once")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+        shutil.rmtree(dest, ignore_errors=True)
+
+
+def test_failed_chunk_raises():
+    """A failing transfer is reported instead of silently losing files."""
+    print("\nTesting failed chunk...")
+    root = create_tree(file_count=10)
+    dest = tempfile.mkdtemp(prefix="chunked_copy_dst_")
+    try:
+        with LocalDockerCp():
+            nextcloud_restore.open_container_cp_extract_stream = lambda c, base_path: subprocess.Popen(
+                ['sh', '-c', 'cat >/dev/null; echo "Error: No such container: nextcloud-app" >&2; exit 1'],
+                stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            try:
+                nextcloud_restore.copy_folder_to_container_in_chunks(root, "nextcloud-app", dest)
+                assert False, "Expected the transfer to fail"
+            except Exception as e:
+                assert "docker cp of 10 files failed" in str(e), e
+                assert "No such container" in str(e), e
+                print(f"  ✓ Raised: {str(e).splitlines()[0]}")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+        shutil.rmtree(dest, ignore_errors=True)
+
+
+def test_unreadable_file_skipped_but_shrinking_file_fails_chunk():
+    """A file gone before its header is written is skipped; one that shrinks mid-write fails the chunk."""
+    print("\nTesting files that change during the copy...")
+    root = create_tree(file_count=3)
+    dest = tempfile.mkdtemp(prefix="chunked_copy_dst_")
+    original_gettarinfo = nextcloud_restore.tarfile.TarFile.gettarinfo
+    try:
+        chunk = [(os.path.join(root, "admin", "files", f"dir_{i}", f"file {i}.txt"),
+                  f"admin/files/dir_{i}/file {i}.txt", 4096) for i in range(3)]
+        chunk.insert(1, (os.path.join(root, "gone.txt"), "gone.txt", 10))
+        copied = []
+        with LocalDockerCp():
+            nextcloud_restore._send_tar_chunk(chunk, "nextcloud-app", dest, lambda path, size: copied.append(path))
+        assert copied == [rel_path for _, rel_path, _ in chunk if rel_path != "gone.txt"], copied
+        assert read_tree(dest) == read_tree(root)
+        print("  ✓ Missing file skipped, the rest of the chunk arrived")
+
+        def shrinking_gettarinfo(tar, name=None, arcname=None, fileobj=None):
+            member = original_gettarinfo(tar, name, arcname, fileobj)
+            if arcname == chunk[2][1]:
+                member.size += 1000  # the file lost data after it was stat'ed
+            return member
+        nextcloud_restore.tarfile.TarFile.gettarinfo = shrinking_gettarinfo
+        with LocalDockerCp():
+            try:
+                nextcloud_restore._send_tar_chunk(chunk, "nextcloud-app", dest, lambda path, size: None)
+                assert False, "Expected the chunk to fail"
+            except Exception as e:
+                assert f"Failed to copy {chunk[2][1]}" in str(e), e
+                print(f"  ✓ Raised: {e}")
+    finally:
+        nextcloud_restore.tarfile.TarFile.gettarinfo = original_gettarinfo
+        shutil.rmtree(root, ignore_errors=True)
+        shutil.rmtree(dest, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_plan_respects_chunk_limits()
+    test_chunks_copied_concurrently_with_per_file_progress()
+    test_failed_chunk_raises()
+    test_unreadable_file_skipped_but_shrinking_file_fails_chunk()
+    print("\n✅ All chunked copy tests passed")
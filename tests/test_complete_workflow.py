@@ -164,9 +164,9 @@ def test_workflow_history_viewing():
         history_end = len(content)
     history_func = content[history_start:history_end]
     
-    assert 'self.backup_history.get_all_backups()' in history_func, \
+    assert 'BackupHistoryPager(self.backup_history)' in history_func, \
         "Should retrieve all backups"
-    print("   ✓ Retrieves all backups from database")
+    print("   ✓ Pages through all backups in the database")
     
     # System displays backups (most recent first)
     print("\n5. System displays backups in list")
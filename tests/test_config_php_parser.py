@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Test suite for the single-pass config.php parser.
+Verifies that Nextcloud's $CONFIG array is tokenized into its full nested structure
+(comments, escapes, short arrays, numeric keys, getenv() calls), that parsed configs
+are cached by file mtime/size or by the container's config stat/digest, and that the
+database detection and trusted-domain helpers are served from that one parse.
+"""
+
+import os
+import sys
+import time
+import tempfile
+import subprocess
+
+# Import the module using importlib to handle the dash in filename
+import importlib.util
+spec = importlib.util.spec_from_file_location(
+    "nextcloud_restore",
+    os.path.join(os.path.dirname(__file__), "../src/nextcloud_restore_and_backup-v9.py")
+)
+nextcloud_restore = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(nextcloud_restore)
+
+CONFIG_PHP = r"""<?php
+// Written by the Nextcloud installer
+$CONFIG = array (
+  'htaccess.RewriteBase' => '/',
+  'memcache.local' => '\\OC\\Memcache\\APCu',
+  'apps_paths' =>
+  array (
+    0 =>
+    array (
+      'path' => '/var/www/html/apps',
+      'url' => '/apps',
+      'writable' => false,
+    ),
+  ),
+  'instanceid' => 'oc5x2lq9',
+  # hash-style comment
+  'passwordsalt' => 'it\'s "salty"',
+  'trusted_domains' =>
+  array (
+    0 => 'localhost',
+    2 => "cloud.example.com",   /* index 1 was removed */
+  ),
+  'datadirectory' => '/var/www/html/data',
+  'dbtype' => 'SQLite3',
+  'version' => '28.0.4.1',
+  'overwrite.cli.url' => 'http://' . 'localhost',
+  'dbname' => 'nextcloud',
+  'dbhost' => getenv('DB_HOST'),
+  'dbport' => 5432,
+  'dbuser' => '',
+  'installed' => true,
+  'maintenance' => false,
+  'loglevel' => 2,
+  'trusted_proxies' => ['10.0.0.1', '10.0.0.2'],
+);
+"""
+
+
+def write_config(directory, text=CONFIG_PHP):
+    path = os.path.join(directory, 'config.php')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    return path
+
+
+def test_parses_full_structure():
+    """Nested arrays, comments, escapes, concatenation and unevaluated calls."""
+    print("\nTesting config.php parsing...")
+    config = nextcloud_restore.parse_config_php_source(CONFIG_PHP)
+    assert config['apps_paths'] == [{'path': '/var/www/html/apps', 'url': '/apps', 'writable': False}]
+    assert config['memcache.local'] == '\\OC\\Memcache\\APCu'
+    assert config['passwordsalt'] == 'it\'s "salty"'
+    assert config['trusted_domains'] == {0: 'localhost', 2: 'cloud.example.com'}
+    assert config['overwrite.cli.url'] == 'http://localhost'
+    assert config['dbhost'] is None and config['dbport'] == 5432 and config['installed'] is True
+    assert config['trusted_proxies'] == ['10.0.0.1', '10.0.0.2']
+    try:
+        nextcloud_restore.parse_config_php_source("<?php\n$CONFIG = array('a' => 'b'")
+        assert False, "truncated config accepted"
+    except nextcloud_restore.ConfigPHPParseError:
+        pass
+    print(f"  ✓ {len(config)} settings parsed in one pass")
+
+
+def test_file_helpers_share_one_parse():
+    """Both file helpers reuse the parse until the file's mtime changes."""
+    print("\nTesting file cache...")
+    original = nextcloud_restore.parse_config_php_source
+    parses = []
+
+    def counting_parse(source):
+        parses.append(source)
+        return original(source)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = write_config(tmp)
+        try:
+            nextcloud_restore.parse_config_php_source = counting_parse
+            for _ in range(5):
+                dbtype, db_config = nextcloud_restore.parse_config_php_dbtype(path)
+                full = nextcloud_restore.parse_config_php_full(path)
+            assert dbtype == 'sqlite' and db_config == {'dbtype': 'sqlite', 'dbname': 'nextcloud'}
+            assert full['trusted_domains'] == ['localhost', 'cloud.example.com']
+            assert full['dbport'] == '5432' and 'dbhost' not in full and 'dbuser' not in full
+            assert len(parses) == 1, f"{len(parses)} parses"
+
+            write_config(tmp, CONFIG_PHP.replace("'SQLite3'", "'pgsql'"))
+            stat = os.stat(path)
+            os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+            assert nextcloud_restore.parse_config_php_dbtype(path)[0] == 'pgsql'
+            assert len(parses) == 2
+        finally:
+            nextcloud_restore.parse_config_php_source = original
+    print("  ✓ 10 lookups from 1 parse; re-parsed after the file changed")
+
+
+class FakeContainerConfig:
+    """config.php inside a container, read through docker_exec / docker_stat_path."""
+
+    def __init__(self, text, with_stat):
+        self.text = text
+        self.with_stat = with_stat
+        self.reads = 0
+        self.mtime = '2026-01-01T00:00:00Z'
+
+    def __enter__(self):
+        self.original = (nextcloud_restore.docker_exec, nextcloud_restore.docker_stat_path)
+
+        def exec_(container_name, cmd, input=None, timeout=None):
+            assert cmd == ['cat', nextcloud_restore.NEXTCLOUD_CONFIG_PHP_PATH]
+            self.reads += 1
+            return subprocess.CompletedProcess(cmd, 0, self.text.encode('utf-8'), b'')
+
+        def stat(container_name, path):
+            if not self.with_stat:
+                return None
+            return {'name': 'config.php', 'size': len(self.text), 'mtime': self.mtime}
+        nextcloud_restore.docker_exec = exec_
+        nextcloud_restore.docker_stat_path = stat
+        return self
+
+    def __exit__(self, *exc):
+        nextcloud_restore.docker_exec, nextcloud_restore.docker_stat_path = self.original
+
+
+def test_container_config_cached_by_stat():
+    """With the Engine API the file is transferred only when its stat changes."""
+    print("\nTesting container cache (stat)...")
+    with FakeContainerConfig(CONFIG_PHP.replace('oc5x2lq9', 'stat0001'), with_stat=True) as fake:
+        for _ in range(5):
+            assert nextcloud_restore.detect_database_type_from_container('nc-app')[0] == 'sqlite'
+        assert fake.reads == 1, f"{fake.reads} reads"
+        fake.text = fake.text.replace("'SQLite3'", "'mysql'")
+        fake.mtime = '2026-01-01T00:00:05Z'
+        assert nextcloud_restore.detect_database_type_from_container('nc-app')[0] == 'mysql'
+        assert fake.reads == 2
+    print("  ✓ 6 detections, 2 transfers")
+
+
+def test_container_config_cached_by_digest():
+    """Through the CLI the file is read each time but parsed once per content."""
+    print("\nTesting container cache (digest)...")
+    original = nextcloud_restore.parse_config_php_source
+    parses = []
+
+    def counting_parse(source):
+        parses.append(source)
+        return original(source)
+    try:
+        nextcloud_restore.parse_config_php_source = counting_parse
+        with FakeContainerConfig(CONFIG_PHP.replace('oc5x2lq9', 'digest01'), with_stat=False) as fake:
+            for _ in range(3):
+                dbtype, db_config = nextcloud_restore.detect_database_type_from_container('nc-app')
+            assert (dbtype, db_config) == ('sqlite', {'dbtype': 'sqlite', 'dbname': 'nextcloud'})
+            assert fake.reads == 3 and len(parses) == 1
+    finally:
+        nextcloud_restore.parse_config_php_source = original
+    print("  ✓ 3 reads, 1 parse")
+
+
+def test_trusted_domains_from_parser():
+    """The GUI's trusted-domain helpers read the parsed config instead of their own regexes."""
+    print("\nTesting trusted domain helpers...")
+    src_path = os.path.join(os.path.dirname(__file__), "../src/nextcloud_restore_and_backup-v9.py")
+    with open(src_path, 'r') as f:
+        content = f.read()
+    for name in ('_get_trusted_domains', '_remove_trusted_domain', '_update_trusted_domains'):
+        start = content.find(f'def {name}(')
+        method = content[start:content.find('\n    def ', start + 10)]
+        assert '"cat", "/var/www/html/config/config.php"' not in method, name
+        assert 'load_container_config_php' in method or 'self._get_trusted_domains' in method, name
+    print("  ✓ Trusted domains come from the cached parse")
+
+
+if __name__ == "__main__":
+    test_parses_full_structure()
+    test_file_helpers_share_one_parse()
+    test_container_config_cached_by_stat()
+    test_container_config_cached_by_digest()
+    test_trusted_domains_from_parser()
+    print("\n✅ All config.php parser tests passed")
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Test suite for the event-driven container state cache.
+Verifies that containers are listed once and then kept current from the Docker event
+stream (start/stop/die/rename/destroy, network connect/disconnect), that lookups and
+health checks are answered from memory, that subscribers are notified of changes,
+that a dropped stream is re-subscribed, that the app's own docker run and network
+connect calls invalidate the cache, and that without the Engine API the cache
+re-lists at most once per TTL.
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import threading
+import subprocess
+
+# Import the module using importlib to handle the dash in filename
+import importlib.util
+spec = importlib.util.spec_from_file_location(
+    "nextcloud_restore",
+    os.path.join(os.path.dirname(__file__), "../src/nextcloud_restore_and_backup-v9.py")
+)
+nextcloud_restore = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(nextcloud_restore)
+
+
+class FakeEventStream:
+    """An /events response whose lines are fed by the test."""
+
+    def __init__(self):
+        self.lines = queue.Queue()
+
+    def readline(self, limit=-1):
+        return self.lines.get(timeout=10)
+
+    def abort(self):
+        self.lines.put(b'')
+
+    def close(self):
+        pass
+
+
+class FakeEngineClient:
+    """Stands in for DockerEngineClient: container listings and event streams."""
+
+    def __init__(self, containers):
+        self.containers = containers
+        self.list_calls = 0
+        self.streams = []
+
+    def list_containers(self, all_containers=False, filters=None):
+        self.list_calls += 1
+        return [{'Id': f'id-{name}', 'Names': [f'/{name}'], 'Image': image, 'State': 'running', 'Labels': {},
+                 'NetworkSettings': {'Networks': {'nc_default': {}}}} for name, image in self.containers]
+
+    def open_events(self, filters=None, since=None, until=None, timeout=None):
+        assert filters == nextcloud_restore.CONTAINER_EVENT_FILTERS
+        self.streams.append(FakeEventStream())
+        return self.streams[-1]
+
+    def send(self, event):
+        self.streams[-1].lines.put(json.dumps(event).encode() + b'\n')
+
+
+def container_event(action, created_as, **attributes):
+    """An event for the container created as `created_as` (Attributes carry its current name)."""
+    return {'Type': 'container', 'Action': action,
+            'Actor': {'ID': f'id-{created_as}', 'Attributes': dict({'name': created_as}, **attributes)}}
+
+
+class CacheFixture:
+    """Install a fresh cache (and optionally a fake API client) as the module's shared one."""
+
+    def __init__(self, client=None, ttl=nextcloud_restore.CONTAINER_CACHE_TTL):
+        self.client = client
+        self.cache = nextcloud_restore.ContainerStateCache(ttl=ttl)
+        self.changes = queue.Queue()
+
+    def __enter__(self):
+        self.original = (nextcloud_restore.get_docker_client, nextcloud_restore._container_cache)
+        nextcloud_restore.get_docker_client = lambda: self.client
+        nextcloud_restore._container_cache = self.cache
+        self.cache.subscribe(lambda *change: self.changes.put(change))
+        return self
+
+    def __exit__(self, *exc):
+        self.cache.stop()
+        nextcloud_restore.get_docker_client, nextcloud_restore._container_cache = self.original
+
+    def next_change(self):
+        return self.changes.get(timeout=5)
+
+    def prime(self):
+        """First lookup: the initial listing is itself announced as a 'refresh'."""
+        self.cache.containers()
+        assert self.next_change() == ('refresh', None, None)
+
+
+def test_lookups_served_from_one_listing():
+    """Container-name lookups, DB detection, networks and health checks reuse one listing."""
+    print("\nTesting in-memory lookups...")
+    client = FakeEngineClient([('nextcloud-app', 'nextcloud:28'), ('nextcloud-db', 'postgres:16')])
+    with CacheFixture(client) as fixture:
+        for _ in range(20):
+            assert nextcloud_restore.get_nextcloud_container_name() == 'nextcloud-app'
+            assert nextcloud_restore.get_postgres_container_name() == 'nextcloud-db'
+            assert [c['name'] for c in nextcloud_restore.list_running_database_containers()] == ['nextcloud-db']
+            assert nextcloud_restore.check_container_network('nextcloud-app', 'nc_default')
+        assert fixture.cache.is_live()
+        assert nextcloud_restore.detect_docker_status()['status'] == 'running'
+        health = nextcloud_restore.check_service_health()
+        assert health['docker']['status'] == 'healthy' and health['nextcloud']['status'] == 'healthy'
+        assert client.list_calls == 1, f"{client.list_calls} listings"
+        print(f"  ✓ 82 lookups and a health check from {client.list_calls} listing")
+
+
+def test_events_keep_cache_current():
+    """Start, die, rename, destroy and network events update the cache and notify subscribers."""
+    print("\nTesting event application...")
+    client = FakeEngineClient([('nextcloud-app', 'nextcloud:28')])
+    with CacheFixture(client) as fixture:
+        cache = fixture.cache
+        fixture.prime()
+        assert cache.get('nextcloud-app')['state'] == 'running'
+
+        client.send(container_event('die', 'nextcloud-app'))
+        assert fixture.next_change()[:2] == ('die', 'nextcloud-app')
+        assert nextcloud_restore.get_nextcloud_container_name() is None
+
+        client.send(container_event('start', 'nextcloud-db', image='postgres:16', tier='db'))
+        action, name, container = fixture.next_change()
+        assert (action, container['state'], container['labels']) == ('start', 'running', {'tier': 'db'})
+        assert nextcloud_restore.get_postgres_container_name() == 'nextcloud-db'
+
+        client.send({'Type': 'network', 'Action': 'connect',
+                     'Actor': {'ID': 'net1', 'Attributes': {'container': 'id-nextcloud-db', 'name': 'bridge'}}})
+        assert fixture.next_change()[2]['networks'] == {'bridge'}
+        assert nextcloud_restore.get_container_networks('nextcloud-db') == {'bridge'}
+
+        client.send(container_event('rename', 'nextcloud-db', name='db-old', oldName='/nextcloud-db'))
+        assert fixture.next_change()[:2] == ('rename', 'db-old')
+        assert cache.get('nextcloud-db') is None and cache.get('db-old')['image'] == 'postgres:16'
+
+        client.send(container_event('destroy', 'nextcloud-db', name='db-old'))
+        assert fixture.next_change() == ('destroy', 'db-old', None)
+        assert [c['name'] for c in cache.containers(running_only=False)] == ['nextcloud-app']
+        assert client.list_calls == 1
+        print("  ✓ Cache follows events without re-listing")
+
+
+def test_dropped_stream_is_resubscribed():
+    """When the event stream ends the cache re-lists and subscribes again."""
+    print("\nTesting reconnection...")
+    original_retry = nextcloud_restore.CONTAINER_EVENTS_RETRY_SECONDS
+    nextcloud_restore.CONTAINER_EVENTS_RETRY_SECONDS = 0.05
+    client = FakeEngineClient([('nextcloud-app', 'nextcloud:28')])
+    try:
+        with CacheFixture(client) as fixture:
+            fixture.prime()
+            client.containers.append(('nextcloud-db', 'postgres:16'))
+            client.streams[-1].abort()
+            assert fixture.next_change() == ('refresh', None, None)
+            deadline = time.monotonic() + 5
+            while not fixture.cache.is_live() and time.monotonic() < deadline:
+                time.sleep(0.01)
+            assert len(client.streams) == 2 and client.list_calls == 2
+            assert fixture.cache.get('nextcloud-db')['state'] == 'running'
+        print("  ✓ Re-listed and re-subscribed after the stream dropped")
+    finally:
+        nextcloud_restore.CONTAINER_EVENTS_RETRY_SECONDS = original_retry
+
+
+def test_own_changes_invalidate_cache():
+    """After the app connects or creates a container the next lookup re-lists, even while live."""
+    print("\nTesting invalidation...")
+    original_run = nextcloud_restore.run_docker_command_silent
+    client = FakeEngineClient([('nextcloud-app', 'nextcloud:28')])
+    try:
+        nextcloud_restore.run_docker_command_silent = \
+            lambda cmd, timeout=10: subprocess.CompletedProcess(cmd, 0, "", "")
+        with CacheFixture(client) as fixture:
+            fixture.prime()
+            assert fixture.cache.is_live()
+            # The connect event has not arrived yet; the listing already shows the network
+            client.containers[0] = ('nextcloud-app', 'nextcloud:29')
+            assert nextcloud_restore.attach_container_to_network('nextcloud-app', 'bridge')
+            assert fixture.cache.get('nextcloud-app')['image'] == 'nextcloud:29'
+            assert client.list_calls == 2
+            fixture.cache.get('nextcloud-app')
+            assert client.list_calls == 2, "live cache is trusted again after the re-listing"
+    finally:
+        nextcloud_restore.run_docker_command_silent = original_run
+
+    src_path = os.path.join(os.path.dirname(__file__), "../src/nextcloud_restore_and_backup-v9.py")
+    with open(src_path, 'r') as f:
+        content = f.read()
+    runs = [i for i in range(len(content)) if content.startswith("f'docker run -d --name {", i)]
+    for start in runs:
+        name = content[start + len("f'docker run -d --name {"):content.find('}', start)]
+        following = content[start:content.find('if result.returncode != 0:', start)]
+        assert f"get_container_cache().invalidate({name})" in following, name
+    print(f"  ✓ Network connect and {len(runs)} docker run calls invalidate the cache")
+
+
+def test_cli_fallback_relists_once_per_ttl():
+    """Without the Engine API, `docker ps -a` runs at most once per TTL."""
+    print("\nTesting CLI fallback...")
+    original_run = nextcloud_restore.run_docker_command_silent
+    output = ["id1\tnextcloud-app\tnextcloud:28\trunning\t\tbridge\n"]
+    calls = []
+
+    def fake_run(cmd, timeout=10):
+        calls.append(cmd)
+        return subprocess.CompletedProcess(cmd, 0, output[0], "")
+    try:
+        nextcloud_restore.run_docker_command_silent = fake_run
+        with CacheFixture(client=None, ttl=60) as fixture:
+            fixture.prime()
+            for _ in range(10):
+                assert nextcloud_restore.get_nextcloud_container_name() == 'nextcloud-app'
+            assert len(calls) == 1 and calls[0][:3] == ['docker', 'ps', '-a']
+            assert not fixture.cache.is_live()
+
+            output[0] = "id1\tnextcloud-app\tnextcloud:28\texited\t\tbridge\n"
+            fixture.cache.refresh()
+            assert fixture.next_change() == ('refresh', None, None)
+            assert nextcloud_restore.get_nextcloud_container_name() is None
+        print(f"  ✓ {len(calls)} docker ps calls for 11 lookups")
+    finally:
+        nextcloud_restore.run_docker_command_silent = original_run
+
+
+def test_health_dashboard_subscribes_to_changes():
+    """The landing page's health dashboard refreshes on container changes instead of polling."""
+    print("\nTesting dashboard subscription...")
+    src_path = os.path.join(os.path.dirname(__file__), "../src/nextcloud_restore_and_backup-v9.py")
+    with open(src_path, 'r') as f:
+        content = f.read()
+    assert "get_container_cache().subscribe(lambda *change: self.progress_bus.post('containers', *change))" in content
+    start = content.find('def _add_health_dashboard(')
+    method = content[start:content.find('\n    def ', start + 10)]
+    assert "self.progress_bus.subscribe('containers', on_container_change)" in method
+    print("  ✓ Dashboard listens on the 'containers' channel")
+
+
+if __name__ == "__main__":
+    test_lookups_served_from_one_listing()
+    test_events_keep_cache_current()
+    test_dropped_stream_is_resubscribed()
+    test_own_changes_invalidate_cache()
+    test_cli_fallback_relists_once_per_ttl()
+    test_health_dashboard_subscribes_to_changes()
+    print("\n✅ All container state cache tests passed")
@@ -67,14 +67,14 @@ def test_copy_progress_callback_parameter():
         return False
 
 def test_file_by_file_copying():
-    """Test that files are copied one by one"""
+    """Test that files are reported one by one while copied in tar chunks"""
     print("\nTesting file-by-file copying implementation...")
     try:
         with open(get_script_path(), 'r') as f:
             content = f.read()
         
-        # Check for file iteration
-        if 'for filepath, rel_path in all_files:' in content:
+        # Check for file iteration inside each tar chunk
+        if 'for file_path, rel_path, _ in chunk:' in content:
             print("  ✓ File iteration loop found")
         else:
             print("  ✗ File iteration loop not found")
@@ -125,9 +125,9 @@ def test_thread_safe_ui_updates():
         with open(get_script_path(), 'r') as f:
             content = f.read()
         
-        # Check for self.after() usage in copy progress callback
-        if 'self.after(0, update_ui)' in content and 'copy_progress_callback' in content:
-            print("  ✓ Thread-safe UI updates using self.after() found")
+        # Copy progress is posted to the progress bus and applied on the main loop
+        if "self.progress_bus.post('copy'" in content and "self.progress_bus.subscribe('copy', show_copy_progress)" in content:
+            print("  ✓ Thread-safe UI updates through the progress bus found")
             return True
         else:
             print("  ✗ Thread-safe UI updates not properly implemented")
@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+"""
+Test suite for the Docker Engine API client.
+Verifies that container listing and inspection share one keep-alive connection, that
+exec runs with separated stdout/stderr, exit codes and streamed stdin, that archive
+get/put replace `docker cp`, that events stream as they arrive, and that the helpers
+fall back to the docker CLI when no API socket is usable.
+
+The daemon is a local fake speaking the Engine API over a Unix socket; "containers"
+run their exec commands on the host and archive paths are host paths.
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import struct
+import tarfile
+import tempfile
+import threading
+import subprocess
+import socketserver
+import http.server
+from urllib.parse import urlparse, parse_qs, unquote
+
+# Import the module using importlib to handle the dash in filename
+import importlib.util
+spec = importlib.util.spec_from_file_location(
+    "nextcloud_restore",
+    os.path.join(os.path.dirname(__file__), "../src/nextcloud_restore_and_backup-v9.py")
+)
+nextcloud_restore = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(nextcloud_restore)
+
+CONTAINERS = {
+    'nextcloud-app': {'Image': 'nextcloud:28', 'Labels': {'com.docker.compose.project': 'nc'},
+                      'Networks': ['nc_default'], 'Ports': {'80/tcp': [{'HostIp': '0.0.0.0', 'HostPort': '8080'}]},
+                      'Env': ['NEXTCLOUD_ADMIN_USER=admin']},
+    'nextcloud-db': {'Image': 'postgres:16', 'Labels': {}, 'Networks': ['nc_default'], 'Ports': {},
+                     'Env': ['POSTGRES_DB=nextcloud', 'POSTGRES_USER=nextcloud']},
+    'other-db': {'Image': 'mariadb:11', 'Labels': {}, 'Networks': ['bridge'], 'Ports': {}, 'Env': []},
+}
+
+
+class FakeDockerHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.daemon.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, payload, status=200):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_body(self):
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return b''.join(chunks)
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def route(self):
+        url = urlparse(self.path)
+        assert url.path.startswith('/v1.41/'), url.path
+        return url.path[len('/v1.41'):].split('/')[1:], {k: v[0] for k, v in parse_qs(url.query).items()}
+
+    def container(self, name):
+        name = unquote(name)
+        if name not in CONTAINERS:
+            self.send_json({'message': f'No such container: {name}'}, 404)
+            return None
+        return name
+
+    def do_GET(self):
+        daemon = self.server.daemon
+        parts, query = self.route()
+        daemon.requests.append(('GET', '/'.join(parts)))
+        if parts == ['_ping']:
+            self.send_response(200)
+            self.send_header('Content-Length', '2')
+            self.end_headers()
+            self.wfile.write(b'OK')
+        elif parts == ['containers', 'json']:
+            self.send_json([{'Id': f'id-{name}', 'Names': [f'/{name}'], 'Image': info['Image'],
+                             'State': 'running', 'Labels': info['Labels'],
+                             'NetworkSettings': {'Networks': {net: {} for net in info['Networks']}}}
+                            for name, info in CONTAINERS.items()])
+        elif parts[0] == 'containers' and parts[2] == 'json':
+            name = self.container(parts[1])
+            if name:
+                info = CONTAINERS[name]
+                self.send_json({'Id': f'id-{name}', 'Name': f'/{name}', 'Config': {'Env': info['Env']},
+                                'NetworkSettings': {'Networks': {net: {} for net in info['Networks']},
+                                                    'Ports': info['Ports']}})
+        elif parts[0] == 'exec' and parts[2] == 'json':
+            self.send_json({'Running': False, 'ExitCode': daemon.execs[parts[1]].get('exit_code')})
+        elif parts[0] == 'containers' and parts[2] == 'archive':
+            if self.container(parts[1]):
+                path = query['path'].rstrip('/')
+                if not os.path.exists(path):
+                    self.send_json({'message': f'Could not find the file {path} in container'}, 404)
+                    return
+                buffer = io.BytesIO()
+                with tarfile.open(fileobj=buffer, mode='w') as tar:
+                    tar.add(path, arcname=os.path.basename(path))
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-tar')
+                self.send_header('Content-Length', str(len(buffer.getvalue())))
+                self.end_headers()
+                self.wfile.write(buffer.getvalue())
+        elif parts == ['events']:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            if 'until' not in query:
+                # A subscription (the container cache): stay connected until the daemon stops
+                self.wfile.flush()
+                daemon.closing.wait()
+                self.close_connection = True
+                return
+            for action in ('start', 'die'):
+                self.wfile.write(json.dumps({'Type': 'container', 'Action': action,
+                                             'Actor': {'Attributes': {'name': 'nextcloud-app'}},
+                                             'filters': query.get('filters')}).encode() + b'\n')
+                self.wfile.flush()
+                time.sleep(0.05)
+            self.close_connection = True
+
+    def do_PUT(self):
+        parts, query = self.route()
+        body = self.read_body()
+        if self.container(parts[1]):
+            with tarfile.open(fileobj=io.BytesIO(body), mode='r') as tar:
+                tar.extractall(query['path'])
+            self.server.daemon.uploads.append((query['path'], len(body), query.get('copyUIDGID')))
+            self.send_response(200)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+    def do_POST(self):
+        daemon = self.server.daemon
+        parts, query = self.route()
+        config = json.loads(self.read_body() or b'{}')
+        if parts[0] == 'containers' and parts[2] == 'exec':
+            if self.container(parts[1]):
+                exec_id = f'exec{len(daemon.execs)}'
+                daemon.execs[exec_id] = {'config': config}
+                self.send_json({'Id': exec_id}, 201)
+        elif parts[0] == 'exec' and parts[2] == 'start':
+            self.start_exec(daemon.execs[parts[1]])
+
+    def start_exec(self, exec_info):
+        config = exec_info['config']
+        self.wfile.write(b'HTTP/1.1 101 UPGRADED\r\nContent-Type: application/vnd.docker.raw-stream\r\n'
+                         b'Connection: Upgrade\r\nUpgrade: tcp\r\n\r\n')
+        self.wfile.flush()
+        proc = subprocess.Popen(config['Cmd'], stdin=subprocess.PIPE if config['AttachStdin'] else subprocess.DEVNULL,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        lock = threading.Lock()
+
+        def pump_out(pipe, stream_type):
+            for data in iter(lambda: pipe.read1(65536), b''):
+                with lock:
+                    self.wfile.write(struct.pack('>BxxxL', stream_type, len(data)) + data)
+                    self.wfile.flush()
+
+        def pump_in():
+            try:
+                for data in iter(lambda: self.rfile.read1(65536), b''):
+                    proc.stdin.write(data)
+            except OSError:
+                pass
+            finally:
+                try:
+                    proc.stdin.close()
+                except OSError:
+                    pass
+        threads = [threading.Thread(target=pump_out, args=(proc.stdout, 1)),
+                   threading.Thread(target=pump_out, args=(proc.stderr, 2))]
+        if config['AttachStdin']:
+            threading.Thread(target=pump_in, daemon=True).start()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        exec_info['exit_code'] = proc.wait()
+        self.close_connection = True
+
+
+class FakeDockerDaemon:
+    """Threaded Engine API stand-in on a temporary Unix socket; points DOCKER_HOST at it."""
+
+    def __init__(self):
+        self.connections = 0
+        self.requests = []
+        self.execs = {}
+        self.uploads = []
+        self.closing = threading.Event()
+
+    def __enter__(self):
+        self.dir = tempfile.mkdtemp(prefix="fake_docker_")
+        self.socket_path = os.path.join(self.dir, "docker.sock")
+        self.server = socketserver.ThreadingUnixStreamServer(self.socket_path, FakeDockerHandler)
+        self.server.daemon_threads = True
+        self.server.daemon = self
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.original_host = os.environ.get('DOCKER_HOST')
+        os.environ['DOCKER_HOST'] = f"unix://{self.socket_path}"
+        nextcloud_restore.reset_docker_client()
+        nextcloud_restore._container_cache = nextcloud_restore.ContainerStateCache()
+        return self
+
+    def __exit__(self, *exc):
+        self.closing.set()
+        nextcloud_restore._container_cache.stop()
+        nextcloud_restore._container_cache = None
+        nextcloud_restore.reset_docker_client()
+        if self.original_host is None:
+            os.environ.pop('DOCKER_HOST', None)
+        else:
+            os.environ['DOCKER_HOST'] = self.original_host
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+def read_tree(directory):
+    tree = {}
+    for dirpath, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(dirpath, name)
+            with open(path, 'rb') as f:
+                tree[os.path.relpath(path, directory)] = f.read()
+    return tree
+
+
+def make_tree(root, count=40):
+    for i in range(count):
+        folder = os.path.join(root, "data", "admin", "files", f"dir_{i % 4}")
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, f"file {i}.txt"), "wb") as f:
+            f.write(os.urandom(100 * i))
+
+
+def test_queries_share_one_connection():
+    """Listing and inspection helpers run over a single keep-alive connection."""
+    print("\nTesting list/inspect over the Engine API...")
+    with FakeDockerDaemon() as daemon:
+        assert nextcloud_restore.docker_ping()
+        assert nextcloud_restore.get_nextcloud_container_name() == 'nextcloud-app'
+        assert nextcloud_restore.get_nextcloud_port() == 8080
+        db_containers = nextcloud_restore.list_running_database_containers()
+        assert [(c['name'], c['type']) for c in db_containers] == [('nextcloud-db', 'pgsql'), ('other-db', 'mariadb')]
+        assert nextcloud_restore.inspect_container_environment('nextcloud-db')['POSTGRES_USER'] == 'nextcloud'
+        assert nextcloud_restore.check_container_network('nextcloud-app', 'nc_default')
+        assert nextcloud_restore.docker_inspect_container('missing') is None
+        # One pooled connection for all requests, one for the container cache's event stream
+        assert daemon.connections == 2, f"{daemon.connections} connections for {len(daemon.requests)} requests"
+        print(f"  ✓ {len(daemon.requests)} requests on 1 connection (plus the event stream)")
+
+
+def test_exec_run_and_streamed_io():
+    """Exit codes, separated stdout/stderr, stdin input and Popen-style streaming."""
+    print("\nTesting exec...")
+    work_dir = tempfile.mkdtemp(prefix="docker_api_exec_")
+    try:
+        with FakeDockerDaemon():
+            result = nextcloud_restore.docker_exec('nextcloud-app', ['sh', '-c', 'echo out; echo err >&2; exit 3'])
+            assert (result.returncode, result.stdout, result.stderr) == (3, b'out\n', b'err\n')
+            payload = os.urandom(3 * 1024 * 1024)
+            assert nextcloud_restore.docker_exec('nextcloud-app', ['cat'], input=payload).stdout == payload
+            missing = nextcloud_restore.docker_exec('missing', ['true'])
+            assert missing.returncode == 1 and b'No such container' in missing.stderr
+            text = nextcloud_restore.run_docker_command_silent(['docker', 'exec', 'nextcloud-app', 'echo', 'hi'])
+            assert text.returncode == 0 and text.stdout == 'hi\n'
+
+            source = os.path.join(work_dir, "source")
+            make_tree(source)
+            proc = nextcloud_restore.open_container_tar_stream('nextcloud-app', ['data'], source)
+            with tarfile.open(fileobj=proc.stdout, mode='r|') as tar:
+                names = [member.name for member in tar]
+            proc.stdout.close()
+            assert proc.wait() == 0 and "data/admin/files/dir_1/file 5.txt" in names
+
+            dest = os.path.join(work_dir, "dest")
+            os.makedirs(dest)
+            proc = nextcloud_restore.open_container_tar_extract_stream('nextcloud-app', dest)
+            with tarfile.open(fileobj=proc.stdin, mode='w|') as tar:
+                tar.add(os.path.join(source, "data"), arcname="data")
+            proc.stdin.close()
+            assert proc.wait() == 0
+            assert read_tree(dest) == read_tree(source)
+        print("  ✓ exec results, stdin input and tar streams in both directions")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def test_archive_get_and_put():
+    """docker cp streams and the chunked folder copy go through the archive endpoints."""
+    print("\nTesting archive transfers...")
+    work_dir = tempfile.mkdtemp(prefix="docker_api_archive_")
+    try:
+        with FakeDockerDaemon() as daemon:
+            source = os.path.join(work_dir, "source")
+            make_tree(source)
+            proc = nextcloud_restore.open_container_folder_cp_stream('nextcloud-app', 'data', source)
+            with tarfile.open(fileobj=proc.stdout, mode='r|') as tar:
+                names = [member.name for member in tar]
+            proc.stdout.close()
+            assert proc.wait() == 0 and "data/admin/files/dir_2/file 6.txt" in names
+            proc = nextcloud_restore.open_container_folder_cp_stream('nextcloud-app', 'nope', source)
+            proc.wait()
+            assert proc.returncode == 1 and b'Could not find' in proc.stderr.read()
+
+            dest = os.path.join(work_dir, "dest")
+            os.makedirs(dest)
+            stats = nextcloud_restore.copy_folder_to_container_in_chunks(
+                os.path.join(source, "data"), 'nextcloud-app', dest, max_files=15)
+            assert read_tree(dest) == read_tree(os.path.join(source, "data"))
+            assert stats['chunks'] == len(daemon.uploads) == 3
+            assert all(copy_uid_gid == 'true' for _, _, copy_uid_gid in daemon.uploads)
+        print(f"  ✓ {len(names)} entries read, {stats['files']} files uploaded in {stats['chunks']} PUTs")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def test_events_stream():
+    """Events are yielded one by one with filters passed through."""
+    print("\nTesting events...")
+    with FakeDockerDaemon():
+        client = nextcloud_restore.get_docker_client()
+        events = list(client.events(filters={'type': ['container']}, until=int(time.time()), timeout=5))
+        assert [event['Action'] for event in events] == ['start', 'die']
+        assert json.loads(events[0]['filters']) == {'type': ['container']}
+        print("  ✓ 2 events received")
+
+
+def test_cli_fallback_without_socket():
+    """Without a usable socket the helpers run the docker CLI as before."""
+    print("\nTesting CLI fallback...")
+    original_host = os.environ.get('DOCKER_HOST')
+    original_run = nextcloud_restore.run_docker_command_silent
+    calls = []
+
+    def fake_run(cmd, timeout=10):
+        calls.append(cmd)
+        return subprocess.CompletedProcess(cmd, 0, "abc123\tnextcloud-app\tnextcloud:28\trunning\t"
+                                                   "com.docker.compose.project=nc,tier=web\tnc_default\n", "")
+    try:
+        os.environ['DOCKER_HOST'] = "unix:///nonexistent/docker.sock"
+        nextcloud_restore.reset_docker_client()
+        nextcloud_restore.run_docker_command_silent = fake_run
+        assert nextcloud_restore.get_docker_client() is None
+        containers = nextcloud_restore.docker_list_containers()
+        assert containers == [{'id': 'abc123', 'name': 'nextcloud-app', 'image': 'nextcloud:28', 'state': 'running',
+                               'labels': {'com.docker.compose.project': 'nc', 'tier': 'web'},
+                               'networks': {'nc_default'}}]
+        assert calls and calls[0][:2] == ['docker', 'ps']
+        print("  ✓ docker ps used when the socket is missing")
+    finally:
+        nextcloud_restore.run_docker_command_silent = original_run
+        if original_host is None:
+            os.environ.pop('DOCKER_HOST', None)
+        else:
+            os.environ['DOCKER_HOST'] = original_host
+        nextcloud_restore.reset_docker_client()
+
+
+if __name__ == "__main__":
+    test_queries_share_one_connection()
+    test_exec_run_and_streamed_io()
+    test_archive_get_and_put()
+    test_events_stream()
+    test_cli_fallback_without_socket()
+    print("\n✅ All Docker Engine API tests passed")
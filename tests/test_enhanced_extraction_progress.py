@@ -101,8 +101,8 @@ def test_prepare_callback_implementation():
         return False
 
 def test_thread_safe_updates():
-    """Test that UI updates use Tkinter's after() method"""
-    print("\nTesting thread-safe UI updates with after()...")
+    """Test that extraction UI updates go through the progress bus"""
+    print("\nTesting thread-safe UI updates through the progress bus...")
     try:
         with open(get_script_path(), 'r') as f:
             content = f.read()
@@ -112,16 +112,15 @@ def test_thread_safe_updates():
             print("  ✗ extraction_progress_callback not found")
             return False
         
-        # Look for the update_ui function and after() call
-        # The pattern should be flexible to handle different indentation
-        if 'def update_ui():' in content or 'def update_ui(' in content:
-            print("  ✓ update_ui inner function found for encapsulating UI updates")
+        # The worker posts to the progress bus; show_extraction_progress renders on the main loop
+        if 'def show_extraction_progress(' in content:
+            print("  ✓ show_extraction_progress function found for encapsulating UI updates")
         else:
-            print("  ✗ update_ui inner function not found")
+            print("  ✗ show_extraction_progress function not found")
             return False
         
-        if 'self.after(0, update_ui)' in content or 'self.after(0,update_ui)' in content:
-            print("  ✓ self.after(0, update_ui) call found for thread-safe updates")
+        if "self.progress_bus.subscribe('extract', show_extraction_progress)" in content:
+            print("  ✓ Progress bus used for thread-safe updates")
             return True
         else:
             print("  ✗ self.after() not used for UI updates")
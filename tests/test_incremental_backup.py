@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""
+Test suite for incremental backups.
+Verifies manifest recording, change detection against the previous manifest
+(including content changes that keep size and mtime), point-in-time restore of a full backup plus its incrementals, history chain links,
+and that rotation protects backups that live incrementals depend on.
+"""
+
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import logging
+import tarfile
+import tempfile
+import subprocess
+
+# Import the module using importlib to handle the dash in filename
+import importlib.util
+spec = importlib.util.spec_from_file_location(
+    "nextcloud_restore",
+    os.path.join(os.path.dirname(__file__), "../src/nextcloud_restore_and_backup-v9.py")
+)
+nextcloud_restore = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(nextcloud_restore)
+
+
+def write_file(root, rel_path, content, mtime=None):
+    path = os.path.join(root, rel_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+def local_listing(root, folders):
+    """Stand-in for list_container_files: same find command, run locally."""
+    output = subprocess.run(
+        ['find'] + [os.path.join(root, f) for f in folders] + ['-printf', '%y\\t%m\\t%s\\t%T@\\t%p\\0'],
+        capture_output=True, check=True
+    ).stdout
+    return nextcloud_restore.parse_container_file_listing(output, root)
+
+
+def local_hasher(root):
+    """Stand-in for hash_container_files: hash the files under root locally."""
+    def hash_files(paths):
+        hashes = {}
+        for path in paths:
+            with open(os.path.join(root, path), "rb") as f:
+                hashes[path] = nextcloud_restore.hashlib.sha256(f.read()).hexdigest()
+        return hashes
+    return hash_files
+
+
+def snapshot_tree(root, folders):
+    """Map of relative file path -> content for comparison."""
+    tree = {}
+    for folder in folders:
+        for dirpath, dirnames, filenames in os.walk(os.path.join(root, folder)):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                with open(path, "rb") as f:
+                    tree[os.path.relpath(path, root)] = f.read()
+    return tree
+
+
+def test_full_then_incremental_restores_point_in_time():
+    """Full + incremental chain rebuilds the tree as it was at the incremental."""
+    print("\n" + "=" * 60)
+    print("TEST: Full backup + incremental restore")
+    print("=" * 60)
+
+    root = tempfile.mkdtemp(prefix="fake_html_")
+    backup_dir = tempfile.mkdtemp(prefix="incr_backups_")
+    restore_dir = tempfile.mkdtemp(prefix="incr_restore_")
+    originals = (nextcloud_restore.open_container_tar_stream,
+                 nextcloud_restore.open_container_paths_tar_stream)
+    try:
+        old = time.time() - 3600
+        write_file(root, "config/config.php", "<?php $CONFIG = array('dbtype' => 'sqlite');", old)
+        for i in range(10):
+            write_file(root, f"data/admin/files/doc_{i}.txt", f"document {i}\n" * 20, old)
+        write_file(root, "data/admin/files/obsolete.txt", "delete me", old)
+
+        nextcloud_restore.open_container_tar_stream = lambda c, folders, base_path: subprocess.Popen(
+            ['tar', '-c', '-C', root] + list(folders), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        nextcloud_restore.open_container_paths_tar_stream = lambda c, paths, base_path: subprocess.Popen(
+            ['tar', '-c', '-C', root, '--no-recursion'] + list(paths), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+        folders = ["config", "data"]
+        full_path = os.path.join(backup_dir, "nextcloud-backup-20240101_000000.tar.gz")
+        full_manifest = {}
+        full_info = {'backup_type': 'full', 'parent': None, 'folders': folders}
+        nextcloud_restore.stream_backup_archive("nextcloud-app", folders, full_path,
+                                                manifest=full_manifest, info=full_info)
+        entry = full_manifest["config/config.php"]
+        config_php = os.path.join(root, "config", "config.php")
+        with open(config_php, "rb") as f:
+            config_hash = nextcloud_restore.hashlib.sha256(f.read()).hexdigest()
+        assert entry == ['f', os.path.getsize(config_php), int(os.path.getmtime(config_php)),
+                         os.stat(config_php).st_mode & 0o7777, config_hash], f"Unexpected manifest entry: {entry}"
+        assert full_manifest["data/admin/files"][4] is None
+        assert full_manifest["data/admin/files"][0] == 'd'
+        print(f"  ✓ Full backup manifest has {len(full_manifest)} entries")
+
+        # Nothing changed yet: the listing must match the manifest exactly
+        changed, deleted = nextcloud_restore.plan_incremental_backup(full_manifest, local_listing(root, folders),
+                                                                     hash_files=local_hasher(root))
+        assert changed == [] and deleted == [], f"Unchanged tree reported changes: {changed} {deleted}"
+
+        # Overnight changes: one edit, one new file in a new folder, one deletion, and
+        # one rewrite that keeps the size and mtime
+        write_file(root, "data/admin/files/doc_3.txt", "edited document 3\n")
+        write_file(root, "data/bob/files/new.txt", "brand new")
+        os.remove(os.path.join(root, "data/admin/files/obsolete.txt"))
+        write_file(root, "data/admin/files/doc_5.txt", "DOCUMENT 5\n" * 20, old)
+
+        listing = local_listing(root, folders)
+        changed, _ = nextcloud_restore.plan_incremental_backup(full_manifest, dict(listing))
+        assert "data/admin/files/doc_5.txt" not in changed, "size and mtime alone cannot see the rewrite"
+        changed, deleted = nextcloud_restore.plan_incremental_backup(full_manifest, listing,
+                                                                     hash_files=local_hasher(root))
+        assert "data/admin/files/doc_3.txt" in changed
+        assert "data/admin/files/doc_5.txt" in changed, "same size and mtime, different content"
+        assert "data/bob/files/new.txt" in changed and "data/bob" in changed
+        assert "data/admin/files/doc_0.txt" not in changed
+        assert deleted == ["data/admin/files/obsolete.txt"], deleted
+        print(f"  ✓ Detected {len(changed)} changed and {len(deleted)} deleted paths")
+
+        incr_path = os.path.join(backup_dir, "nextcloud-backup-20240102_000000-incremental.tar.gz")
+        incr_manifest = {}
+        incr_info = {'backup_type': 'incremental', 'parent': os.path.basename(full_path),
+                     'folders': folders, 'deleted': deleted}
+        stats = nextcloud_restore.stream_backup_archive("nextcloud-app", folders, incr_path, paths=changed,
+                                                        manifest=incr_manifest, info=incr_info)
+        assert stats['files'] == len(changed)
+        assert os.path.getsize(incr_path) < os.path.getsize(full_path)
+
+        merged = nextcloud_restore.merge_incremental_manifest(full_manifest, listing, incr_manifest)
+        assert "data/admin/files/obsolete.txt" not in merged
+        assert merged["data/admin/files/doc_0.txt"] == full_manifest["data/admin/files/doc_0.txt"]
+        assert merged["data/admin/files/doc_3.txt"][4] != full_manifest["data/admin/files/doc_3.txt"][4]
+        assert merged["data/admin/files/doc_5.txt"][4] != full_manifest["data/admin/files/doc_5.txt"][4]
+
+        # Entries of manifests without hashes get one from the comparison
+        unhashed = {path: entry[:4] + [None] for path, entry in full_manifest.items()}
+        relisted = local_listing(root, folders)
+        nextcloud_restore.plan_incremental_backup(unhashed, relisted, hash_files=local_hasher(root))
+        remerged = nextcloud_restore.merge_incremental_manifest(unhashed, relisted, incr_manifest)
+        assert remerged["data/admin/files/doc_0.txt"] == full_manifest["data/admin/files/doc_0.txt"]
+
+        chain, temp_files = nextcloud_restore.resolve_backup_chain(incr_path, backup_dir)
+        assert [os.path.basename(p) for p, info in chain] == [os.path.basename(full_path), os.path.basename(incr_path)]
+        assert temp_files == []
+        nextcloud_restore.extract_backup_chain(chain, restore_dir)
+
+        assert snapshot_tree(restore_dir, folders) == snapshot_tree(root, folders), "Restored tree differs"
+        assert not os.path.exists(os.path.join(restore_dir, nextcloud_restore.BACKUP_INFO_NAME))
+        print("  ✓ Restored tree matches the source at the time of the incremental")
+
+        status, details = nextcloud_restore.verify_backup_integrity(incr_path)
+        assert status == 'success' and 'Incremental' in details, details
+        print(f"  ✓ {details}")
+    finally:
+        (nextcloud_restore.open_container_tar_stream,
+         nextcloud_restore.open_container_paths_tar_stream) = originals
+        for d in (root, backup_dir, restore_dir):
+            shutil.rmtree(d, ignore_errors=True)
+
+
+def test_missing_parent_is_reported():
+    """Restoring an incremental without its parent fails with a clear message."""
+    print("\n" + "=" * 60)
+    print("TEST: Missing parent backup")
+    print("=" * 60)
+
+    work_dir = tempfile.mkdtemp(prefix="incr_orphan_")
+    try:
+        archive_path = os.path.join(work_dir, "nextcloud-backup-2-incremental.tar.gz")
+        with tarfile.open(archive_path, 'w:gz') as tar:
+            nextcloud_restore._add_json_member(tar, nextcloud_restore.BACKUP_INFO_NAME,
+                                               {'backup_type': 'incremental', 'parent': 'nextcloud-backup-1.tar.gz'})
+        try:
+            nextcloud_restore.resolve_backup_chain(archive_path, work_dir)
+            assert False, "Expected a missing parent error"
+        except Exception as e:
+            assert "nextcloud-backup-1.tar.gz" in str(e)
+            print(f"  ✓ {e}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def test_history_chain_and_rotation_protection():
+    """History records parent links; ancestors of kept backups are protected from rotation."""
+    print("\n" + "=" * 60)
+    print("TEST: History chain links and rotation protection")
+    print("=" * 60)
+
+    work_dir = tempfile.mkdtemp(prefix="incr_history_")
+    try:
+        history = nextcloud_restore.BackupHistoryManager(db_path=os.path.join(work_dir, "history.db"))
+        paths = [os.path.join(work_dir, name) for name in (
+            "nextcloud-backup-1.tar.gz", "nextcloud-backup-2-incremental.tar.gz",
+            "nextcloud-backup-3-incremental.tar.gz", "nextcloud-backup-4.tar.gz")]
+        full_id = history.add_backup(paths[0], manifest_path="m1")
+        incr1_id = history.add_backup(paths[1], backup_type='incremental', parent_id=full_id, manifest_path="m2")
+        incr2_id = history.add_backup(paths[2], backup_type='incremental', parent_id=incr1_id, manifest_path="m3")
+        history.add_backup(paths[3])  # regular backup without manifest
+
+        chain = history.get_backup_chain(incr2_id)
+        assert [row[0] for row in chain] == [full_id, incr1_id, incr2_id]
+        assert chain[0][2] == 'full'
+
+        assert history.get_protected_backup_paths([paths[2]]) == {paths[0], paths[1]}
+        assert history.get_protected_backup_paths([paths[3]]) == set()
+        assert history.get_latest_manifest_backup(work_dir)[0] == incr2_id
+        assert history.get_latest_manifest_backup(os.path.join(work_dir, "elsewhere")) is None
+        history.add_backup(os.path.join(work_dir, "sub", "nextcloud-backup-5.tar.gz"), manifest_path="m5")
+        assert history.get_latest_manifest_backup(work_dir + os.sep)[0] == incr2_id, "subdirectories are not matched"
+        plan = ' '.join(row[3] for row in history._query(
+            'EXPLAIN QUERY PLAN SELECT id FROM backups WHERE backup_dir = ? AND manifest_path IS NOT NULL '
+            'ORDER BY timestamp DESC, id DESC LIMIT 1', (work_dir,)))
+        assert 'idx_backups_backup_dir' in plan, plan
+        print("  ✓ Chain resolved and full backup protected while incrementals depend on it")
+
+        # Rotation must consult the protection list before deleting
+        src_path = os.path.join(os.path.dirname(__file__), "../src/nextcloud_restore_and_backup-v9.py")
+        with open(src_path, 'r') as f:
+            content = f.read()
+        start = content.find('def _perform_backup_rotation(')
+        rotation_src = content[start:content.find('\n    def ', start + 1)]
+        assert "get_protected=self.backup_history.get_protected_backup_paths" in rotation_src
+        print("  ✓ _perform_backup_rotation skips protected backups")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def test_history_schema_upgrade():
+    """Databases created before incremental support gain the new columns."""
+    print("\n" + "=" * 60)
+    print("TEST: History schema upgrade")
+    print("=" * 60)
+
+    work_dir = tempfile.mkdtemp(prefix="incr_schema_")
+    try:
+        db_path = os.path.join(work_dir, "history.db")
+        conn = sqlite3.connect(db_path)
+        conn.execute('''CREATE TABLE backups (id INTEGER PRIMARY KEY AUTOINCREMENT, backup_path TEXT NOT NULL,
+                        timestamp DATETIME NOT NULL, size_bytes INTEGER, encrypted BOOLEAN, database_type TEXT,
+                        folders_backed_up TEXT, verification_status TEXT, verification_details TEXT, notes TEXT,
+                        created_at DATETIME DEFAULT CURRENT_TIMESTAMP)''')
+        conn.execute("INSERT INTO backups (backup_path, timestamp) VALUES ('old.tar.gz', '2024-01-01T00:00:00')")
+        conn.commit()
+        conn.close()
+
+        history = nextcloud_restore.BackupHistoryManager(db_path=db_path)
+        links = history.get_backup_links('old.tar.gz')
+        assert links[2] == 'full' and links[3] is None and links[4] is None, links
+        assert len(history.get_all_backups()) == 1
+        print("  ✓ Existing records upgraded as full backups")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def test_incremental_option_args():
+    """Incremental mode round-trips through the schedule config and CLI arguments."""
+    print("\n" + "=" * 60)
+    print("TEST: Incremental option arguments")
+    print("=" * 60)
+
+    options = nextcloud_restore.get_backup_options({'backup_mode': 'incremental', 'full_every': 14})
+    args = nextcloud_restore.build_backup_option_args(options)
+    assert args == ["--incremental", "--full-every", "14"], args
+    assert "--incremental" not in nextcloud_restore.build_backup_option_args(None)
+    print(f"  ✓ {args}")
+
+
+class LogCapture(logging.Handler):
+    """Collect warnings logged by the module while in a with block."""
+    def __enter__(self):
+        self.messages = []
+        nextcloud_restore.logger.addHandler(self)
+        return self
+
+    def __exit__(self, *exc):
+        nextcloud_restore.logger.removeHandler(self)
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def test_listing_falls_back_without_find_printf():
+    """A busybox find without -printf is replaced by the PHP lister, with a warning."""
+    print("\n" + "=" * 60)
+    print("TEST: Container listing without find -printf")
+    print("=" * 60)
+
+    calls = []
+
+    def busybox_exec(container_name, cmd, **kwargs):
+        calls.append(cmd)
+        if cmd[0] == 'find':
+            return subprocess.CompletedProcess(cmd, 1, b'', b'find: unrecognized: -printf\n')
+        records = [b'd\t755\t4096\t1700000000\t/var/www/html/config',
+                   b'f\t640\t1234\t1700000100\t/var/www/html/config/config.php', b'']
+        return subprocess.CompletedProcess(cmd, 0, b'\0'.join(records), b'')
+
+    original_exec = nextcloud_restore.docker_exec
+    nextcloud_restore.docker_exec = busybox_exec
+    try:
+        with LogCapture() as warnings:
+            listing = nextcloud_restore.list_container_files('nextcloud-app', ['config'])
+    finally:
+        nextcloud_restore.docker_exec = original_exec
+    assert [cmd[0] for cmd in calls] == ['find', 'php']
+    assert calls[1][1:4] == ['-r', nextcloud_restore.CONTAINER_FILE_LISTER_PHP, '--'] and calls[1][4:] == ['/var/www/html/config']
+    assert listing == {'config': ['d', 4096, 1700000000, 0o755, None],
+                       'config/config.php': ['f', 1234, 1700000100, 0o640, None]}, listing
+    assert any('does not support -printf' in message for message in warnings.messages)
+    print("  ✓ Listed with PHP and logged the degraded mode")
+
+
+def test_container_files_hashed_in_one_call():
+    """hash_container_files sends the paths on stdin to one PHP call and parses its records."""
+    print("\n" + "=" * 60)
+    print("TEST: Hashing container files")
+    print("=" * 60)
+
+    calls = []
+
+    def php_exec(container_name, cmd, input=None, **kwargs):
+        calls.append((cmd, input))
+        output = b'ab' * 32 + b'\tconfig/config.php\0' + b'\tdata/gone.txt\0'
+        return subprocess.CompletedProcess(cmd, 0, output, b'')
+
+    original_exec = nextcloud_restore.docker_exec
+    nextcloud_restore.docker_exec = php_exec
+    try:
+        hashes = nextcloud_restore.hash_container_files('nextcloud-app', ['config/config.php', 'data/gone.txt'])
+        assert nextcloud_restore.hash_container_files('nextcloud-app', []) == {}
+    finally:
+        nextcloud_restore.docker_exec = original_exec
+    assert len(calls) == 1
+    assert calls[0][0] == ['php', '-r', nextcloud_restore.CONTAINER_FILE_HASHER_PHP, '--', '/var/www/html']
+    assert calls[0][1] == b'config/config.php\0data/gone.txt\0'
+    assert hashes == {'config/config.php': 'ab' * 32}, hashes
+
+    # A file that cannot be hashed any more is archived again
+    previous = {'data/gone.txt': ['f', 1, 1, 0o644, 'cd' * 32]}
+    changed, _ = nextcloud_restore.plan_incremental_backup(
+        previous, {'data/gone.txt': ['f', 1, 1, 0o644, None]}, hash_files=lambda paths: {})
+    assert changed == ['data/gone.txt']
+    print("  ✓ One docker exec for all paths; unreadable files count as changed")
+
+
+if __name__ == "__main__":
+    try:
+        test_full_then_incremental_restores_point_in_time()
+        test_missing_parent_is_reported()
+        test_history_chain_and_rotation_protection()
+        test_history_schema_upgrade()
+        test_incremental_option_args()
+        test_listing_falls_back_without_find_printf()
+        test_container_files_hashed_in_one_call()
+        print("\n✅ All incremental backup tests passed")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ ASSERTION FAILED: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
@@ -106,7 +106,7 @@ def test_integration_workflow():
     show_history_section = content[show_history_start:show_history_end]
     
     # Verify it fetches backups
-    assert 'self.backup_history.get_all_backups()' in show_history_section, \
+    assert 'BackupHistoryPager(self.backup_history)' in show_history_section, \
         "History display doesn't fetch backups"
     
     print("   ✓ Backup history display fetches all backups")
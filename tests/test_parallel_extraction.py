@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Test suite for parallel extraction writers in fast_extract_tar_gz.
+Verifies that the writer pool produces the same tree as serial extraction (contents,
+modes, mtimes, links), that directory metadata is applied after their files are
+written, that the in-flight byte budget is respected, that progress and errors
+are reported as before, and that members escaping the target directory are skipped.
+"""
+
+import os
+import io
+import sys
+import stat
+import shutil
+import tarfile
+import tempfile
+
+# Import the module using importlib to handle the dash in filename
+import importlib.util
+spec = importlib.util.spec_from_file_location(
+    "nextcloud_restore",
+    os.path.join(os.path.dirname(__file__), "../src/nextcloud_restore_and_backup-v9.py")
+)
+nextcloud_restore = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(nextcloud_restore)
+
+DIR_MTIME = 1000000000      # 2001-09-09
+FILE_MTIME = 1200000000
+
+
+def add(tar, name, data=None, kind=tarfile.REGTYPE, mode=0o644, linkname=""):
+    info = tarfile.TarInfo(name)
+    info.type = kind
+    info.mode = mode
+    info.mtime = DIR_MTIME if kind == tarfile.DIRTYPE else FILE_MTIME
+    info.linkname = linkname
+    if data is not None:
+        info.size = len(data)
+    tar.addfile(info, io.BytesIO(data) if data is not None else None)
+
+
+def write_archive(path, file_count=400, big_file_size=0):
+    """A backup-like archive with directories first, many small files and a few links."""
+    with tarfile.open(path, "w:gz", compresslevel=1) as tar:
+        add(tar, "data", kind=tarfile.DIRTYPE, mode=0o750)
+        add(tar, "data/admin", kind=tarfile.DIRTYPE, mode=0o750)
+        add(tar, "data/admin/files", kind=tarfile.DIRTYPE, mode=0o755)
+        for i in range(file_count):
+            add(tar, f"data/admin/files/note_{i}.md", os.urandom(i * 37 % 5000), mode=0o600 if i % 2 else 0o644)
+        add(tar, "data/admin/files/empty.txt", b"")
+        add(tar, "data/admin/files/link_to_note", kind=tarfile.SYMTYPE, linkname="note_1.md")
+        add(tar, "data/admin/files/hard_note", kind=tarfile.LNKTYPE, linkname="data/admin/files/note_3.md")
+        if big_file_size:
+            add(tar, "data/admin/files/video.bin", os.urandom(big_file_size))
+        # A file whose directory entry comes later in the archive
+        add(tar, "apps/notes/appinfo/info.xml", b"<info/>")
+        add(tar, "apps/notes", kind=tarfile.DIRTYPE, mode=0o755)
+
+
+def snapshot(root):
+    """Describe a tree: {rel_path: (type, mode, mtime, content or link)}."""
+    tree = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in dirnames + filenames:
+            path = os.path.join(dirpath, name)
+            st = os.lstat(path)
+            rel = os.path.relpath(path, root)
+            if stat.S_ISLNK(st.st_mode):
+                tree[rel] = ('link', os.readlink(path))
+            elif stat.S_ISDIR(st.st_mode):
+                tree[rel] = ('dir', stat.S_IMODE(st.st_mode), int(st.st_mtime))
+            else:
+                with open(path, 'rb') as f:
+                    tree[rel] = ('file', stat.S_IMODE(st.st_mode), int(st.st_mtime), f.read(), st.st_nlink)
+    return tree
+
+
+def test_parallel_matches_serial():
+    """The writer pool gives exactly the tree serial extraction gives."""
+    print("\nTesting parallel vs serial extraction...")
+    work_dir = tempfile.mkdtemp(prefix="parallel_extract_")
+    try:
+        archive_path = os.path.join(work_dir, "backup.tar.gz")
+        write_archive(archive_path, big_file_size=3 * 1024 * 1024)
+        serial = os.path.join(work_dir, "serial")
+        parallel = os.path.join(work_dir, "parallel")
+        nextcloud_restore.fast_extract_tar_gz(archive_path, serial, writers=1)
+        nextcloud_restore.fast_extract_tar_gz(archive_path, parallel, writers=4,
+                                              max_inflight_bytes=256 * 1024)
+        expected, result = snapshot(serial), snapshot(parallel)
+        # Serial extraction sets a directory's mtime before its files are written into it
+        without_dir_mtimes = lambda tree: {k: v[:2] if v[0] == 'dir' else v for k, v in tree.items()}
+        assert without_dir_mtimes(result) == without_dir_mtimes(expected)
+        archived_dirs = ["data", os.path.join("data", "admin"), os.path.join("data", "admin", "files"),
+                         os.path.join("apps", "notes")]
+        assert all(result[d][2] == DIR_MTIME for d in archived_dirs), \
+            "directory mtime must be applied after its files are written"
+        assert result[os.path.join("data", "admin", "files", "hard_note")][4] == 2
+        print(f"  ✓ {len(result)} entries identical, directory mtimes preserved")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def test_inflight_budget_and_progress():
+    """Handed-off bytes stay within the budget; progress is reported per member as before."""
+    print("\nTesting in-flight budget...")
+    work_dir = tempfile.mkdtemp(prefix="parallel_extract_budget_")
+    original_write = nextcloud_restore.ParallelExtractor._write
+    peaks = []
+
+    def slow_write(self, member, target, data, cost):
+        peaks.append(self._inflight)
+        original_write(self, member, target, data, cost)
+    try:
+        archive_path = os.path.join(work_dir, "backup.tar.gz")
+        write_archive(archive_path)
+        nextcloud_restore.ParallelExtractor._write = slow_write
+        progress = []
+        budget = 64 * 1024
+        nextcloud_restore.fast_extract_tar_gz(archive_path, os.path.join(work_dir, "out"),
+                                              progress_callback=lambda *args: progress.append(args),
+                                              writers=4, max_inflight_bytes=budget)
+        largest = 5000 + nextcloud_restore.EXTRACT_MEMBER_OVERHEAD
+        assert max(peaks) <= budget + largest, max(peaks)
+        assert [args[0] for args in progress] == list(range(1, len(progress) + 1))
+        assert all(args[1] is None for args in progress)
+        assert progress[-1][3] <= progress[-1][4] == os.path.getsize(archive_path)
+        print(f"  ✓ Peak {max(peaks)} bytes in flight for a {budget} byte budget; {len(progress)} callbacks")
+    finally:
+        nextcloud_restore.ParallelExtractor._write = original_write
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def test_write_error_is_raised():
+    """A failing write in a worker surfaces as an extraction error."""
+    print("\nTesting writer errors...")
+    work_dir = tempfile.mkdtemp(prefix="parallel_extract_error_")
+    try:
+        archive_path = os.path.join(work_dir, "backup.tar.gz")
+        write_archive(archive_path, file_count=50)
+        out = os.path.join(work_dir, "out")
+        # A directory where a file should go makes open() fail in the worker
+        os.makedirs(os.path.join(out, "data", "admin", "files", "note_10.md"))
+        try:
+            nextcloud_restore.fast_extract_tar_gz(archive_path, out, writers=4)
+            assert False, "Expected extraction to fail"
+        except Exception as e:
+            assert "Extraction failed" in str(e) or "File system error" in str(e), e
+            print(f"  ✓ Raised: {e}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def test_unsafe_members_are_skipped():
+    """'..' names, absolute names and symlinks out of the tree never write outside extract_to."""
+    print("\nTesting unsafe members...")
+    work_dir = tempfile.mkdtemp(prefix="parallel_extract_unsafe_")
+    try:
+        archive_path = os.path.join(work_dir, "backup.tar.gz")
+        outside = os.path.join(work_dir, "outside")
+        os.mkdir(outside)
+        with tarfile.open(archive_path, "w:gz", compresslevel=1) as tar:
+            add(tar, "./", kind=tarfile.DIRTYPE, mode=0o755)
+            add(tar, "./config/config.php", b"<?php")
+            add(tar, "../evil.txt", b"escaped")
+            add(tar, "data/../../evil2.txt", b"escaped")
+            add(tar, "/absolute.txt", b"rooted")
+            add(tar, "data/escape", kind=tarfile.SYMTYPE, linkname="../../outside")
+            add(tar, "data/escape/pwned.txt", b"through the link")
+            add(tar, "data/rooted", kind=tarfile.SYMTYPE, linkname=outside)
+            add(tar, "data/hard", kind=tarfile.LNKTYPE, linkname="../evil.txt")
+            add(tar, "data/inside", kind=tarfile.SYMTYPE, linkname="../config/config.php")
+        for writers in (1, 4):
+            out = os.path.join(work_dir, f"out_{writers}")
+            nextcloud_restore.fast_extract_tar_gz(archive_path, out, writers=writers)
+            tree = snapshot(out)
+            assert os.listdir(outside) == []
+            assert not any(os.path.exists(os.path.join(work_dir, name)) for name in ("evil.txt", "evil2.txt"))
+            assert tree[os.path.join("config", "config.php")][3] == b"<?php"
+            assert tree[os.path.join("absolute.txt")][3] == b"rooted"
+            assert tree[os.path.join("data", "inside")] == ('link', "../config/config.php")
+            assert tree[os.path.join("data", "escape")][0] == 'dir', "unsafe symlink must not be created"
+            assert os.path.join("data", "rooted") not in tree and os.path.join("data", "hard") not in tree
+        print("  ✓ Nothing written outside the target with 1 or 4 writers")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_parallel_matches_serial()
+    test_inflight_budget_and_progress()
+    test_write_error_is_raised()
+    test_unsafe_members_are_skipped()
+    print("\n✅ All parallel extraction tests passed")
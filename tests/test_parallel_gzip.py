@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Test suite for the multi-core gzip compressor used by the backup engine.
+Verifies that ParallelGzipWriter output is a valid multi-member gzip archive that the
+existing readers accept, and benchmarks it against the single-threaded make_archive path.
+
+Run directly for a larger benchmark:
+    python test_parallel_gzip.py [size_mb]
+"""
+
+import os
+import sys
+import io
+import gzip
+import time
+import shutil
+import tarfile
+import tempfile
+
+# Import the module using importlib to handle the dash in filename
+import importlib.util
+spec = importlib.util.spec_from_file_location(
+    "nextcloud_restore",
+    os.path.join(os.path.dirname(__file__), "../src/nextcloud_restore_and_backup-v9.py")
+)
+nextcloud_restore = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(nextcloud_restore)
+
+ParallelGzipWriter = nextcloud_restore.ParallelGzipWriter
+
+
+def make_sample_data(size):
+    """Mix of compressible text and incompressible bytes, like a Nextcloud data folder."""
+    text = b"Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 1000
+    chunks = []
+    total = 0
+    while total < size:
+        chunk = text if (total // len(text)) % 2 == 0 else os.urandom(len(text))
+        chunks.append(chunk)
+        total += len(chunk)
+    return b"".join(chunks)[:size]
+
+
+def count_gzip_members(data):
+    """Count gzip members by walking the stream with zlib."""
+    import zlib
+    members = 0
+    while data:
+        d = zlib.decompressobj(31)
+        d.decompress(data)
+        members += 1
+        data = d.unused_data
+    return members
+
+
+def test_roundtrip_multi_member():
+    """Output decompresses to the exact input and consists of several gzip members."""
+    print("\nTesting ParallelGzipWriter roundtrip...")
+    payload = make_sample_data(3 * 1024 * 1024 + 12345)
+    out = io.BytesIO()
+    with ParallelGzipWriter(out, level=6, threads=4, block_size=256 * 1024) as writer:
+        # Uneven write sizes exercise the block splitting
+        for i in range(0, len(payload), 70000):
+            writer.write(payload[i:i + 70000])
+
+    compressed = out.getvalue()
+    assert gzip.decompress(compressed) == payload, "Decompressed data does not match input"
+    members = count_gzip_members(compressed)
+    assert members == 13, f"Expected 13 gzip members, got {members}"
+    assert writer.bytes_in == len(payload)
+    assert writer.bytes_out == len(compressed)
+    print(f"  ✓ {len(payload)} bytes -> {len(compressed)} bytes in {members} members")
+
+
+def test_empty_input_is_valid_gzip():
+    """Closing without writing still produces a valid gzip stream."""
+    print("\nTesting empty input...")
+    out = io.BytesIO()
+    with ParallelGzipWriter(out, threads=2):
+        pass
+    assert gzip.decompress(out.getvalue()) == b""
+    print("  ✓ Empty input produces a valid empty gzip file")
+
+
+def test_tar_archive_readable_by_existing_readers():
+    """A tar written through the parallel compressor works with r:gz and fast_extract_tar_gz."""
+    print("\nTesting compatibility with existing archive readers...")
+    work_dir = tempfile.mkdtemp(prefix="pgzip_test_")
+    try:
+        archive_path = os.path.join(work_dir, "nextcloud-backup-test.tar.gz")
+        with open(archive_path, 'wb') as raw:
+            with ParallelGzipWriter(raw, threads=3, block_size=64 * 1024) as writer:
+                with tarfile.open(fileobj=writer, mode='w|') as tar:
+                    for name in ["config/config.php", "data/admin/files/a.bin", "data/admin/files/b.txt"]:
+                        data = make_sample_data(200 * 1024) if name.endswith('.bin') else b"<?php $CONFIG = array();"
+                        info = tarfile.TarInfo(name)
+                        info.size = len(data)
+                        tar.addfile(info, io.BytesIO(data))
+
+        with tarfile.open(archive_path, 'r:gz') as tar:
+            names = tar.getnames()
+        assert "config/config.php" in names
+
+        extract_dir = os.path.join(work_dir, "extract")
+        progress = []
+        nextcloud_restore.fast_extract_tar_gz(
+            archive_path, extract_dir,
+            progress_callback=lambda *args: progress.append(args)
+        )
+        assert os.path.getsize(os.path.join(extract_dir, "data", "admin", "files", "a.bin")) == 200 * 1024
+        assert progress[-1][0] == 3, "Progress should report all 3 files"
+        print("  ✓ tarfile 'r:gz' and fast_extract_tar_gz read multi-member archives")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def test_backup_option_args():
+    """Compression settings round-trip through the schedule config and CLI arguments."""
+    print("\nTesting compression options...")
+    defaults = nextcloud_restore.get_backup_options(None)
+    assert defaults['compress_threads'] == 0 and defaults['compress_level'] == 6
+    assert nextcloud_restore.build_backup_option_args(defaults) == []
+
+    config = {'backup_dir': '/backups', 'compress_threads': 16, 'compress_level': 3}
+    options = nextcloud_restore.get_backup_options(config)
+    assert options['compress_threads'] == 16 and options['compress_level'] == 3
+    args = nextcloud_restore.build_backup_option_args(options)
+    assert args == ["--compress-threads", "16", "--compress-level", "3"], args
+    print(f"  ✓ Config {options} -> CLI {args}")
+
+
+def benchmark_compression(size_mb=32, threads=None, level=6):
+    """
+    Compare the old single-core path (tarfile/make_archive 'gztar') with ParallelGzipWriter.
+    Returns dict of MB/s for each path.
+    """
+    payload = make_sample_data(size_mb * 1024 * 1024)
+    info = tarfile.TarInfo("data/sample.bin")
+    info.size = len(payload)
+    results = {}
+
+    start = time.time()
+    out = io.BytesIO()
+    with tarfile.open(fileobj=out, mode='w|gz') as tar:  # what shutil.make_archive(..., 'gztar') does
+        tar.addfile(info, io.BytesIO(payload))
+    results['make_archive (1 thread, level 9)'] = size_mb / (time.time() - start)
+
+    start = time.time()
+    out = io.BytesIO()
+    with ParallelGzipWriter(out, level=level, threads=threads) as writer:
+        with tarfile.open(fileobj=writer, mode='w|') as tar:
+            tar.addfile(info, io.BytesIO(payload))
+    thread_count = writer.threads
+    results[f'ParallelGzipWriter ({thread_count} threads, level {level})'] = size_mb / (time.time() - start)
+
+    for name, rate in results.items():
+        print(f"  {name:<45} {rate:8.1f} MB/s")
+    return results
+
+
+def test_benchmark_reports_throughput():
+    """Benchmark reports MB/s for both compression paths."""
+    print("\nBenchmarking compression throughput (8 MB sample)...")
+    results = benchmark_compression(size_mb=8)
+    assert len(results) == 2
+    assert all(rate > 0 for rate in results.values())
+
+
+if __name__ == "__main__":
+    test_roundtrip_multi_member()
+    test_empty_input_is_valid_gzip()
+    test_tar_archive_readable_by_existing_readers()
+    test_backup_option_args()
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    print(f"\nBenchmarking compression throughput ({size} MB sample)...")
+    benchmark_compression(size_mb=size)
+    print("\n✅ All parallel gzip tests passed")
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Test suite for the progress bus between worker threads and the Tk main loop.
+Verifies that posted events are coalesced to the latest state per channel, that
+channels are applied in the order of their latest event, that the bus drains on a
+fixed timer, and that posting costs next to nothing on the worker side.
+"""
+
+import os
+import sys
+import time
+import threading
+
+# Import the module using importlib to handle the dash in filename
+import importlib.util
+spec = importlib.util.spec_from_file_location(
+    "nextcloud_restore",
+    os.path.join(os.path.dirname(__file__), "../src/nextcloud_restore_and_backup-v9.py")
+)
+nextcloud_restore = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(nextcloud_restore)
+
+
+class FakeWidget:
+    """Records after() calls instead of running a Tk event loop."""
+
+    def __init__(self):
+        self.scheduled = []
+
+    def after(self, delay, callback):
+        self.scheduled.append((delay, callback))
+
+
+def test_latest_state_per_channel():
+    """Thousands of posts from several threads become one handler call per channel."""
+    print("\nTesting coalescing...")
+    bus = nextcloud_restore.ProgressBus()
+    calls = []
+    bus.subscribe('extract', lambda n, name: calls.append(('extract', n, name)))
+    bus.subscribe('restore', lambda percent, msg: calls.append(('restore', percent, msg)))
+
+    def worker():
+        for i in range(1, 5001):
+            bus.post('extract', i, f"file_{i}")
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    bus.post('restore', 20, "Extraction complete!")
+
+    assert bus.drain() == 2
+    assert calls == [('extract', 5000, "file_5000"), ('restore', 20, "Extraction complete!")], calls
+    assert bus.drain() == 0, "nothing left after a drain"
+    print("  ✓ 20000 posts applied as 2 handler calls")
+
+
+def test_channels_applied_in_order_of_latest_event():
+    """A channel posted again after another one is applied after it."""
+    print("\nTesting channel ordering...")
+    bus = nextcloud_restore.ProgressBus()
+    applied = []
+    bus.subscribe('a', lambda v: applied.append(('a', v)))
+    bus.subscribe('b', lambda v: applied.append(('b', v)))
+    bus.post('a', 1)
+    bus.post('b', 1)
+    bus.post('a', 2)
+    bus.drain()
+    assert applied == [('b', 1), ('a', 2)], applied
+    print("  ✓ Latest event decides the order")
+
+
+def test_handler_errors_do_not_stop_the_bus():
+    """A failing handler is logged and the other channels are still applied."""
+    print("\nTesting handler errors...")
+    bus = nextcloud_restore.ProgressBus()
+    applied = []
+
+    def broken(value):
+        raise ValueError("widget gone")
+    bus.subscribe('broken', broken)
+    bus.subscribe('ok', applied.append)
+    bus.post('broken', 1)
+    bus.post('ok', 2)
+    bus.post('unsubscribed', 3)
+    bus.drain()
+    assert applied == [2]
+    print("  ✓ Errors contained")
+
+
+def test_timer_drains_at_fixed_interval():
+    """start() schedules a drain every interval; stop() applies what is left and stops."""
+    print("\nTesting drain timer...")
+    bus = nextcloud_restore.ProgressBus()
+    widget = FakeWidget()
+    applied = []
+    bus.subscribe('restore', lambda percent, msg: applied.append(percent))
+    bus.start(widget)
+    assert widget.scheduled and widget.scheduled[-1][0] == 100, "10 Hz timer expected"
+
+    bus.post('restore', 5, "")
+    bus.post('restore', 6, "")
+    widget.scheduled.pop()[1]()
+    assert applied == [6] and len(widget.scheduled) == 1, "tick drains and reschedules"
+
+    bus.post('restore', 7, "")
+    bus.stop()
+    assert applied == [6, 7]
+    widget.scheduled.pop()[1]()
+    assert widget.scheduled == [], "no rescheduling after stop()"
+    print("  ✓ Drained on a 100 ms timer")
+
+
+def test_post_is_cheap():
+    """Posting a million events takes about as long as a million tuple appends."""
+    print("\nTesting worker-side overhead...")
+    bus = nextcloud_restore.ProgressBus()
+    start = time.perf_counter()
+    for i in range(1000000):
+        bus.post('extract', i, None, "name", i, 100)
+    elapsed = time.perf_counter() - start
+    assert elapsed < 3.0, f"posting took {elapsed:.2f}s"
+    bus.drain()
+    print(f"  ✓ {elapsed * 1000:.0f} ns per post")
+
+
+def test_restore_callbacks_post_to_bus():
+    """Extraction and copy callbacks only post; widgets are updated by the bus handlers."""
+    print("\nTesting restore callbacks...")
+    src_path = os.path.join(os.path.dirname(__file__), "../src/nextcloud_restore_and_backup-v9.py")
+    with open(src_path, 'r') as f:
+        content = f.read()
+    start = content.find('def extraction_progress_callback(')
+    callback = content[start:content.find('def show_extraction_progress(', start)]
+    assert "self.progress_bus.post('extract'" in callback and "self.after(" not in callback
+    start = content.find('def copy_progress_callback(')
+    callback = content[start:content.find('def show_copy_progress(', start)]
+    assert "self.progress_bus.post('copy'" in callback and "self.after(" not in callback
+    start = content.find('def set_restore_progress(')
+    method = content[start:content.find('\n    def ', start + 10)]
+    assert "progress_bus.post('restore', percent, msg)" in method
+    print("  ✓ Worker threads no longer schedule one Tk callback per file")
+
+
+if __name__ == "__main__":
+    test_latest_state_per_channel()
+    test_channels_applied_in_order_of_latest_event()
+    test_handler_errors_do_not_stop_the_bus()
+    test_timer_drains_at_fixed_interval()
+    test_post_is_cheap()
+    test_restore_callbacks_post_to_bus()
+    print("\n✅ All progress bus tests passed")
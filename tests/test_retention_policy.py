@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Test suite for the backup retention policy.
+Verifies that --rotation-policy specifications round-trip, that a policy with
+hourly/daily/weekly/monthly/yearly rules and a size budget keeps the expected restore
+points in one pass over the catalog, that incremental chains of kept backups are
+never deleted, and that the policy is wired through schedule_config.json, the
+scheduled task command line, the dry-run preview and a bulk rotation.
+"""
+
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+# Import the module using importlib to handle the dash in filename
+import importlib.util
+spec = importlib.util.spec_from_file_location(
+    "nextcloud_restore",
+    os.path.join(os.path.dirname(__file__), "../src/nextcloud_restore_and_backup-v9.py")
+)
+nextcloud_restore = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(nextcloud_restore)
+
+GB = 1024 ** 3
+
+
+def nightly_backups(days, size=GB, start=datetime(2026, 6, 30, 2, 0)):
+    """Catalog entries for one backup per night, newest first."""
+    entries = []
+    for day in range(days):
+        when = start - timedelta(days=day)
+        name = f"nextcloud-backup-{when:%Y%m%d_%H%M%S}.tar.gz"
+        entries.append({'name': name, 'path': f"/backups/{name}", 'size': size,
+                        'modified': time.mktime(when.timetuple()), 'inode': day + 1})
+    return entries
+
+
+def test_policy_spec_round_trip():
+    """Specifications parse into a dict and format back; mistakes are rejected."""
+    print("\nTesting policy specification...")
+    policy = nextcloud_restore.parse_rotation_policy("daily=7, weekly=4,monthly=12,yearly=3,max-bytes=500G")
+    assert policy == {'daily': 7, 'weekly': 4, 'monthly': 12, 'yearly': 3, 'max_bytes': 500 * GB}
+    spec_text = nextcloud_restore.format_rotation_policy(policy)
+    assert spec_text == "daily=7,weekly=4,monthly=12,yearly=3,max-bytes=500G"
+    assert nextcloud_restore.parse_rotation_policy(spec_text) == policy
+    assert nextcloud_restore.parse_rotation_policy("max-bytes=1536MB") == {'max_bytes': 1536 * 1024 ** 2}
+    assert nextcloud_restore.format_rotation_policy({'max_bytes': 1536 * 1024 ** 2}) == "max-bytes=1536M"
+    assert nextcloud_restore.parse_rotation_policy("") == {}
+    for bad in ("daily", "fortnightly=2", "weekly=-1", "daily=7G", "max-bytes=lots"):
+        try:
+            nextcloud_restore.parse_rotation_policy(bad)
+            assert False, f"accepted {bad!r}"
+        except nextcloud_restore.RotationPolicyError:
+            pass
+
+    config = {'rotation_policy': policy, 'rotation_keep': 2}
+    assert nextcloud_restore.get_rotation_policy(config, rotation_keep=2) == dict(policy, last=2)
+    assert nextcloud_restore.get_rotation_policy(None) == {}
+    print(f"  ✓ {spec_text}")
+
+
+def test_gfs_buckets():
+    """Two years of nightly backups thin out to 7 daily, 4 weekly, 12 monthly and 3 yearly points."""
+    print("\nTesting GFS buckets...")
+    entries = nightly_backups(730)
+    policy = nextcloud_restore.parse_rotation_policy("daily=7,weekly=4,monthly=12,yearly=3")
+    plan = nextcloud_restore.plan_retention(entries, policy)
+    kept = {entry['name']: reasons for entry, reasons in plan['keep']}
+    assert len(plan['keep']) + len(plan['delete']) == 730
+
+    dates = [datetime.fromtimestamp(entry['modified']) for entry, _ in plan['keep']]
+    assert dates == sorted(dates, reverse=True)
+    daily = [d for (entry, reasons), d in zip(plan['keep'], dates) if 'daily' in reasons]
+    weekly = [d for (entry, reasons), d in zip(plan['keep'], dates) if 'weekly' in reasons]
+    monthly = [d for (entry, reasons), d in zip(plan['keep'], dates) if 'monthly' in reasons]
+    yearly = [d for (entry, reasons), d in zip(plan['keep'], dates) if 'yearly' in reasons]
+    assert [d.day for d in daily] == [30, 29, 28, 27, 26, 25, 24]
+    assert len({d.isocalendar()[:2] for d in weekly}) == 4 and all(d.weekday() == 6 or d == dates[0] for d in weekly)
+    assert [(d.year, d.month) for d in monthly][:3] == [(2026, 6), (2026, 5), (2026, 4)]
+    assert len(monthly) == 12 and all((d + timedelta(days=1)).month != d.month for d in monthly)
+    assert [d.date().isoformat() for d in yearly] == ['2026-06-30', '2025-12-31', '2024-12-31']
+    assert kept[entries[0]['name']] == ['daily', 'weekly', 'monthly', 'yearly']
+    # Overlapping rules share restore points: 7 daily + 2 weekly + 11 monthly + 1 yearly
+    assert len(plan['keep']) == 21, f"{len(plan['keep'])} kept"
+    assert plan['delete_bytes'] == len(plan['delete']) * GB
+    print(f"  ✓ {len(plan['keep'])} of 730 backups kept, {plan['delete_bytes'] // GB} GB freed")
+
+
+def test_last_rule_and_size_budget():
+    """'last' keeps the newest N; the byte budget drops the oldest kept points first."""
+    print("\nTesting last rule and size budget...")
+    entries = nightly_backups(60)
+    plan = nextcloud_restore.plan_retention(entries, {'last': 3})
+    assert [entry for entry, _ in plan['keep']] == entries[:3]
+
+    policy = {'daily': 7, 'monthly': 12, 'max_bytes': 5 * GB}
+    plan = nextcloud_restore.plan_retention(entries, policy)
+    assert [entry for entry, _ in plan['keep']] == entries[:5] and plan['keep_bytes'] == 5 * GB
+    assert {reason for _, reason in plan['delete']} == {'over size budget', 'not kept by any rule'}
+
+    tiny = nextcloud_restore.plan_retention(entries, {'max_bytes': GB // 2})
+    assert [entry for entry, _ in tiny['keep']] == entries[:1], "the newest backup is always kept"
+    assert nextcloud_restore.plan_retention(entries, {})['delete'] == [], "no rules keeps everything"
+    print("  ✓ Budget of 5 GB keeps 5 nightly backups")
+
+
+def test_incremental_chains_protected():
+    """Backups that kept incrementals depend on move from the delete list to the keep list."""
+    print("\nTesting incremental protection...")
+    entries = nightly_backups(10)
+    chain = {entries[0]['path']: {entries[3]['path'], entries[6]['path']}}
+    calls = []
+
+    def get_protected(kept_paths):
+        calls.append(kept_paths)
+        return set().union(*(chain.get(path, set()) for path in kept_paths))
+    plan = nextcloud_restore.plan_retention(entries, {'last': 2}, get_protected=get_protected)
+    kept = [(entry['path'], reasons) for entry, reasons in plan['keep']]
+    assert kept == [(entries[0]['path'], ['last']), (entries[1]['path'], ['last']),
+                    (entries[3]['path'], ['incremental chain']), (entries[6]['path'], ['incremental chain'])]
+    assert len(plan['delete']) == 6 and len(calls) == 1
+    text = nextcloud_restore.describe_retention_plan(plan, limit=5)
+    assert text.splitlines()[0].startswith("Keep 4 backup(s)") and text.endswith("... and 5 more")
+    print("  ✓ 2 chain members kept with 1 protection lookup")
+
+
+def test_policy_wired_through_schedule():
+    """The policy is saved, passed to the task, previewed and applied with bulk deletes."""
+    print("\nTesting schedule wiring...")
+    src_path = os.path.join(os.path.dirname(__file__), "../src/nextcloud_restore_and_backup-v9.py")
+    with open(src_path, 'r') as f:
+        content = f.read()
+
+    def body(name, indent='    '):
+        start = content.find(f'def {name}(')
+        return content[start:content.find(f'\n{indent}def ', start + 10)]
+    assert '"--rotation-policy", format_rotation_policy(rotation_policy)' in body('create_scheduled_task', '')
+    assert "'rotation_policy': policy," in body('_create_schedule')
+    assert "parser.add_argument('--rotation-policy'" in content
+    assert "rotation_policy = parse_rotation_policy(args.rotation_policy)" in content
+    assert "rotation_policy = get_rotation_policy(schedule_config)" in content
+
+    preview = body('_preview_rotation_policy')
+    assert 'plan_retention(' in preview and 'os.remove' not in preview and 'delete_by_paths' not in preview
+    assert 'self._preview_rotation_policy(' in body('show_schedule_backup')
+
+    rotation = body('_perform_backup_rotation')
+    assert 'plan = plan_retention(backup_files, policy' in rotation
+    assert 'self.backup_history.get_manifest_paths(files_to_delete)' in rotation
+    assert 'get_backup_links' not in rotation and rotation.count('delete_by_paths') == 1
+    print("  ✓ Config, CLI, preview and rotation use the same plan")
+
+
+if __name__ == "__main__":
+    test_policy_spec_round_trip()
+    test_gfs_buckets()
+    test_last_rule_and_size_budget()
+    test_incremental_chains_protected()
+    test_policy_wired_through_schedule()
+    print("\n✅ All retention policy tests passed")
@@ -3,7 +3,7 @@
 Test robocopy implementation to ensure:
 1. Robocopy is used on Windows platforms
 2. Recommended robocopy options are present (/E, /NFL, /NDL, /MT:8, /R:2, /W:2)
-3. Fallback to file-by-file method exists for non-Windows platforms
+3. Fallback to chunked tar copy method exists for non-Windows platforms
 4. Status messages indicate when robocopy is being used
 5. Error handling and fallback for robocopy failures
 """
@@ -85,21 +85,21 @@ def test_platform_detection():
 
 
 def test_fallback_method_exists():
-    """Test that file-by-file fallback method exists"""
+    """Test that chunked tar copy fallback method exists"""
     print("\nTesting fallback method...")
     
     with open(os.path.join(os.path.dirname(__file__), '..', 'src', 'nextcloud_restore_and_backup-v9.py'), 'r') as f:
         source = f.read()
     
-    # Check for file-by-file method
-    if 'def _copy_folder_file_by_file(' in source:
-        print("  ✓ _copy_folder_file_by_file fallback method exists")
+    # Check for chunked tar copy method
+    if 'def _copy_folder_in_chunks(' in source:
+        print("  ✓ _copy_folder_in_chunks fallback method exists")
     else:
         print("  ✗ Fallback method not found")
         return False
     
     # Check that fallback is called on non-Windows
-    pattern = r"else:.*?_copy_folder_file_by_file"
+    pattern = r"else:.*?_copy_folder_in_chunks"
     if re.search(pattern, source, re.DOTALL):
         print("  ✓ Fallback method called on non-Windows platforms")
     else:
@@ -124,7 +124,7 @@ def test_robocopy_error_handling():
         return False
     
     # Check that fallback is triggered on error
-    pattern = r"if result\.returncode > 3:.*?_copy_folder_file_by_file"
+    pattern = r"if result\.returncode > 3:.*?_copy_folder_in_chunks"
     if re.search(pattern, source, re.DOTALL):
         print("  ✓ Fallback triggered on robocopy errors")
     else:
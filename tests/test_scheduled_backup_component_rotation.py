@@ -298,19 +298,17 @@ def test_backup_rotation_implementation():
     method_body = content[function_start:next_def]
     
     # Check for key rotation logic
-    assert 'listdir' in method_body or 'scandir' in method_body, \
+    # The backup catalog lists the directory (only when it changed), newest first
+    assert 'self.backup_catalog.files(backup_dir)' in method_body, \
         "Should list files in backup directory"
-    print("  ✓ Lists files in backup directory")
-    
-    assert 'sort' in method_body, \
-        "Should sort files by time"
-    print("  ✓ Sorts files by modification time")
+    assert 'listdir' not in method_body, "Should not walk the directory itself"
+    print("  ✓ Lists files in backup directory, newest first, from the catalog")
     
     assert 'os.remove' in method_body or 'unlink' in method_body, \
         "Should delete old backup files"
     print("  ✓ Deletes old backup files")
     
-    assert 'backup_history.delete_backup' in method_body, \
+    assert 'backup_history.delete_by_paths' in method_body, \
         "Should update backup history database"
     print("  ✓ Updates backup history database")
     
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Test suite for concurrent, cached service health checks.
+Verifies that check_service_health runs its checks concurrently, that each check is
+bounded by its own deadline, that per-check latency is recorded, and that the
+ServiceHealthMonitor serves cached results at once while stale ones are re-checked
+in the background.
+"""
+
+import os
+import sys
+import time
+import queue
+import socket
+import threading
+import subprocess
+
+# Import the module using importlib to handle the dash in filename
+import importlib.util
+spec = importlib.util.spec_from_file_location(
+    "nextcloud_restore",
+    os.path.join(os.path.dirname(__file__), "../src/nextcloud_restore_and_backup-v9.py")
+)
+nextcloud_restore = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(nextcloud_restore)
+
+
+class SlowCache:
+    """A container cache whose daemon check takes a while."""
+
+    def __init__(self, delay):
+        self.delay = delay
+
+    def available(self):
+        time.sleep(self.delay)
+        return True
+
+
+class SlowHost:
+    """Make every health check take `delay` seconds (network: `network_delay`)."""
+
+    def __init__(self, delay, network_delay=None):
+        self.delay = delay
+        self.network_delay = delay if network_delay is None else network_delay
+
+    def __enter__(self):
+        self.original = (nextcloud_restore.get_container_cache, nextcloud_restore.get_nextcloud_container_name,
+                         subprocess.run, socket.create_connection, nextcloud_restore.platform.system)
+        cache = SlowCache(self.delay)
+
+        def nextcloud_name():
+            time.sleep(self.delay)
+            return 'nextcloud-app'
+
+        def run(cmd, **kwargs):
+            time.sleep(self.delay)
+            return subprocess.CompletedProcess(cmd, 0, "100.64.0.1 host\n", "")
+
+        def connect(address, timeout=None):
+            time.sleep(self.network_delay)
+            if self.network_delay > timeout:
+                raise socket.timeout("timed out")
+            return socket.socket()
+        nextcloud_restore.get_container_cache = lambda: cache
+        nextcloud_restore.get_nextcloud_container_name = nextcloud_name
+        subprocess.run = run
+        socket.create_connection = connect
+        nextcloud_restore.platform.system = lambda: "Linux"
+        return self
+
+    def __exit__(self, *exc):
+        (nextcloud_restore.get_container_cache, nextcloud_restore.get_nextcloud_container_name,
+         subprocess.run, socket.create_connection, nextcloud_restore.platform.system) = self.original
+
+
+def test_checks_run_concurrently():
+    """Four 0.5 s checks finish in about 0.5 s, with their latency recorded."""
+    print("\nTesting concurrent checks...")
+    with SlowHost(0.5):
+        start = time.perf_counter()
+        health = nextcloud_restore.check_service_health()
+        elapsed = time.perf_counter() - start
+    assert list(health) == ['nextcloud', 'tailscale', 'docker', 'network']
+    assert all(info['status'] == 'healthy' for info in health.values()), health
+    assert all(450 <= info['latency_ms'] < 1500 for info in health.values()), health
+    assert elapsed < 1.2, f"checks took {elapsed:.2f}s (serial would be 2s)"
+    print(f"  ✓ 4 checks in {elapsed:.2f}s; latencies {[info['latency_ms'] for info in health.values()]}")
+
+
+def test_each_check_has_a_deadline():
+    """A check that overruns its deadline is reported as timed out; the others are not held up."""
+    print("\nTesting per-check deadlines...")
+    original = dict(nextcloud_restore.HEALTH_CHECK_DEADLINES)
+    nextcloud_restore.HEALTH_CHECK_DEADLINES['network'] = 0.3
+    try:
+        with SlowHost(0.05, network_delay=2.5):
+            start = time.perf_counter()
+            health = nextcloud_restore.check_service_health()
+            elapsed = time.perf_counter() - start
+        assert health['network']['status'] == 'warning' and 'timed out' in health['network']['message']
+        assert health['docker']['status'] == 'healthy'
+        assert elapsed < 1.0, f"waited {elapsed:.2f}s for a 0.3 s deadline"
+        print(f"  ✓ Network check cut off after {elapsed:.2f}s")
+    finally:
+        nextcloud_restore.HEALTH_CHECK_DEADLINES.clear()
+        nextcloud_restore.HEALTH_CHECK_DEADLINES.update(original)
+
+
+def test_monitor_serves_cache_and_revalidates():
+    """snapshot() never waits; stale results are re-checked in the background, one check at a time."""
+    print("\nTesting stale-while-revalidate...")
+    original = nextcloud_restore.check_service_health
+    calls = []
+    release = threading.Event()
+
+    def fake_check():
+        calls.append(time.monotonic())
+        release.wait(5)
+        return {'docker': {'status': 'healthy', 'message': f'check {len(calls)}',
+                           'checked_at': nextcloud_restore.datetime.now(), 'latency_ms': 1.0}}
+    try:
+        nextcloud_restore.check_service_health = fake_check
+        monitor = nextcloud_restore.ServiceHealthMonitor(ttl=60)
+        results = queue.Queue()
+        monitor.subscribe(results.put)
+
+        start = time.perf_counter()
+        first = monitor.snapshot()
+        assert time.perf_counter() - start < 0.1
+        assert first['docker']['status'] == 'unknown' and monitor.last_checked() is None
+        monitor.snapshot()
+        release.set()
+        assert results.get(timeout=5)['docker']['message'] == 'check 1'
+        assert monitor.snapshot()['docker']['message'] == 'check 1'
+        assert len(calls) == 1, "a fresh result is served without re-checking"
+
+        release.clear()
+        monitor.invalidate()
+        stale = monitor.snapshot()
+        assert stale['docker']['message'] == 'check 1', "stale result served while re-checking"
+        release.set()
+        assert results.get(timeout=5)['docker']['message'] == 'check 2'
+        monitor.snapshot(force=True)
+        assert results.get(timeout=5)['docker']['message'] == 'check 3'
+        assert len(calls) == 3
+        print("  ✓ Cached results served at once; 3 background checks for 6 snapshots")
+    finally:
+        release.set()
+        nextcloud_restore.check_service_health = original
+
+
+def test_dashboard_renders_from_monitor():
+    """The landing page renders cached results and updates from the 'health' bus channel."""
+    print("\nTesting dashboard wiring...")
+    src_path = os.path.join(os.path.dirname(__file__), "../src/nextcloud_restore_and_backup-v9.py")
+    with open(src_path, 'r') as f:
+        content = f.read()
+    start = content.find('def _refresh_health_dashboard(')
+    method = content[start:content.find('\n    def ', start + 10)]
+    assert "monitor.snapshot(force=force)" in method and "check_service_health()" not in method
+    assert "get_health_monitor().subscribe(lambda health_status: self.progress_bus.post('health', health_status))" in content
+    start = content.find('def _add_health_dashboard(')
+    method = content[start:content.find('\n    def ', start + 10)]
+    assert "self.progress_bus.subscribe('health', on_health_result)" in method
+    print("  ✓ Dashboard no longer blocks on the checks")
+
+
+if __name__ == "__main__":
+    test_checks_run_concurrently()
+    test_each_check_has_a_deadline()
+    test_monitor_serves_cache_and_revalidates()
+    test_dashboard_renders_from_monitor()
+    print("\n✅ All service health tests passed")
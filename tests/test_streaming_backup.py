@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Test suite for the streaming backup engine.
+Verifies that container folders are piped straight into the final .tar.gz archive
+without a staging directory, and that the docker cp stream fallback works when the
+container cannot run tar itself.
+"""
+
+import os
+import sys
+import tarfile
+import tempfile
+import shutil
+import subprocess
+
+# Import the module using importlib to handle the dash in filename
+import importlib.util
+spec = importlib.util.spec_from_file_location(
+    "nextcloud_restore",
+    os.path.join(os.path.dirname(__file__), "../src/nextcloud_restore_and_backup-v9.py")
+)
+nextcloud_restore = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(nextcloud_restore)
+
+
+def create_fake_nextcloud_root():
+    """Create a directory that looks like /var/www/html inside a container."""
+    root = tempfile.mkdtemp(prefix="fake_html_")
+    os.makedirs(os.path.join(root, "config"))
+    os.makedirs(os.path.join(root, "data", "admin", "files"))
+    os.makedirs(os.path.join(root, "apps", "files"))
+    with open(os.path.join(root, "config", "config.php"), "w") as f:
+        f.write("<?php\n$CONFIG = array (\n  'dbtype' => 'pgsql',\n);\n")
+    for i in range(20):
+        with open(os.path.join(root, "data", "admin", "files", f"doc_{i}.txt"), "w") as f:
+            f.write(f"document {i}\n" * 50)
+    with open(os.path.join(root, "apps", "files", "appinfo.xml"), "w") as f:
+        f.write("<info/>")
+    return root
+
+
+def local_tar_stream(root, folders):
+    """Stand-in for `docker exec tar -c`: stream a local directory as tar on stdout."""
+    return subprocess.Popen(['tar', '-c', '-C', root] + list(folders),
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+def test_streaming_backup_creates_archive_without_staging():
+    """Folders and the DB dump end up in one gzip archive; no staging dir or partial file remains."""
+    print("\n" + "=" * 60)
+    print("TEST: Streaming backup writes the final archive directly")
+    print("=" * 60)
+
+    root = create_fake_nextcloud_root()
+    out_dir = tempfile.mkdtemp(prefix="stream_backup_out_")
+    original = nextcloud_restore.open_container_tar_stream
+    try:
+        nextcloud_restore.open_container_tar_stream = lambda container, folders, base_path: local_tar_stream(root, folders)
+
+        dump_path = os.path.join(out_dir, "dump.sql")
+        with open(dump_path, "w") as f:
+            f.write("CREATE TABLE oc_users (uid TEXT);\n")
+
+        archive_path = os.path.join(out_dir, "nextcloud-backup-test.tar.gz")
+        progress = []
+        stats = nextcloud_restore.stream_backup_archive(
+            "nextcloud-app", ["config", "data"], archive_path,
+            extra_files={"nextcloud-db.sql": dump_path},
+            progress_callback=lambda files, size, name: progress.append((files, size, name))
+        )
+
+        assert os.path.exists(archive_path), "Archive was not created"
+        assert not os.path.exists(archive_path + ".partial"), "Partial file left behind"
+        assert progress, "Progress callback was never called"
+        assert stats['files'] == progress[-1][0]
+
+        with tarfile.open(archive_path, 'r:gz') as tar:
+            names = tar.getnames()
+        assert "config/config.php" in names
+        assert "data/admin/files/doc_0.txt" in names
+        assert "nextcloud-db.sql" in names
+        assert not any(n.startswith("apps") for n in names), "Unselected folder was archived"
+        print(f"  ✓ Archive contains {len(names)} entries, {stats['bytes']} bytes of payload")
+    finally:
+        nextcloud_restore.open_container_tar_stream = original
+        shutil.rmtree(root, ignore_errors=True)
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+
+def test_streaming_backup_falls_back_to_docker_cp_stream():
+    """When tar is unavailable in the container, per-folder docker cp streams are used."""
+    print("\n" + "=" * 60)
+    print("TEST: Fallback to docker cp tar streams")
+    print("=" * 60)
+
+    root = create_fake_nextcloud_root()
+    out_dir = tempfile.mkdtemp(prefix="stream_backup_out_")
+    original_tar = nextcloud_restore.open_container_tar_stream
+    original_cp = nextcloud_restore.open_container_folder_cp_stream
+    cp_calls = []
+    try:
+        # Simulate "tar: executable file not found" inside the container
+        nextcloud_restore.open_container_tar_stream = lambda container, folders, base_path: subprocess.Popen(
+            [sys.executable, '-c', 'import sys; sys.stderr.write("tar: not found\\n"); sys.exit(127)'],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+        def fake_cp(container, folder, base_path):
+            cp_calls.append(folder)
+            return local_tar_stream(root, [folder])
+        nextcloud_restore.open_container_folder_cp_stream = fake_cp
+
+        archive_path = os.path.join(out_dir, "nextcloud-backup-fallback.tar.gz")
+        nextcloud_restore.stream_backup_archive("nextcloud-app", ["config", "data", "apps"], archive_path)
+
+        assert cp_calls == ["config", "data", "apps"], f"Unexpected docker cp calls: {cp_calls}"
+        with tarfile.open(archive_path, 'r:gz') as tar:
+            names = tar.getnames()
+        assert "config/config.php" in names
+        assert "apps/files/appinfo.xml" in names
+        print(f"  ✓ Fallback archived {len(names)} entries via {len(cp_calls)} docker cp streams")
+    finally:
+        nextcloud_restore.open_container_tar_stream = original_tar
+        nextcloud_restore.open_container_folder_cp_stream = original_cp
+        shutil.rmtree(root, ignore_errors=True)
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+
+def test_failed_stream_removes_partial_archive():
+    """A broken stream must not leave a file that looks like a valid backup."""
+    print("\n" + "=" * 60)
+    print("TEST: Failed stream cleans up the partial archive")
+    print("=" * 60)
+
+    out_dir = tempfile.mkdtemp(prefix="stream_backup_out_")
+    original_tar = nextcloud_restore.open_container_tar_stream
+    original_cp = nextcloud_restore.open_container_folder_cp_stream
+    try:
+        failing = lambda *args: subprocess.Popen([sys.executable, '-c', 'import sys; sys.exit(1)'],
+                                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        nextcloud_restore.open_container_tar_stream = failing
+        nextcloud_restore.open_container_folder_cp_stream = failing
+
+        archive_path = os.path.join(out_dir, "nextcloud-backup-broken.tar.gz")
+        try:
+            nextcloud_restore.stream_backup_archive("nextcloud-app", ["config"], archive_path)
+            assert False, "Expected the broken stream to raise"
+        except Exception as e:
+            print(f"  ✓ Raised as expected: {e}")
+
+        assert not os.path.exists(archive_path)
+        assert not os.path.exists(archive_path + ".partial")
+        print("  ✓ No archive or partial file left behind")
+    finally:
+        nextcloud_restore.open_container_tar_stream = original_tar
+        nextcloud_restore.open_container_folder_cp_stream = original_cp
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+
+def test_backup_processes_use_streaming_engine():
+    """Both backup entry points stream into the archive instead of staging a copy."""
+    print("\n" + "=" * 60)
+    print("TEST: Backup processes use the streaming engine")
+    print("=" * 60)
+
+    src_path = os.path.join(os.path.dirname(__file__), "../src/nextcloud_restore_and_backup-v9.py")
+    with open(src_path, 'r') as f:
+        content = f.read()
+
+    assert "shutil.make_archive" not in content, "make_archive staging path still present"
+    assert 'f"ncbackup_{timestamp}")' not in content, "Staging directory still created"
+    assert content.count("stream_backup_archive(container_name, copied_folders, backup_file") == 2
+    print("  ✓ run_backup_process and run_backup_process_scheduled stream directly")
+
+
+if __name__ == "__main__":
+    try:
+        test_streaming_backup_creates_archive_without_staging()
+        test_streaming_backup_falls_back_to_docker_cp_stream()
+        test_failed_stream_removes_partial_archive()
+        test_backup_processes_use_streaming_engine()
+        print("\n✅ All streaming backup tests passed")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ ASSERTION FAILED: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Test suite for database-type detection on encrypted backups.
+Verifies that config.php is read from the gpg output stream without a decrypted copy
+on disk, that gpg is stopped as soon as config.php has been found, and that a wrong
+password is reported as a gpg error.
+
+The tests are skipped when gpg is not installed.
+"""
+
+import os
+import sys
+import io
+import time
+import shutil
+import tarfile
+import tempfile
+
+# Import the module using importlib to handle the dash in filename
+import importlib.util
+spec = importlib.util.spec_from_file_location(
+    "nextcloud_restore",
+    os.path.join(os.path.dirname(__file__), "../src/nextcloud_restore_and_backup-v9.py")
+)
+nextcloud_restore = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(nextcloud_restore)
+
+GPG_AVAILABLE = nextcloud_restore.check_gpg_available()[0]
+PASSWORD = "correct horse battery staple"
+CONFIG_PHP = b"<?php\n$CONFIG = array (\n  'dbtype' => 'mysql',\n  'dbname' => 'nextcloud',\n);\n"
+
+
+def create_encrypted_backup(work_dir, config_first=True, data_mb=24):
+    """Write a .tar.gz.gpg backup with data_mb of file data and config.php first or last."""
+    plain_path = os.path.join(work_dir, "nextcloud-backup-test.tar.gz")
+    members = [("data/admin/files/video_%d.bin" % i, os.urandom(1024 * 1024)) for i in range(data_mb)]
+    config = ("config/config.php", CONFIG_PHP)
+    members = [config] + members if config_first else members + [config]
+    with tarfile.open(plain_path, "w:gz", compresslevel=1) as tar:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    encrypted_path = plain_path + ".gpg"
+    nextcloud_restore.encrypt_file_gpg(plain_path, encrypted_path, PASSWORD)
+    os.remove(plain_path)
+    return encrypted_path
+
+
+class RecordingReader(nextcloud_restore.GpgDecryptingReader):
+    """GpgDecryptingReader that remembers its instances so tests can inspect them."""
+    instances = []
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        RecordingReader.instances.append(self)
+
+
+def detect_with_recording_reader(archive_path, extract_to, password):
+    """Run extract_config_php_only and return (config_path, reader, seconds)."""
+    original = nextcloud_restore.GpgDecryptingReader
+    RecordingReader.instances = []
+    nextcloud_restore.GpgDecryptingReader = RecordingReader
+    try:
+        start = time.time()
+        config_path = nextcloud_restore.extract_config_php_only(archive_path, extract_to, password)
+        elapsed = time.time() - start
+    finally:
+        nextcloud_restore.GpgDecryptingReader = original
+    assert len(RecordingReader.instances) == 1
+    return config_path, RecordingReader.instances[0], elapsed
+
+
+def test_config_first_stops_gpg_early():
+    """With config.php at the front, only the start of a large archive is decrypted."""
+    print("\nTesting early exit on encrypted backup...")
+    if not GPG_AVAILABLE:
+        print("  - Skipped: gpg not installed")
+        return
+    work_dir = tempfile.mkdtemp(prefix="stream_decrypt_early_")
+    try:
+        archive_path = create_encrypted_backup(work_dir, config_first=True)
+        before = set(os.listdir(work_dir))
+        config_path, reader, elapsed = detect_with_recording_reader(
+            archive_path, os.path.join(work_dir, "cfg"), PASSWORD)
+
+        assert config_path and open(config_path, 'rb').read() == CONFIG_PHP
+        assert reader.stopped_early, "gpg should be stopped once config.php is found"
+        assert reader.returncode is not None, "gpg process was not reaped"
+        assert reader.bytes_out < 4 * 1024 * 1024, f"Decrypted {reader.bytes_out} bytes"
+        assert set(os.listdir(work_dir)) == before | {"cfg"}, "No decrypted copy should be written"
+        print(f"  ✓ Found config.php after decrypting {reader.bytes_out // 1024} KiB "
+              f"of {os.path.getsize(archive_path) // 1024} KiB in {elapsed:.2f}s")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def test_config_last_still_found():
+    """config.php at the end of the archive is found after decrypting everything."""
+    print("\nTesting config.php at the end of an encrypted backup...")
+    if not GPG_AVAILABLE:
+        print("  - Skipped: gpg not installed")
+        return
+    work_dir = tempfile.mkdtemp(prefix="stream_decrypt_late_")
+    try:
+        archive_path = create_encrypted_backup(work_dir, config_first=False, data_mb=4)
+        config_path, reader, elapsed = detect_with_recording_reader(
+            archive_path, os.path.join(work_dir, "cfg"), PASSWORD)
+        assert config_path and config_path.endswith(os.path.join("config", "config.php"))
+        assert reader.bytes_out > 4 * 1024 * 1024
+        assert reader.error() is None
+        print(f"  ✓ Found config.php after decrypting {reader.bytes_out // 1024} KiB")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def test_wrong_password_reports_gpg_error():
+    """A wrong password surfaces gpg's error rather than a tar read error."""
+    print("\nTesting wrong password...")
+    if not GPG_AVAILABLE:
+        print("  - Skipped: gpg not installed")
+        return
+    work_dir = tempfile.mkdtemp(prefix="stream_decrypt_badpw_")
+    try:
+        archive_path = create_encrypted_backup(work_dir, data_mb=1)
+        try:
+            nextcloud_restore.extract_config_php_only(archive_path, os.path.join(work_dir, "cfg"), "wrong")
+            assert False, "Expected a decryption error"
+        except Exception as e:
+            assert "GPG decryption failed" in str(e), e
+            assert "Bad session key" in str(e) or "decryption failed: " in str(e), e
+            print(f"  ✓ Raised: {str(e).splitlines()[0]}")
+
+        # Without a password the archive is rejected as encrypted, as before
+        try:
+            nextcloud_restore.extract_config_php_only(archive_path, os.path.join(work_dir, "cfg"))
+            assert False, "Expected encrypted archive without password to fail"
+        except Exception as e:
+            assert "encrypted" in str(e), e
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def test_early_detection_streams_encrypted_backups():
+    """early_detect_database_type_from_backup no longer decrypts to a temporary file."""
+    print("\nTesting early detection source...")
+    src_path = os.path.join(os.path.dirname(__file__), "../src/nextcloud_restore_and_backup-v9.py")
+    with open(src_path, 'r') as f:
+        content = f.read()
+    start = content.find('def early_detect_database_type_from_backup(')
+    end = content.find('\n    def ', start + 100)
+    method = content[start:end]
+    assert "decrypt_file_gpg(" not in method
+    assert "tempfile.mktemp(" not in method
+    assert "extract_config_php_only(backup_to_extract, temp_extract_dir, password)" in method
+    assert 'raise Exception("Incorrect decryption password")' in method
+    print("  ✓ Encrypted backups are decrypted on a pipe during detection")
+
+
+if __name__ == "__main__":
+    test_config_first_stops_gpg_early()
+    test_config_last_still_found()
+    test_wrong_password_reports_gpg_error()
+    test_early_detection_streams_encrypted_backups()
+    print("\n✅ All streaming decryption tests passed")
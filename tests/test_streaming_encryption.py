@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Test suite for encrypting backups while they stream.
+Verifies that the compressed tar stream is piped through gpg so that only the final
+.gpg file is written, that the passphrase never appears on gpg's command line or on
+disk (on Windows it travels on an inherited pipe handle), and that a failing
+gpg leaves no partial archive behind.
+
+The tests are skipped when gpg is not installed.
+"""
+
+import os
+import sys
+import shutil
+import tarfile
+import tempfile
+import subprocess
+
+# Import the module using importlib to handle the dash in filename
+import importlib.util
+spec = importlib.util.spec_from_file_location(
+    "nextcloud_restore",
+    os.path.join(os.path.dirname(__file__), "../src/nextcloud_restore_and_backup-v9.py")
+)
+nextcloud_restore = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(nextcloud_restore)
+
+GPG_AVAILABLE = nextcloud_restore.check_gpg_available()[0]
+PASSWORD = "correct horse battery staple"
+
+
+def create_fake_nextcloud_root():
+    """Create a directory that looks like /var/www/html inside a container."""
+    root = tempfile.mkdtemp(prefix="fake_html_")
+    os.makedirs(os.path.join(root, "config"))
+    os.makedirs(os.path.join(root, "data", "admin", "files"))
+    with open(os.path.join(root, "config", "config.php"), "w") as f:
+        f.write("<?php\n$CONFIG = array (\n  'dbtype' => 'sqlite',\n);\n")
+    for i in range(20):
+        with open(os.path.join(root, "data", "admin", "files", f"doc_{i}.txt"), "w") as f:
+            f.write(f"secret document {i}\n" * 500)
+    return root
+
+
+def test_encrypted_stream_writes_only_gpg_file():
+    """The archive is encrypted on the fly; no plaintext archive ever exists on disk."""
+    print("\nTesting streaming encryption...")
+    if not GPG_AVAILABLE:
+        print("  - Skipped: gpg not installed")
+        return
+    root = create_fake_nextcloud_root()
+    out_dir = tempfile.mkdtemp(prefix="stream_encrypt_out_")
+    original = nextcloud_restore.open_container_tar_stream
+    seen_files = set()
+    try:
+        nextcloud_restore.open_container_tar_stream = lambda c, folders, base_path: subprocess.Popen(
+            ['tar', '-c', '-C', root] + list(folders), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+        archive_path = os.path.join(out_dir, "nextcloud-backup-test.tar.gz.gpg")
+        nextcloud_restore.stream_backup_archive(
+            "nextcloud-app", ["config", "data"], archive_path,
+            progress_callback=lambda *args: seen_files.update(os.listdir(out_dir)),
+            encryption_password=PASSWORD
+        )
+
+        assert os.listdir(out_dir) == ["nextcloud-backup-test.tar.gz.gpg"]
+        assert seen_files <= {"nextcloud-backup-test.tar.gz.gpg.partial"}, f"Unexpected files: {seen_files}"
+        assert nextcloud_restore.detect_archive_format(archive_path) == 'gpg'
+        with open(archive_path, "rb") as f:
+            assert b"secret document" not in f.read()
+
+        decrypted = os.path.join(out_dir, "decrypted.tar.gz")
+        nextcloud_restore.decrypt_file_gpg(archive_path, decrypted, PASSWORD)
+        with tarfile.open(decrypted, "r:gz") as tar:
+            names = tar.getnames()
+        assert "config/config.php" in names and "data/admin/files/doc_19.txt" in names
+        print(f"  ✓ Encrypted archive decrypts to {len(names)} entries; no plaintext file written")
+    finally:
+        nextcloud_restore.open_container_tar_stream = original
+        shutil.rmtree(root, ignore_errors=True)
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+
+def test_passphrase_not_on_command_line_and_no_recompression():
+    """gpg receives the passphrase on a pipe and runs with its compression disabled."""
+    print("\nTesting gpg command line...")
+    if not GPG_AVAILABLE:
+        print("  - Skipped: gpg not installed")
+        return
+    out_dir = tempfile.mkdtemp(prefix="stream_encrypt_args_")
+    try:
+        writer = nextcloud_restore.GpgEncryptingWriter(os.path.join(out_dir, "x.gpg"), PASSWORD)
+        with writer:
+            writer.write(b"already compressed bytes" * 100)
+        assert PASSWORD not in " ".join(writer.proc.args), "Passphrase visible in the process list"
+        assert "--passphrase-fd" in writer.proc.args
+        assert writer.proc.args[writer.proc.args.index("--compress-algo") + 1] == "none"
+
+        packets = subprocess.run(['gpg', '--batch', '--passphrase-fd', '0', '--list-packets',
+                                  os.path.join(out_dir, "x.gpg")],
+                                 input=PASSWORD.encode(), capture_output=True).stdout.decode()
+        assert "compressed packet" not in packets, "gpg recompressed the archive"
+        print("  ✓ --passphrase-fd used, no compressed packet in the output")
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+
+def test_windows_passphrase_uses_inherited_pipe_handle():
+    """On Windows the passphrase pipe's handle is passed to gpg alone; nothing is written to disk."""
+    print("\nTesting Windows passphrase handle...")
+    temp_dir = tempfile.mkdtemp(prefix="stream_encrypt_passhandle_")
+    inheritable = []
+
+    class FakeStartupInfo:
+        def __init__(self, lpAttributeList=None):
+            self.lpAttributeList = lpAttributeList
+    fake_msvcrt = type(sys)('msvcrt')
+    fake_msvcrt.get_osfhandle = lambda fd: fd + 1000
+    original = (os.name, sys.modules.get('msvcrt'), tempfile.tempdir,
+                getattr(os, 'set_handle_inheritable', None), getattr(subprocess, 'STARTUPINFO', None))
+    sys.modules['msvcrt'] = fake_msvcrt
+    tempfile.tempdir = temp_dir
+    os.set_handle_inheritable = lambda handle, value: inheritable.append((handle, value))
+    subprocess.STARTUPINFO = FakeStartupInfo
+    try:
+        os.name = 'nt'
+        try:
+            args, popen_kwargs, read_fd = nextcloud_restore.gpg_passphrase_args(PASSWORD)
+        finally:
+            os.name = original[0]
+        handle = read_fd + 1000
+        assert args == ['--passphrase-fd', str(handle)], args
+        assert PASSWORD not in " ".join(args), "Passphrase visible in the process list"
+        assert inheritable == [(handle, True)], inheritable
+        assert popen_kwargs['startupinfo'].lpAttributeList == {'handle_list': [handle]}
+        assert 'pass_fds' not in popen_kwargs
+        with os.fdopen(read_fd, 'rb') as pipe_in:
+            assert pipe_in.read() == PASSWORD.encode() + b"\n"
+        assert os.listdir(temp_dir) == [], "passphrase written to a temporary file"
+        print("  ✓ --passphrase-fd names an inheritable pipe handle listed for gpg only")
+    finally:
+        if original[1] is None:
+            sys.modules.pop('msvcrt', None)
+        else:
+            sys.modules['msvcrt'] = original[1]
+        tempfile.tempdir = original[2]
+        for module, name, value in ((os, 'set_handle_inheritable', original[3]),
+                                    (subprocess, 'STARTUPINFO', original[4])):
+            if value is None:
+                delattr(module, name)
+            else:
+                setattr(module, name, value)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def test_gpg_failure_removes_partial_archive():
+    """If gpg cannot write its output, the backup fails and leaves nothing behind."""
+    print("\nTesting gpg failure...")
+    if not GPG_AVAILABLE:
+        print("  - Skipped: gpg not installed")
+        return
+    root = create_fake_nextcloud_root()
+    out_dir = tempfile.mkdtemp(prefix="stream_encrypt_fail_")
+    original = nextcloud_restore.open_container_tar_stream
+    try:
+        nextcloud_restore.open_container_tar_stream = lambda c, folders, base_path: subprocess.Popen(
+            ['tar', '-c', '-C', root] + list(folders), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        archive_path = os.path.join(out_dir, "missing-dir", "nextcloud-backup-test.tar.gz.gpg")
+        try:
+            nextcloud_restore.stream_backup_archive("nextcloud-app", ["config", "data"], archive_path,
+                                                    encryption_password=PASSWORD)
+            assert False, "Expected gpg failure to raise"
+        except Exception as e:
+            assert "GPG encryption failed" in str(e), e
+            print(f"  ✓ Raised: {str(e).splitlines()[0]}")
+        assert os.listdir(out_dir) == []
+    finally:
+        nextcloud_restore.open_container_tar_stream = original
+        shutil.rmtree(root, ignore_errors=True)
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+
+def test_backup_processes_encrypt_while_streaming():
+    """Neither backup entry point writes a plaintext archive and encrypts it afterwards."""
+    print("\nTesting backup processes...")
+    src_path = os.path.join(os.path.dirname(__file__), "../src/nextcloud_restore_and_backup-v9.py")
+    with open(src_path, 'r') as f:
+        content = f.read()
+    assert "encrypt_file_gpg(backup_file" not in content
+    assert content.count("encryption_password=encryption_password if encrypt else None") == 2
+    print("  ✓ run_backup_process and run_backup_process_scheduled encrypt in the stream")
+
+
+if __name__ == "__main__":
+    test_encrypted_stream_writes_only_gpg_file()
+    test_passphrase_not_on_command_line_and_no_recompression()
+    test_windows_passphrase_uses_inherited_pipe_handle()
+    test_gpg_failure_removes_partial_archive()
+    test_backup_processes_encrypt_while_streaming()
+    print("\n✅ All streaming encryption tests passed")
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Test suite for the streaming restore engine.
+Verifies that restore_archive_to_container pipes the selected folders of a backup
+(plain, encrypted or an incremental chain) into tar as one stream, rewrites unsafe or
+'./'-prefixed member names, reports progress in archive bytes read, only replaces
+the folders once the whole archive has been read, and that the restore wizard only
+extracts config and database files locally.
+
+The container's commands run locally against a temporary directory; the
+encrypted test is skipped when gpg is not installed.
+"""
+
+import os
+import sys
+import io
+import json
+import shutil
+import tarfile
+import tempfile
+import subprocess
+
+# Import the module using importlib to handle the dash in filename
+import importlib.util
+spec = importlib.util.spec_from_file_location(
+    "nextcloud_restore",
+    os.path.join(os.path.dirname(__file__), "../src/nextcloud_restore_and_backup-v9.py")
+)
+nextcloud_restore = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(nextcloud_restore)
+
+GPG_AVAILABLE = nextcloud_restore.check_gpg_available()[0]
+PASSWORD = "correct horse battery staple"
+
+
+def write_archive(archive_path, members, info=None):
+    """Write a .tar.gz with the given {name: bytes} members (and an info member)."""
+    with tarfile.open(archive_path, "w:gz", compresslevel=1) as tar:
+        if info is not None:
+            data = json.dumps(info).encode()
+            entry = tarfile.TarInfo(nextcloud_restore.BACKUP_INFO_NAME)
+            entry.size = len(data)
+            tar.addfile(entry, io.BytesIO(data))
+        for name, data in members.items():
+            entry = tarfile.TarInfo(name)
+            entry.size = len(data)
+            tar.addfile(entry, io.BytesIO(data))
+
+
+class LocalContainer:
+    """Stand in for a container: its commands run locally, with the Nextcloud root at root."""
+
+    def __init__(self, root):
+        self.root = root
+        self.removed = []
+        self.commands = []
+
+    def __enter__(self):
+        self.originals = (nextcloud_restore.open_container_tar_extract_stream,
+                          nextcloud_restore.container_has_tar,
+                          nextcloud_restore.docker_exec)
+        nextcloud_restore.open_container_tar_extract_stream = lambda c, base_path: subprocess.Popen(
+            ['tar', '-x', '-f', '-', '-C', base_path],
+            stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        nextcloud_restore.container_has_tar = lambda c: True
+        nextcloud_restore.docker_exec = self.exec
+        return self
+
+    def exec(self, container_name, cmd, input=None, timeout=None, user=None):
+        self.commands.append(cmd)
+        if cmd[:3] == ['rm', '-rf', '--']:
+            self.removed.extend(os.path.relpath(path, self.root).replace(os.sep, '/') for path in cmd[3:])
+        return subprocess.run(cmd, input=input, capture_output=True, timeout=timeout)
+
+    def __exit__(self, *exc):
+        (nextcloud_restore.open_container_tar_extract_stream,
+         nextcloud_restore.container_has_tar,
+         nextcloud_restore.docker_exec) = self.originals
+
+
+def read_tree(directory):
+    """Map of relative path -> file contents under directory."""
+    tree = {}
+    for dirpath, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(dirpath, name)
+            with open(path, 'rb') as f:
+                tree[os.path.relpath(path, directory).replace(os.sep, '/')] = f.read()
+    return tree
+
+
+def test_member_names_are_normalized():
+    """'./' and leading '/' are stripped; names and symlink targets escaping the root are rejected."""
+    print("\nTesting member name rewriting...")
+    normalize = nextcloud_restore.normalize_restore_member_name
+    assert normalize("./data/admin/files/a.txt") == "data/admin/files/a.txt"
+    assert normalize("/config//config.php") == "config/config.php"
+    assert normalize("data/../../etc/passwd") is None
+    assert normalize("./") is None
+    safe_link = nextcloud_restore.is_safe_symlink_target
+    assert safe_link("data/admin/files/link", "../notes/a.md")
+    assert safe_link("config/current", "../data/./admin")
+    assert not safe_link("data/link", "../../etc")
+    assert not safe_link("data/link", "/etc/passwd")
+    assert not safe_link("data/link", "C:\\Windows")
+    assert not safe_link("link", "")
+    assert nextcloud_restore.is_restore_local_path("nextcloud-db.sql")
+    assert nextcloud_restore.is_restore_local_path("data/owncloud.db")
+    assert not nextcloud_restore.is_restore_local_path("data/admin/files/a.db")
+    print("  ✓ Names rewritten under the Nextcloud root")
+
+
+def test_restore_streams_selected_folders():
+    """Only the requested folders reach the container, with rewritten names and byte progress."""
+    print("\nTesting streaming restore of a plain archive...")
+    work_dir = tempfile.mkdtemp(prefix="stream_restore_plain_")
+    try:
+        archive_path = os.path.join(work_dir, "nextcloud-backup-test.tar.gz")
+        write_archive(archive_path, {
+            "./config/config.php": b"<?php $CONFIG = array();",
+            "./data/admin/files/report.txt": os.urandom(300 * 1024),
+            "apps/notes/appinfo/info.xml": b"<info/>",
+            "../outside.txt": b"must not be written",
+            "nextcloud-db.sql": b"-- dump",
+        })
+        root = os.path.join(work_dir, "html")
+        os.makedirs(os.path.join(root, "data", "old"))
+        open(os.path.join(root, "data", "old", "stale.txt"), "w").close()
+        progress = []
+        chain, _ = nextcloud_restore.resolve_backup_chain(archive_path, work_dir, decrypt=False)
+        with LocalContainer(root):
+            stats = nextcloud_restore.restore_archive_to_container(
+                chain, "nextcloud-app", ["config", "data", "apps", "custom_apps"], base_path=root,
+                progress_callback=lambda *args: progress.append(args))
+
+        tree = read_tree(root)
+        assert set(tree) == {"config/config.php", "data/admin/files/report.txt", "apps/notes/appinfo/info.xml"}, tree
+        assert not os.path.exists(os.path.join(work_dir, "outside.txt"))
+        assert stats['files'] == 3
+        assert progress[-1][2] == os.path.getsize(archive_path)
+        assert 0 < progress[-1][1] <= progress[-1][2]
+        print(f"  ✓ {stats['files']} entries streamed; stale data removed; progress in archive bytes")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def test_incremental_chain_applies_deletions():
+    """Each incremental's deletions are applied in the container before it is streamed."""
+    print("\nTesting streaming restore of an incremental chain...")
+    work_dir = tempfile.mkdtemp(prefix="stream_restore_chain_")
+    try:
+        full = os.path.join(work_dir, "nextcloud-backup-full.tar.gz")
+        write_archive(full, {"config/config.php": b"v1", "data/admin/files/a.txt": b"a",
+                             "data/admin/files/b.txt": b"b"}, info={'backup_type': 'full'})
+        incremental = os.path.join(work_dir, "nextcloud-backup-incr.tar.gz")
+        write_archive(incremental, {"data/admin/files/c.txt": b"c"},
+                      info={'backup_type': 'incremental', 'parent': os.path.basename(full),
+                            'deleted': ["data/admin/files/a.txt"]})
+        chain, _ = nextcloud_restore.resolve_backup_chain(incremental, work_dir, decrypt=False)
+        assert [path for path, _ in chain] == [full, incremental]
+
+        root = os.path.join(work_dir, "html")
+        os.makedirs(root)
+        with LocalContainer(root) as container:
+            nextcloud_restore.restore_archive_to_container(chain, "nextcloud-app", ["config", "data"],
+                                                           base_path=root)
+        assert read_tree(root) == {"config/config.php": b"v1", "data/admin/files/b.txt": b"b",
+                                   "data/admin/files/c.txt": b"c"}
+        assert ".restore-staging/data/admin/files/a.txt" in container.removed
+
+        local = os.path.join(work_dir, "local")
+        nextcloud_restore.extract_restore_local_files(chain, local)
+        assert read_tree(local) == {"config/config.php": b"v1"}
+        print("  ✓ Chain replayed into the container; only config extracted locally")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def test_failed_restore_keeps_current_folders():
+    """A corrupt archive fails before anything is replaced; existing folders stay in place."""
+    print("\nTesting restore of a corrupt archive...")
+    work_dir = tempfile.mkdtemp(prefix="stream_restore_corrupt_")
+    try:
+        archive_path = os.path.join(work_dir, "nextcloud-backup-test.tar.gz")
+        write_archive(archive_path, {"config/config.php": b"new", "data/admin/files/new.bin": os.urandom(256 * 1024)})
+        with open(archive_path, 'r+b') as f:
+            f.truncate(os.path.getsize(archive_path) // 2)
+        root = os.path.join(work_dir, "html")
+        os.makedirs(os.path.join(root, "config"))
+        os.makedirs(os.path.join(root, "data", "admin"))
+        with open(os.path.join(root, "config", "config.php"), "wb") as f:
+            f.write(b"current")
+        with open(os.path.join(root, "data", "admin", "old.txt"), "wb") as f:
+            f.write(b"old")
+        data_inode = os.stat(os.path.join(root, "data")).st_ino
+        chain, _ = nextcloud_restore.resolve_backup_chain(archive_path, work_dir, decrypt=False)
+        with LocalContainer(root):
+            try:
+                nextcloud_restore.restore_archive_to_container(chain, "nextcloud-app", ["config", "data"],
+                                                               base_path=root)
+                assert False, "Expected a read error"
+            except Exception:
+                pass
+            assert read_tree(root) == {"config/config.php": b"current", "data/admin/old.txt": b"old"}
+            assert sorted(os.listdir(root)) == ["config", "data"], "staging directory left behind"
+
+            write_archive(archive_path, {"config/config.php": b"new", "data/admin/files/new.bin": b"x"})
+            chain, _ = nextcloud_restore.resolve_backup_chain(archive_path, work_dir, decrypt=False)
+            nextcloud_restore.restore_archive_to_container(chain, "nextcloud-app", ["config", "data"],
+                                                           base_path=root)
+        assert read_tree(root) == {"config/config.php": b"new", "data/admin/files/new.bin": b"x"}
+        assert os.stat(os.path.join(root, "data")).st_ino == data_inode, "data/ replaced instead of emptied"
+        print("  ✓ Corrupt archive left the folders untouched; a good one was swapped in")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def test_encrypted_archive_streams_through_gpg():
+    """Encrypted backups are decrypted on a pipe; no decrypted copy is written."""
+    print("\nTesting streaming restore of an encrypted archive...")
+    if not GPG_AVAILABLE:
+        print("  - Skipped: gpg not installed")
+        return
+    work_dir = tempfile.mkdtemp(prefix="stream_restore_gpg_")
+    try:
+        plain_path = os.path.join(work_dir, "nextcloud-backup-test.tar.gz")
+        payload = os.urandom(512 * 1024)
+        write_archive(plain_path, {"config/config.php": b"<?php", "data/admin/files/x.bin": payload})
+        encrypted_path = plain_path + ".gpg"
+        nextcloud_restore.encrypt_file_gpg(plain_path, encrypted_path, PASSWORD)
+        os.remove(plain_path)
+
+        chain, _ = nextcloud_restore.resolve_backup_chain(encrypted_path, work_dir, PASSWORD, decrypt=False)
+        root = os.path.join(work_dir, "html")
+        os.makedirs(root)
+        with LocalContainer(root):
+            nextcloud_restore.restore_archive_to_container(chain, "nextcloud-app", ["config", "data"],
+                                                           base_path=root, password=PASSWORD)
+            assert read_tree(root)["data/admin/files/x.bin"] == payload
+            try:
+                nextcloud_restore.restore_archive_to_container(chain, "nextcloud-app", ["data"],
+                                                               base_path=root, password="wrong")
+                assert False, "Expected a decryption error"
+            except Exception as e:
+                assert "GPG decryption failed" in str(e), e
+            assert read_tree(root)["data/admin/files/x.bin"] == payload, "data removed before decryption"
+        assert sorted(os.listdir(root)) == ["config", "data"], "staging directory left behind"
+        assert sorted(os.listdir(work_dir)) == ["html", "nextcloud-backup-test.tar.gz.gpg"]
+        print("  ✓ Decrypted in-stream; wrong password reported by gpg")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def test_restore_wizard_streams_archives():
+    """The restore thread streams archives and keeps full extraction only as a fallback."""
+    print("\nTesting restore wizard wiring...")
+    src_path = os.path.join(os.path.dirname(__file__), "../src/nextcloud_restore_and_backup-v9.py")
+    with open(src_path, 'r') as f:
+        content = f.read()
+    start = content.find('def _restore_auto_thread(')
+    end = content.find('\n    def ', start + 100)
+    method = content[start:end]
+    assert "self._stream_archive_into_container(" in method
+    assert "self.auto_extract_backup(backup_path, password, full=True)" in method
+    assert "return self._extract_archive_for_restore(backup_path, password, extract_temp)" in content
+    print("  ✓ _restore_auto_thread uses the streaming restore engine")
+
+
+if __name__ == "__main__":
+    test_member_names_are_normalized()
+    test_restore_streams_selected_folders()
+    test_incremental_chain_applies_deletions()
+    test_failed_restore_keeps_current_folders()
+    test_encrypted_archive_streams_through_gpg()
+    test_restore_wizard_streams_archives()
+    print("\n✅ All streaming restore tests passed")
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Test suite for the constant-memory backup verifier.
+Verifies that verify_archive_stream keeps memory flat as the number of files grows,
+decompresses every payload so corruption inside a file is caught, and checks encrypted
+backups through a gpg pipe without writing a decrypted copy.
+
+The encrypted tests are skipped when gpg is not installed.
+"""
+
+import os
+import sys
+import io
+import shutil
+import tarfile
+import tempfile
+import tracemalloc
+
+# Import the module using importlib to handle the dash in filename
+import importlib.util
+spec = importlib.util.spec_from_file_location(
+    "nextcloud_restore",
+    os.path.join(os.path.dirname(__file__), "../src/nextcloud_restore_and_backup-v9.py")
+)
+nextcloud_restore = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(nextcloud_restore)
+
+GPG_AVAILABLE = nextcloud_restore.check_gpg_available()[0]
+PASSWORD = "correct horse battery staple"
+
+
+def write_backup(archive_path, file_count, payload=b"small file\n", big_file_size=0):
+    """Write a Nextcloud-like .tar.gz with file_count small data files."""
+    with tarfile.open(archive_path, "w:gz", compresslevel=1) as tar:
+        config = b"<?php\n$CONFIG = array (\n  'dbtype' => 'sqlite',\n);\n"
+        info = tarfile.TarInfo("config/config.php")
+        info.size = len(config)
+        tar.addfile(info, io.BytesIO(config))
+        if big_file_size:
+            data = os.urandom(big_file_size)
+            info = tarfile.TarInfo("data/admin/files/big.bin")
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+        for i in range(file_count):
+            info = tarfile.TarInfo(f"data/admin/files/dir_{i // 500}/file_{i}.txt")
+            info.size = len(payload)
+            tar.addfile(info, io.BytesIO(payload))
+
+
+def peak_memory_of_verification(archive_path):
+    tracemalloc.start()
+    try:
+        stats = nextcloud_restore.verify_archive_stream(archive_path)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return stats, peak
+
+
+def test_memory_flat_regardless_of_file_count():
+    """Peak memory does not grow with the number of members."""
+    print("\nTesting verifier memory use...")
+    work_dir = tempfile.mkdtemp(prefix="stream_verify_mem_")
+    try:
+        small = os.path.join(work_dir, "small.tar.gz")
+        large = os.path.join(work_dir, "large.tar.gz")
+        write_backup(small, 2000)
+        write_backup(large, 20000)
+        small_stats, small_peak = peak_memory_of_verification(small)
+        large_stats, large_peak = peak_memory_of_verification(large)
+        assert small_stats['files'] == 2001 and large_stats['files'] == 20001
+        assert large_stats['has_config'] and large_stats['has_data']
+        # Keeping a TarInfo per member would add several MB for 18000 extra files
+        assert large_peak - small_peak < 1024 * 1024, (small_peak, large_peak)
+        print(f"  ✓ Peak {small_peak // 1024} KiB for 2k files, {large_peak // 1024} KiB for 20k files")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def test_corrupted_payload_is_detected():
+    """A damaged byte inside a file's data fails verification."""
+    print("\nTesting corruption inside a member...")
+    work_dir = tempfile.mkdtemp(prefix="stream_verify_corrupt_")
+    try:
+        archive_path = os.path.join(work_dir, "nextcloud-backup-test.tar.gz")
+        write_backup(archive_path, 10, big_file_size=2 * 1024 * 1024)
+        status, details = nextcloud_restore.verify_backup_integrity(archive_path)
+        assert status == 'success', details
+
+        with open(archive_path, 'r+b') as f:
+            f.seek(os.path.getsize(archive_path) // 2)
+            byte = f.read(1)
+            f.seek(-1, os.SEEK_CUR)
+            f.write(bytes([byte[0] ^ 0xFF]))
+        status, details = nextcloud_restore.verify_backup_integrity(archive_path)
+        assert status == 'error', (status, details)
+        print(f"  ✓ Rejected: {details}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def test_encrypted_backup_verified_without_temp_file():
+    """Encrypted backups are verified through a gpg pipe; a wrong password is an error."""
+    print("\nTesting encrypted verification...")
+    if not GPG_AVAILABLE:
+        print("  - Skipped: gpg not installed")
+        return
+    work_dir = tempfile.mkdtemp(prefix="stream_verify_gpg_")
+    original_mktemp = tempfile.mktemp
+    try:
+        plain_path = os.path.join(work_dir, "nextcloud-backup-test.tar.gz")
+        write_backup(plain_path, 100)
+        encrypted_path = plain_path + ".gpg"
+        nextcloud_restore.encrypt_file_gpg(plain_path, encrypted_path, PASSWORD)
+        os.remove(plain_path)
+
+        def no_mktemp(*args, **kwargs):
+            raise AssertionError("verification must not create a temporary decrypted file")
+        tempfile.mktemp = no_mktemp
+
+        status, details = nextcloud_restore.verify_backup_integrity(encrypted_path, PASSWORD)
+        assert status == 'success', details
+        assert "101 files" in details, details
+        assert os.listdir(work_dir) == ["nextcloud-backup-test.tar.gz.gpg"]
+
+        status, details = nextcloud_restore.verify_backup_integrity(encrypted_path, "wrong password")
+        assert status == 'error' and "incorrect password" in details, details
+
+        with open(encrypted_path, 'r+b') as f:
+            f.truncate(os.path.getsize(encrypted_path) - 100)
+        status, details = nextcloud_restore.verify_backup_integrity(encrypted_path, PASSWORD)
+        assert status == 'error', (status, details)
+        print(f"  ✓ Verified encrypted backup in-stream; truncated copy rejected: {details}")
+    finally:
+        tempfile.mktemp = original_mktemp
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_memory_flat_regardless_of_file_count()
+    test_corrupted_payload_is_detected()
+    test_encrypted_backup_verified_without_temp_file()
+    print("\n✅ All streaming verification tests passed")
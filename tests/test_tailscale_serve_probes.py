@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Test suite for the concurrent Tailscale Serve health probes.
+Verifies that `tailscale serve status` and the Tailscale IP / MagicDNS probes run
+concurrently under one deadline, that each probed host keeps one HTTP connection
+across health checks, that every check reports its latency, that redirects and client
+errors count as reachable, and that results are reported as each check completes.
+
+HTTPS is replaced by plain HTTP to a local server that answers for both hosts.
+"""
+
+import os
+import sys
+import time
+import threading
+import subprocess
+import http.client
+import http.server
+
+# Import the module using importlib to handle the dash in filename
+import importlib.util
+spec = importlib.util.spec_from_file_location(
+    "nextcloud_restore",
+    os.path.join(os.path.dirname(__file__), "../src/nextcloud_restore_and_backup-v9.py")
+)
+nextcloud_restore = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(nextcloud_restore)
+
+TS_IP = "100.64.0.7"
+TS_HOSTNAME = "cloud.tail1234.ts.net"
+
+
+class ServeHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        host = self.headers['Host']
+        self.server.requests.append(host)
+        time.sleep(self.server.delays.get(host, 0))
+        self.send_response(self.server.status)
+        if 300 <= self.server.status < 400:
+            self.send_header('Location', '/login')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+class FakeTailnet:
+    """Local server standing in for Tailscale Serve on both the IP and the MagicDNS name."""
+
+    def __init__(self, delays=None, serve_delay=0.0, status=302):
+        self.delays = delays or {}
+        self.serve_delay = serve_delay
+        self.status = status
+
+    def __enter__(self):
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), ServeHandler)
+        self.server.daemon_threads = True
+        self.server.connections = 0
+        self.server.requests = []
+        self.server.delays = self.delays
+        self.server.status = self.status
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        local_port = self.server.server_address[1]
+        serve_delay = self.serve_delay
+
+        class LocalConnection(http.client.HTTPConnection):
+            def __init__(self, host, timeout=None, context=None):
+                super().__init__('127.0.0.1', local_port, timeout=timeout)
+                self.probed_host = host
+
+            def putheader(self, header, *values):
+                if header.lower() == 'host':
+                    values = (self.probed_host,)
+                super().putheader(header, *values)
+
+        def run(cmd, **kwargs):
+            time.sleep(serve_delay)
+            return subprocess.CompletedProcess(cmd, 0, f"https://{TS_HOSTNAME} (tailnet only)\n"
+                                                       "|-- / proxy http://127.0.0.1:8080\n", "")
+        self.original = (http.client.HTTPSConnection, subprocess.run, nextcloud_restore.platform.system)
+        http.client.HTTPSConnection = LocalConnection
+        subprocess.run = run
+        nextcloud_restore.platform.system = lambda: "Linux"
+        nextcloud_restore._tailscale_probe_connections.clear()
+        return self
+
+    def __exit__(self, *exc):
+        http.client.HTTPSConnection, subprocess.run, nextcloud_restore.platform.system = self.original
+        for conn in nextcloud_restore._tailscale_probe_connections.values():
+            conn.close()
+        nextcloud_restore._tailscale_probe_connections.clear()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def test_probes_run_concurrently_with_latency():
+    """Three 0.5 s checks take about 0.5 s together; each reports its latency."""
+    print("\nTesting concurrent probes...")
+    with FakeTailnet(delays={TS_IP: 0.5, TS_HOSTNAME: 0.5}, serve_delay=0.5):
+        start = time.perf_counter()
+        result = nextcloud_restore.check_tailscale_serve_health(TS_IP, TS_HOSTNAME, 8080)
+        elapsed = time.perf_counter() - start
+    checks = result['checks']
+    assert list(checks) == ['serve_running', 'port_mapped', 'ip_accessible', 'hostname_accessible']
+    assert result['overall_status'] == 'success', checks
+    assert "accessible via HTTPS" in checks['ip_accessible']['message']
+    assert all(450 <= checks[name]['latency_ms'] < 1500
+               for name in ('serve_running', 'ip_accessible', 'hostname_accessible')), checks
+    assert elapsed < 1.2, f"checks took {elapsed:.2f}s (serial would be 1.5s)"
+    print(f"  ✓ 3 checks in {elapsed:.2f}s; latencies "
+          f"{[checks[name]['latency_ms'] for name in checks]}")
+
+
+def test_one_connection_per_host_is_reused():
+    """A second health check reuses the connections opened by the first."""
+    print("\nTesting connection reuse...")
+    with FakeTailnet() as tailnet:
+        for _ in range(3):
+            result = nextcloud_restore.check_tailscale_serve_health(TS_IP, TS_HOSTNAME, 8080)
+            assert result['overall_status'] == 'success'
+        assert sorted(tailnet.server.requests) == sorted([TS_IP, TS_HOSTNAME] * 3)
+        assert tailnet.server.connections == 2, f"{tailnet.server.connections} connections for 6 probes"
+    print("  ✓ 6 probes over 2 connections")
+
+
+def test_results_stream_and_deadline():
+    """Fast checks are reported first; a probe past the shared deadline is reported as timed out."""
+    print("\nTesting streaming and deadline...")
+    original_deadline = nextcloud_restore.TAILSCALE_HEALTH_DEADLINE
+    nextcloud_restore.TAILSCALE_HEALTH_DEADLINE = 1
+    reported = []
+    try:
+        with FakeTailnet(delays={TS_HOSTNAME: 3}):
+            start = time.perf_counter()
+            result = nextcloud_restore.check_tailscale_serve_health(
+                TS_IP, TS_HOSTNAME, 8080, on_check=lambda name, check: reported.append((name, time.perf_counter() - start)))
+            elapsed = time.perf_counter() - start
+        assert [name for name, _ in reported][-1] == 'hostname_accessible'
+        assert all(at < 0.5 for name, at in reported if name != 'hostname_accessible'), reported
+        assert not result['checks']['hostname_accessible']['status']
+        assert "timed out" in result['checks']['hostname_accessible']['message']
+        assert result['checks']['ip_accessible']['status'] and result['overall_status'] == 'warning'
+        assert elapsed < 2.0, f"waited {elapsed:.2f}s for a 1 s deadline"
+        print(f"  ✓ {len(reported)} results streamed; slow probe cut off at {elapsed:.2f}s")
+    finally:
+        nextcloud_restore.TAILSCALE_HEALTH_DEADLINE = original_deadline
+
+
+def test_any_answer_but_gateway_errors_is_reachable():
+    """Redirects (not followed) and client errors count as reachable; 502/504 do not."""
+    print("\nTesting response codes...")
+    for status, reachable in ((301, True), (307, True), (308, True), (401, True), (405, True),
+                              (502, False), (504, False)):
+        with FakeTailnet(status=status):
+            result = nextcloud_restore.check_tailscale_serve_health(TS_IP, TS_HOSTNAME, 8080)
+        for name in ('ip_accessible', 'hostname_accessible'):
+            assert result['checks'][name]['status'] == reachable, (status, result['checks'][name])
+    print("  ✓ 3xx and 4xx reachable; gateway errors reported")
+
+
+def test_page_shows_results_as_they_complete():
+    """The Tailscale page redraws the results after each completed check."""
+    print("\nTesting page wiring...")
+    src_path = os.path.join(os.path.dirname(__file__), "../src/nextcloud_restore_and_backup-v9.py")
+    with open(src_path, 'r') as f:
+        content = f.read()
+    start = content.find('def _run_health_check(')
+    method = content[start:content.find('\n    def ', start + 10)]
+    assert "check_tailscale_serve_health(ts_ip, ts_hostname, port, on_check=on_check)" in method
+    assert "self.progress_bus.post('tailscale_health', snapshot)" in method
+    assert "self.progress_bus.subscribe('tailscale_health', on_result)" in method
+    assert "self.after(" not in method, "worker threads must not call Tk"
+    start = content.find('def _add_check_result(')
+    method = content[start:content.find('\n    def ', start + 10)]
+    assert "if check_result is None:" in method and "latency_ms" in method
+    print("  ✓ Partial results displayed with per-check latency")
+
+
+if __name__ == "__main__":
+    test_probes_run_concurrently_with_latency()
+    test_one_connection_per_host_is_reused()
+    test_results_stream_and_deadline()
+    test_any_answer_but_gateway_errors_is_reachable()
+    test_page_shows_results_as_they_complete()
+    print("\n✅ All Tailscale Serve probe tests passed")
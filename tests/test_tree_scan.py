@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Test suite for the single-pass tree scan used to plan restore copies.
+Verifies that TreeScan reports the same files, sizes and directories as os.walk,
+that its entries can be consumed while the scan is still running, and that the
+restore thread sizes, counts and copies folders from one scan.
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import threading
+
+# Import the module using importlib to handle the dash in filename
+import importlib.util
+spec = importlib.util.spec_from_file_location(
+    "nextcloud_restore",
+    os.path.join(os.path.dirname(__file__), "../src/nextcloud_restore_and_backup-v9.py")
+)
+nextcloud_restore = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(nextcloud_restore)
+
+
+def create_tree(file_count=300):
+    """Create a nested folder with files of different sizes, an empty directory and a symlink."""
+    root = tempfile.mkdtemp(prefix="tree_scan_")
+    os.makedirs(os.path.join(root, "admin", "files", "empty"))
+    for i in range(file_count):
+        folder = os.path.join(root, "admin", "files", f"dir_{i % 11}", f"sub_{i % 3}")
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, f"file_{i}.txt"), "wb") as f:
+            f.write(b"x" * i)
+    os.symlink("admin", os.path.join(root, "link"))
+    return root
+
+
+def walk_summary(root):
+    """(files {rel_path: size}, directories) as seen by os.walk; symlinks count as files."""
+    files, directories = {}, set()
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in dirnames + filenames:
+            path = os.path.join(dirpath, name)
+            rel_path = os.path.relpath(path, root).replace(os.sep, '/')
+            if os.path.isdir(path) and not os.path.islink(path):
+                directories.add(rel_path)
+            else:
+                files[rel_path] = os.lstat(path).st_size
+    return files, directories
+
+
+def test_scan_matches_os_walk():
+    """Totals, file list and directory list agree with os.walk; parents come first."""
+    print("\nTesting tree scan totals...")
+    root = create_tree()
+    try:
+        scan = nextcloud_restore.TreeScan(root).scan()
+        expected_files, expected_dirs = walk_summary(root)
+        files = {rel: size for _, rel, size in scan.iter_files()}
+        assert files == expected_files
+        assert scan.file_count == len(expected_files)
+        assert scan.total_bytes == sum(expected_files.values())
+        assert set(scan.directories) == expected_dirs
+        for i, directory in enumerate(scan.directories):
+            if '/' in directory:
+                assert scan.directories.index(directory.rsplit('/', 1)[0]) < i
+        print(f"  ✓ {scan.file_count} files, {len(scan.directories)} directories, {scan.total_bytes} bytes")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def test_files_consumed_while_scanning():
+    """iter_files yields the first entries before the scan has finished."""
+    print("\nTesting incremental consumption...")
+    root = create_tree()
+    release = threading.Event()
+
+    class PausingScan(nextcloud_restore.TreeScan):
+        NOTIFY_EVERY = 10
+
+        def _publish(self, count):
+            super()._publish(count)
+            release.wait(10)
+
+    try:
+        scan = PausingScan(root).start()
+        files = scan.iter_files()
+        first = [next(files) for _ in range(10)]
+        assert not scan.done.is_set(), "entries should be readable before the scan completes"
+        release.set()
+        rest = list(files)
+        assert scan.done.is_set()
+        assert len(first) + len(rest) == scan.file_count == 301
+        print(f"  ✓ {len(first)} files consumed before the scan finished")
+    finally:
+        release.set()
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def test_several_folders_scanned_in_background():
+    """start_tree_scans scans folders in order in one background thread."""
+    print("\nTesting background scans...")
+    root = create_tree(file_count=50)
+    try:
+        folders = [os.path.join(root, "admin", "files", f"dir_{i}") for i in range(3)]
+        scans = nextcloud_restore.start_tree_scans(folders)
+        counts = [scans[folder].wait().file_count for folder in folders]
+        assert counts == [sum(len(files) for _, _, files in os.walk(folder)) for folder in folders]
+        print(f"  ✓ File counts {counts}")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def test_restore_thread_uses_one_scan():
+    """The restore thread no longer walks each folder separately for sizes and counts."""
+    print("\nTesting restore thread source...")
+    src_path = os.path.join(os.path.dirname(__file__), "../src/nextcloud_restore_and_backup-v9.py")
+    with open(src_path, 'r') as f:
+        content = f.read()
+    start = content.find('def _restore_auto_thread(')
+    end = content.find('\n    def ', start + 100)
+    method = content[start:end]
+    assert "os.walk(" not in method
+    assert "start_tree_scans(" in method and "scan=folder_scan" in method
+    print("  ✓ Sizing, counting and copying share one scan")
+
+
+if __name__ == "__main__":
+    test_scan_matches_os_walk()
+    test_files_consumed_while_scanning()
+    test_several_folders_scanned_in_background()
+    test_restore_thread_uses_one_scan()
+    print("\n✅ All tree scan tests passed")
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Test suite for batched trusted-domain updates.
+Verifies that trusted_domains edits are queued in memory and written with a single
+`occ config:import` call however many domains change, that unchanged batches cost no
+call, that failures are reported and leave the batch pending, and that the wizard's
+domain helpers go through that one call.
+"""
+
+import os
+import sys
+import json
+import subprocess
+
+# Import the module using importlib to handle the dash in filename
+import importlib.util
+spec = importlib.util.spec_from_file_location(
+    "nextcloud_restore",
+    os.path.join(os.path.dirname(__file__), "../src/nextcloud_restore_and_backup-v9.py")
+)
+nextcloud_restore = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(nextcloud_restore)
+
+
+class FakeOcc:
+    """Stands in for docker_exec: records occ calls and keeps trusted_domains in memory."""
+
+    def __init__(self, domains, fail=False):
+        self.domains = list(domains)
+        self.fail = fail
+        self.calls = []
+
+    def __enter__(self):
+        self.original = nextcloud_restore.docker_exec
+
+        def exec_(container_name, cmd, input=None, timeout=None, user=None):
+            self.calls.append((container_name, cmd, user))
+            if self.fail:
+                return subprocess.CompletedProcess(cmd, 1, b'', b'Nextcloud is not installed\n')
+            self.domains = json.loads(input.decode('utf-8'))['system']['trusted_domains']
+            return subprocess.CompletedProcess(cmd, 0, b'Config successfully imported\n', b'')
+        nextcloud_restore.docker_exec = exec_
+        return self
+
+    def __exit__(self, *exc):
+        nextcloud_restore.docker_exec = self.original
+
+
+def test_batch_is_one_call():
+    """Twenty adds and a remove are written with one occ call."""
+    print("\nTesting batched transaction...")
+    with FakeOcc(['localhost']) as occ:
+        transaction = nextcloud_restore.TrustedDomainTransaction('nc-app', occ.domains)
+        added = [f"host{i}.tail1234.ts.net" for i in range(20)]
+        assert all(transaction.add(domain) for domain in added)
+        assert not transaction.add('host0.tail1234.ts.net')
+        assert transaction.remove('localhost') and not transaction.remove('localhost')
+        assert transaction.commit() == (True, None)
+        assert occ.domains == added
+        assert len(occ.calls) == 1
+        container, cmd, user = occ.calls[0]
+        assert container == 'nc-app' and user == nextcloud_restore.NEXTCLOUD_OCC_USER
+        assert cmd == ['php', '/var/www/html/occ', 'config:import']
+        assert transaction.commit() == (True, None) and len(occ.calls) == 1, "unchanged batch is not written"
+    print("  ✓ 21 edits, 1 docker exec")
+
+
+def test_failed_commit_reports_error():
+    """A failing occ call returns its message and leaves the batch pending."""
+    print("\nTesting failed commit...")
+    with FakeOcc(['localhost'], fail=True):
+        transaction = nextcloud_restore.TrustedDomainTransaction('nc-app', ['localhost'])
+        transaction.add('cloud.example.com')
+        success, error = transaction.commit()
+        assert not success and error == 'Nextcloud is not installed'
+        assert transaction.changed() and transaction.base == ['localhost']
+    print("  ✓ Error surfaced, nothing marked as written")
+
+
+def test_wizard_helpers_use_transactions():
+    """Add, remove and bulk update build one transaction each; nothing rewrites config.php."""
+    print("\nTesting wizard helpers...")
+    src_path = os.path.join(os.path.dirname(__file__), "../src/nextcloud_restore_and_backup-v9.py")
+    with open(src_path, 'r') as f:
+        content = f.read()
+    for name in ('_add_trusted_domain', '_remove_trusted_domain', '_update_trusted_domains'):
+        start = content.find(f'def {name}(')
+        method = content[start:content.find('\n    def ', start + 10)]
+        assert method.count('TrustedDomainTransaction(') == 1, name
+        assert 'self._commit_domain_transaction(transaction' in method, name
+        assert 'domain_change_history' not in method, f"{name} records history only after writing"
+    start = content.find('def _set_trusted_domains(')
+    method = content[start:content.find('\n    def ', start + 10)]
+    assert 'apply_trusted_domains(container_name, domains_list)' in method
+    assert 'EOFCONFIG' not in content and '"cat", "/var/www/html/config/config.php"' not in content
+    print("  ✓ Domain helpers write through one occ call")
+
+
+if __name__ == "__main__":
+    test_batch_is_one_call()
+    test_failed_commit_reports_error()
+    test_wizard_helpers_use_transactions()
+    print("\n✅ All trusted domain transaction tests passed")